@@ -0,0 +1,136 @@
+"""
+Latency of the agent with recorded model responses, without network access.
+
+Writes a recording of two steps per question, a query of the detections and
+the final answer, with the given model latencies, or replays an existing
+recording, then answers concurrent questions with the full agent: the schema
+summary, the sandboxed SQL tool, the checkpointer, the streaming callbacks and
+the concurrency limit of the model. Reports the time to the first answer token
+and to the end of the answer, the wait for the model and the prompt tokens.
+
+    python benchmarks/agent_latency.py --questions 16 --concurrency 2
+    python benchmarks/agent_latency.py --recording recording.jsonl --speed 10
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from typing import Dict, List
+
+from chat_load import AGENT_QUERY, QUESTIONS, TABLE, detections
+
+
+def write_recording(path: Path, first_token: float, seconds: float) -> None:
+    with path.open('w') as file:
+        for question in QUESTIONS:
+            file.write(json.dumps({
+                "question": question, "step": 0, "content": "",
+                "tool_calls": [{"name": "sql_db_query", "args": {"query": AGENT_QUERY},
+                                "id": "call-0"}],
+                "first_token_seconds": first_token, "seconds": first_token,
+            }) + "\n")
+            file.write(json.dumps({
+                "question": question, "step": 1,
+                "content": "Final Answer: " + " ".join(["The player with tracker id 7"] * 12),
+                "tool_calls": [], "first_token_seconds": first_token, "seconds": seconds,
+            }) + "\n")
+
+
+def summary(values: List[float]) -> Dict[str, float]:
+    values = sorted(values)
+    return {
+        "p50": statistics.median(values),
+        "p95": values[min(len(values) - 1, int(0.95 * len(values)))],
+        "max": values[-1],
+    }
+
+
+async def ask(sql_rag, paths: Dict[str, str], index: int, report: Dict) -> None:
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    start = time.perf_counter()
+    first_token = None
+
+    async def on_token(token: str):
+        nonlocal first_token
+        if first_token is None:
+            first_token = time.perf_counter() - start
+
+    async def on_answer():
+        pass
+
+    agent = sql_rag.SQLAgentLanggraph(
+        detection_db_path=paths['detections'],
+        service='recorded',
+        project_id='project-0',
+        video_id='video-0',
+        final_answer_pre_callback=on_answer,
+        token_callback=on_token,
+    )
+    agent.memory_async = AsyncSqliteSaver.from_conn_string(paths['memory'])
+    await agent.process_question(QUESTIONS[index % len(QUESTIONS)], 'benchmark')
+    report['first_token'].append(first_token or float('nan'))
+    report['answer'].append(time.perf_counter() - start)
+    report['prompt_tokens'].append(sum(agent.stream_handler.prompt_tokens))
+
+
+async def main(args, paths: Dict[str, str]) -> Dict:
+    from rag import llm, sql_rag
+
+    report = {"first_token": [], "answer": [], "prompt_tokens": []}
+    start = time.perf_counter()
+    await asyncio.gather(*(ask(sql_rag, paths, index, report) for index in range(args.questions)))
+    elapsed = time.perf_counter() - start
+    queue = llm.LLM_QUEUE_SECONDS
+    return {
+        "questions": args.questions,
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "first_answer_token_seconds": summary(report["first_token"]),
+        "answer_seconds": summary(report["answer"]),
+        "prompt_tokens_per_question": statistics.median(report["prompt_tokens"]),
+        "queue_wait_seconds": {
+            "sum": sum(queue.sums.values()),
+            "count": sum(counts[-1] for counts in queue.counts.values())},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--questions", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--recording", default="")
+    # latencies of the written recording and the factor of the replay
+    parser.add_argument("--first-token", type=float, default=0.4)
+    parser.add_argument("--seconds", type=float, default=1.5)
+    parser.add_argument("--speed", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        recording = Path(args.recording) if args.recording else directory / 'recording.jsonl'
+        if not args.recording:
+            write_recording(recording, args.first_token, args.seconds)
+        # read by the model and its gate when they are imported
+        os.environ["LLM_RECORDING"] = recording.as_posix()
+        os.environ["LLM_REPLAY_SPEED"] = str(args.speed)
+        os.environ["LOCAL_LLM_CONCURRENCY"] = str(args.concurrency)
+
+        from sqlalchemy import create_engine
+        paths = {
+            "detections": (directory / 'detections.db').as_posix(),
+            "memory": (directory / 'memory.db').as_posix(),
+        }
+        engine = create_engine(f"sqlite:///{paths['detections']}")
+        with engine.begin() as conn:
+            detections('project-0', 'video-0', 750).to_sql(TABLE, conn, index=False)
+        engine.dispose()
+
+        print(json.dumps(asyncio.run(main(args, paths)), indent=2))
@@ -0,0 +1,91 @@
+"""
+Memory allocated per frame by the radar annotation, before and after the
+in-place compositor.
+
+Annotates synthetic 1080p frames with random tracked detections, once by copying
+the frame and rendering, resizing and blending a new radar per frame, and once
+in place with the RadarOverlay, and reports tracemalloc peaks and timings.
+
+    python benchmarks/annotation.py --frames 100 --detections 25
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+import supervision as sv
+
+from rag.services import COLORS, CONFIG, annotate_tracks
+from sports.annotators.compositor import RadarOverlay
+from sports.annotators.soccer import draw_pitch, draw_points_on_pitch
+
+
+def copy_and_blend(frame, detections, pitch_xy, color_lookup) -> np.ndarray:
+    # the per-frame allocations of the pipelines before the compositor
+    annotated_frame = annotate_tracks(frame.copy(), detections, color_lookup)
+    radar = draw_pitch(config=CONFIG)
+    for color_id, color in enumerate(COLORS):
+        radar = draw_points_on_pitch(
+            config=CONFIG, xy=pitch_xy[color_lookup == color_id],
+            face_color=sv.Color.from_hex(color), radius=20, pitch=radar)
+    h, w, _ = frame.shape
+    radar = sv.resize_image(radar, (w // 2, h // 2))
+    radar_h, radar_w, _ = radar.shape
+    rect = sv.Rect(x=w // 2 - radar_w // 2, y=h - radar_h, width=radar_w, height=radar_h)
+    return sv.draw_image(annotated_frame, radar, opacity=0.5, rect=rect)
+
+
+def in_place(overlay: RadarOverlay):
+    def annotate(frame, detections, pitch_xy, color_lookup) -> np.ndarray:
+        annotated_frame = annotate_tracks(frame, detections, color_lookup)
+        return overlay.annotate(annotated_frame, pitch_xy, color_lookup)
+    return annotate
+
+
+def measure(annotate, frames: int, count: int) -> dict:
+    rng = np.random.default_rng(0)
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    # warm up buffers and caches outside of the measurement
+    inputs = []
+    for _ in range(frames + 1):
+        xy = rng.uniform([0, 0], [1800, 1000], size=(count, 2))
+        detections = sv.Detections(
+            xyxy=np.hstack([xy, xy + 80]).astype(np.float32),
+            class_id=rng.integers(1, 4, size=count),
+            tracker_id=np.arange(count),
+        )
+        pitch_xy = rng.uniform([0, 0], [CONFIG.length, CONFIG.width], size=(count, 2))
+        inputs.append((detections, pitch_xy, rng.integers(0, 4, size=count)))
+    annotate(frame, *inputs[0])
+
+    tracemalloc.start()
+    peaks, start = [], time.perf_counter()
+    for detections, pitch_xy, color_lookup in inputs[1:]:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        annotate(frame, detections, pitch_xy, color_lookup)
+        peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    return {
+        "peak_kib_per_frame": float(np.mean(peaks)) / 1024,
+        "ms_per_frame": 1000 * elapsed / frames,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--detections", type=int, default=25)
+    args = parser.parse_args()
+
+    print(json.dumps({
+        "copy_and_blend": measure(copy_and_blend, args.frames, args.detections),
+        "in_place": measure(
+            in_place(RadarOverlay(CONFIG, COLORS)), args.frames, args.detections),
+    }, indent=2))
@@ -0,0 +1,101 @@
+"""
+Parity check and throughput of the inference backends.
+
+Runs the player detection model and the SigLIP encoder on every backend and
+compares their outputs against the TORCH backend. Exits with a non-zero status
+when a backend drifts beyond the tolerances.
+
+    python benchmarks/backends.py path/to/clip.mp4 --backends TORCH ONNX --int8
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import time
+from itertools import islice
+
+import numpy as np
+import supervision as sv
+
+from benchmarks.keyframes import match_boxes
+from rag.services import PLAYER_DETECTION_MODEL_PATH
+from sports.common.backends import Backend, load_siglip_encoder, load_yolo
+from sports.common.team import SIGLIP_MODEL_PATH
+
+MIN_RECALL = 0.95
+MIN_COSINE = 0.99
+
+
+def run(source_video_path: str, backends, frames: int, int8: bool) -> dict:
+    video_frames = list(islice(
+        sv.get_video_frames_generator(source_path=source_video_path), frames))
+    report = {"source": source_video_path, "frames": len(video_frames), "backends": {}}
+
+    # SigLIP inputs are normalized to [-1, 1]
+    pixel_values = np.random.default_rng(0).random(
+        (32, 3, 224, 224), dtype=np.float32) * 2 - 1
+
+    detections, embeddings = {}, {}
+    for backend in backends:
+        model = load_yolo(PLAYER_DETECTION_MODEL_PATH, backend=backend, int8=int8)
+        start = time.perf_counter()
+        detections[backend] = [
+            sv.Detections.from_ultralytics(model(frame, imgsz=1280, verbose=False)[0])
+            for frame in video_frames
+        ]
+        detection_fps = len(video_frames) / (time.perf_counter() - start)
+
+        encoder = load_siglip_encoder(SIGLIP_MODEL_PATH, backend=backend, int8=int8)
+        start = time.perf_counter()
+        embeddings[backend] = encoder(pixel_values)
+        crops_per_second = len(pixel_values) / (time.perf_counter() - start)
+
+        report["backends"][str(backend)] = {
+            "detection_fps": detection_fps,
+            "siglip_crops_per_second": crops_per_second,
+        }
+
+    failed = False
+    for backend in backends:
+        total, ious = 0, []
+        for expected, actual in zip(detections[Backend.TORCH], detections[backend]):
+            count, matched = match_boxes(expected, actual, iou_threshold=0.5)
+            total += count
+            ious += matched
+        a, b = embeddings[Backend.TORCH], embeddings[backend]
+        cosine = np.sum(a * b, axis=1) / (
+            np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+        parity = {
+            "detection_recall": len(ious) / total if total else 1.0,
+            "detection_mean_iou": float(np.mean(ious)) if ious else 0.0,
+            "siglip_min_cosine": float(cosine.min()),
+        }
+        parity["passed"] = bool(
+            parity["detection_recall"] >= MIN_RECALL
+            and parity["siglip_min_cosine"] >= MIN_COSINE
+        )
+        failed = failed or not parity["passed"]
+        report["backends"][str(backend)].update(parity)
+
+    report["passed"] = not failed
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source_video_path")
+    parser.add_argument(
+        "--backends", nargs="+", default=[str(backend) for backend in Backend])
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--int8", action="store_true")
+    args = parser.parse_args()
+
+    backends = [Backend.TORCH] + [
+        Backend(name.upper()) for name in args.backends
+        if Backend(name.upper()) != Backend.TORCH
+    ]
+    report = run(args.source_video_path, backends, args.frames, args.int8)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["passed"] else 1)
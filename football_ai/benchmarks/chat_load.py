@@ -0,0 +1,229 @@
+"""
+Concurrent chat load on the detections and memory databases.
+
+Simulated chat sessions read the message history and run fast path and, when
+langchain is installed, sandboxed agent queries, while a job appends detections
+in a background thread. Reports the latency of the turns, the stalls of the
+event loop and the failed writes, either through the pooled, thread-offloaded
+access layer or with blocking calls on the event loop and an engine per request
+as the server did before.
+
+    python benchmarks/chat_load.py --sessions 32 --turns 20
+    python benchmarks/chat_load.py --mode blocking
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import asyncio
+import json
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from rag.answer_cache import bump_versions
+from rag.database import get_engine, run_sync
+from rag.history import SQLMessageHistory
+from rag.router import FastPathRouter
+
+TABLE = 'PLAYER_TRACKING'
+QUESTIONS = [
+    "Which player ran the most?",
+    "How many players are there?",
+    "Which player was visible the longest?",
+    "How long is the video?",
+]
+AGENT_QUERY = (
+    f"SELECT tracker_id, COUNT(*) FROM {TABLE} "
+    "WHERE class_name = 'player' GROUP BY tracker_id ORDER BY 2 DESC LIMIT 5")
+
+
+def detections(project_id: str, video_id: str, frames: int, start: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(start)
+    frame = np.repeat(np.arange(start, start + frames), 22)
+    tracker_id = np.tile(np.arange(22), frames)
+    x = rng.uniform(0, 1800, len(frame))
+    y = rng.uniform(0, 1000, len(frame))
+    return pd.DataFrame({
+        'project': project_id, 'video_id': video_id, 'frame': frame,
+        'tracker_id': tracker_id, 'class_name': 'player', 'confidence': 0.9,
+        'x_min': x, 'y_min': y, 'x_max': x + 40, 'y_max': y + 80,
+    })
+
+
+def make_databases(directory: Path, videos: int, frames: int, messages: int) -> Dict[str, str]:
+    detection_db = directory / 'detections.db'
+    memory_db = directory / 'memory.db'
+    engine = create_engine(f"sqlite:///{detection_db.as_posix()}")
+    with engine.begin() as conn:
+        for index in range(videos):
+            detections('project-0', f'video-{index}', frames).to_sql(
+                TABLE, conn, index=False, if_exists='append')
+    engine.dispose()
+
+    with sqlite3.connect(memory_db) as conn:
+        conn.execute(
+            "CREATE TABLE checkpoints (thread_id TEXT, checkpoint_ns TEXT DEFAULT '', "
+            "checkpoint_id TEXT, parent_checkpoint_id TEXT, type TEXT, "
+            "checkpoint BLOB, metadata BLOB)")
+        rows = []
+        for index in range(messages):
+            if index % 2:
+                metadata = {"source": "loop", "session_id": "project-0", "writes": {"agent": {
+                    "messages": [{"kwargs": {"content": f"Final Answer: answer {index}",
+                                             "response_metadata": {"finish_reason": "STOP"},
+                                             "tool_calls": []}}]}}}
+            else:
+                metadata = {"source": "input", "session_id": "project-0", "sender": "user",
+                            "writes": {"__start__": {"messages": f"question {index}"}}}
+            rows.append(("1", f"{index:08d}", json.dumps(metadata)))
+        conn.executemany(
+            "INSERT INTO checkpoints (thread_id, checkpoint_id, metadata) VALUES (?, ?, ?)", rows)
+    return {"detections": detection_db.as_posix(), "memory": memory_db.as_posix()}
+
+
+async def measure_loop_lag(stop: asyncio.Event, lags: List[float], interval: float = 0.005):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+def write_detections(paths: Dict[str, str], mode: str, stop: threading.Event,
+                     interval: float, frames: int, report: Dict) -> None:
+    start = 10 ** 6
+    while not stop.wait(interval):
+        df = detections('project-0', 'video-0', frames, start)
+        began = time.perf_counter()
+        try:
+            if mode == 'pooled':
+                engine = get_engine(paths['detections'])
+            else:
+                engine = create_engine(f"sqlite:///{paths['detections']}")
+            with engine.begin() as conn:
+                df.to_sql(TABLE, conn, index=False, if_exists='append')
+                bump_versions(conn, ['video-0'])
+            report['writes'].append(time.perf_counter() - began)
+        except Exception as e:
+            report['write_errors'].append(str(e).splitlines()[0])
+        start += frames
+
+
+def history_blocking(memory_db: str) -> List[Dict]:
+    # an engine per request, as the endpoint used to do
+    history = SQLMessageHistory('project-0', memory_db)
+    history.raw_memory = create_engine(f"sqlite:///{memory_db}")
+    messages = history.get_history()
+    history.raw_memory.dispose()
+    return messages
+
+
+async def session(index: int, paths: Dict[str, str], mode: str, turns: int,
+                  router: FastPathRouter, sandbox, latencies: Dict[str, List[float]]):
+    video_id = f'video-{index % 4}'
+    for turn in range(turns):
+        question = QUESTIONS[(index + turn) % len(QUESTIONS)]
+
+        start = time.perf_counter()
+        if mode == 'pooled':
+            await SQLMessageHistory('project-0', paths['memory']).aget_history()
+        else:
+            history_blocking(paths['memory'])
+        latencies['history'].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        if mode == 'pooled':
+            await run_sync(router.answer, question, 'project-0', video_id)
+        else:
+            router.answer(question, 'project-0', video_id)
+        latencies['fast_path'].append(time.perf_counter() - start)
+
+        if sandbox is not None:
+            start = time.perf_counter()
+            if mode == 'pooled':
+                await run_sync(sandbox.run_no_throw, AGENT_QUERY)
+            else:
+                sandbox.run_no_throw(AGENT_QUERY)
+            latencies['agent_query'].append(time.perf_counter() - start)
+        # the user reads the answer
+        await asyncio.sleep(0.01)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "p50_ms": 1000 * values[len(values) // 2],
+        "p95_ms": 1000 * values[int(len(values) * 0.95)],
+        "max_ms": 1000 * values[-1],
+        "mean_ms": 1000 * statistics.fmean(values),
+    }
+
+
+async def run_load(paths: Dict[str, str], args) -> Dict:
+    router = FastPathRouter(paths['detections'])
+    try:
+        from rag.sandbox import SandboxedSQLDatabase
+        sandbox = SandboxedSQLDatabase(paths['detections'], 'project-0', 'video-1')
+    except ImportError:
+        sandbox = None
+
+    latencies = {"history": [], "fast_path": [], "agent_query": []}
+    writer_report = {"writes": [], "write_errors": []}
+    stop_writer = threading.Event()
+    writer = threading.Thread(target=write_detections, args=(
+        paths, args.mode, stop_writer, args.write_interval, args.write_frames, writer_report))
+    lags: List[float] = []
+    stop_lag = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop_lag, lags))
+
+    writer.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        session(index, paths, args.mode, args.turns, router, sandbox, latencies)
+        for index in range(args.sessions)))
+    elapsed = time.perf_counter() - start
+    stop_lag.set()
+    await lag_task
+    stop_writer.set()
+    writer.join()
+
+    return {
+        "mode": args.mode,
+        "sessions": args.sessions,
+        "turns": args.sessions * args.turns,
+        "seconds": elapsed,
+        "turns_per_second": args.sessions * args.turns / elapsed,
+        "latency": {name: percentiles(values) for name, values in latencies.items() if values},
+        "event_loop_lag": percentiles(lags),
+        "writes": percentiles(writer_report["writes"]),
+        "write_errors": len(writer_report["write_errors"]),
+        "write_error_examples": sorted(set(writer_report["write_errors"]))[:3],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mode", choices=["pooled", "blocking"], default="pooled")
+    parser.add_argument("--sessions", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--videos", type=int, default=4)
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--write-interval", type=float, default=0.2)
+    parser.add_argument("--write-frames", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = make_databases(Path(directory), args.videos, args.frames, args.messages)
+        print(json.dumps(asyncio.run(run_load(paths, args)), indent=2))
@@ -0,0 +1,51 @@
+"""
+Disk use and query latency of memory.db before and after checkpoint compaction.
+
+Fills a memory database with synthetic agent checkpoints, four per turn: the
+question, a tool call, its result and the final answer, with pending writes for
+the tool steps, compacts it and prints the report.
+
+    python benchmarks/compaction.py --checkpoints 100000 --sessions 20
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import sqlite3
+import tempfile
+from dataclasses import asdict
+
+from history import make_memory_db
+
+from rag.compaction import compact_checkpoints
+
+
+def add_pending_writes(path: Path) -> None:
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE writes (thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL DEFAULT '', "
+            "checkpoint_id TEXT NOT NULL, task_id TEXT NOT NULL, idx INTEGER NOT NULL, "
+            "channel TEXT NOT NULL, type TEXT, value BLOB, "
+            "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))")
+        conn.execute(
+            "INSERT INTO writes SELECT thread_id, checkpoint_ns, checkpoint_id, 'task', 0, "
+            "'messages', 'json', metadata FROM checkpoints")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--checkpoints", type=int, default=100_000)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--keep-recent", type=int, default=10)
+    # the checkpoints hold every message of the thread so far
+    parser.add_argument("--checkpoint-bytes", type=int, default=8192)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        memory_db = Path(directory) / 'memory.db'
+        make_memory_db(memory_db, args.checkpoints, args.sessions, args.checkpoint_bytes)
+        add_pending_writes(memory_db)
+        report = compact_checkpoints(memory_db.as_posix(), args.keep_recent)
+        print(json.dumps(asdict(report), indent=2))
@@ -0,0 +1,63 @@
+"""
+Throughput of a composite job against one job per Service.
+
+Runs each requested Service on its own, then all of them in a single composite
+pass, over the first frames of a clip.
+
+    python benchmarks/composite.py path/to/clip.mp4 --modes PLAYER_DETECTION BALL_DETECTION PLAYER_TRACKING RADAR
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import time
+from itertools import islice
+
+from benchmarks.profiles import PIPELINES
+from rag.composite import run_composite
+from rag.profiles import get_profile
+from rag.services import Service, run_pitch_detection
+
+PIPELINES = {**PIPELINES, Service.PITCH_DETECTION: run_pitch_detection}
+
+
+def run(source_video_path: str, modes, frames: int, device: str) -> dict:
+    profile = get_profile()
+    report = {"source": source_video_path, "frames": frames, "separate": {}}
+
+    separate = 0.0
+    for mode in modes:
+        generator = PIPELINES[mode](source_video_path, device=device, profile=profile)
+        start = time.perf_counter()
+        for _ in islice(generator, frames):
+            pass
+        elapsed = time.perf_counter() - start
+        separate += elapsed
+        report["separate"][str(mode)] = {"seconds": elapsed}
+
+    generator = run_composite(source_video_path, device, modes, profile)
+    start = time.perf_counter()
+    for _ in islice(generator, frames):
+        pass
+    composite = time.perf_counter() - start
+
+    report.update({
+        "separate_seconds": separate,
+        "composite_seconds": composite,
+        "speedup": separate / composite,
+    })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source_video_path")
+    parser.add_argument("--modes", nargs="+", default=[str(service) for service in Service])
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    modes = [Service[mode.upper()] for mode in args.modes]
+    print(json.dumps(run(args.source_video_path, modes, args.frames, args.device), indent=2))
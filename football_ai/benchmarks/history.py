@@ -0,0 +1,137 @@
+"""
+Latency of the chat history with many agent checkpoints.
+
+Fills a memory database with synthetic langgraph checkpoints, several per turn
+as the agent writes them, then times the one-off backfill of the messages
+table, pages of the indexed history and the previous json_extract scan of the
+checkpoints that returned the whole history of a project.
+
+    python benchmarks/history.py --checkpoints 100000 --sessions 20
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import sqlite3
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict
+
+from sqlalchemy import text
+
+from rag.history import FINAL_ANSWER, SQLMessageHistory
+
+# the query of the history before the messages table
+LEGACY_QUERY = """
+    WITH json_data AS (
+        SELECT *,
+            json_extract(metadata, '$.writes.agent.messages[0].kwargs.response_metadata.finish_reason') as finish_reason,
+            json_extract(metadata, '$.writes.agent.messages[0].kwargs.tool_calls') as tool_calls,
+            json_extract(metadata, '$.source') as source,
+            json_extract(metadata, '$.session_id') as session_id,
+            json_extract(metadata, '$.sender') as sender
+        FROM checkpoints
+    )
+    SELECT thread_id, checkpoint_id, metadata, sender, tool_calls
+    FROM json_data
+    WHERE thread_id = 1
+    AND (LOWER(finish_reason) = 'stop' OR source = 'input')
+    AND session_id = :project_id
+    AND (tool_calls IS NULL OR tool_calls = '[]')
+    ORDER BY checkpoint_id DESC
+"""
+
+
+def turn_checkpoints(session_id: str, turn: int):
+    """
+    The checkpoints of one turn: the question, a tool call, its result and the
+    final answer.
+    """
+    agent = lambda content, tool_calls, finish: {"agent": {"messages": [{"kwargs": {
+        "content": content, "tool_calls": tool_calls,
+        "response_metadata": {"finish_reason": finish}}}]}}
+    yield {"source": "input", "session_id": session_id, "sender": "user@example.com",
+           "writes": {"__start__": {"messages": f"question {turn} " + "x" * 80}}}
+    yield {"source": "loop", "session_id": session_id,
+           "writes": agent("", [{"name": "sql_db_query", "args": {"query": "SELECT 1"}}], "STOP")}
+    yield {"source": "loop", "session_id": session_id,
+           "writes": {"tools": {"messages": [{"kwargs": {"content": "[(1,)]" * 50}}]}}}
+    yield {"source": "loop", "session_id": session_id,
+           "writes": agent(f"{FINAL_ANSWER}answer {turn} " + "y" * 300, [], "STOP")}
+
+
+def make_memory_db(
+    path: Path, checkpoints: int, sessions: int, checkpoint_bytes: int = 400
+) -> None:
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE checkpoints (thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL DEFAULT '', "
+            "checkpoint_id TEXT NOT NULL, parent_checkpoint_id TEXT, type TEXT, "
+            "checkpoint BLOB, metadata BLOB, "
+            "PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))")
+        rows, index, turn = [], 0, 0
+        while index < checkpoints:
+            for metadata in turn_checkpoints(str(turn % sessions), turn):
+                rows.append(("1", f"{index:012d}", b"0" * checkpoint_bytes, json.dumps(metadata)))
+                index += 1
+            turn += 1
+        conn.executemany(
+            "INSERT INTO checkpoints (thread_id, checkpoint_id, checkpoint, metadata) "
+            "VALUES (?, ?, ?, ?)", rows[:checkpoints])
+
+
+def timed(fn: Callable, repeat: int) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"median_ms": 1000 * statistics.median(times), "max_ms": 1000 * max(times)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--checkpoints", type=int, default=100_000)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        memory_db = Path(directory) / 'memory.db'
+        make_memory_db(memory_db, args.checkpoints, args.sessions)
+        history = SQLMessageHistory('0', memory_db.as_posix())
+
+        def legacy():
+            with history.raw_memory.connect() as conn:
+                for row in conn.execute(text(LEGACY_QUERY), {"project_id": "0"}):
+                    json.loads(row[2])
+
+        start = time.perf_counter()
+        history.ensure_table()
+        backfill_seconds = time.perf_counter() - start
+        with history.raw_memory.connect() as conn:
+            messages = conn.execute(text("SELECT COUNT(*) FROM chat_messages")).scalar()
+
+        _, cursor = history.get_history(limit=args.page_size)
+        # the last page of the project
+        deep_cursor = None
+        page_cursor = cursor
+        while page_cursor is not None:
+            deep_cursor = page_cursor
+            _, page_cursor = history.get_history(before=int(page_cursor), limit=args.page_size)
+
+        print(json.dumps({
+            "checkpoints": args.checkpoints,
+            "sessions": args.sessions,
+            "messages": messages,
+            "backfill_seconds": backfill_seconds,
+            "first_page": timed(lambda: history.get_history(limit=args.page_size), args.repeat),
+            "last_page": timed(
+                lambda: history.get_history(before=int(deep_cursor), limit=args.page_size),
+                args.repeat) if deep_cursor else None,
+            "legacy_full_history": timed(legacy, max(1, args.repeat // 5)),
+        }, indent=2))
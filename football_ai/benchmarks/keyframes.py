@@ -0,0 +1,104 @@
+"""
+Accuracy and throughput report for keyframe inference.
+
+Runs the player detector on every frame as a reference, then again with the
+adaptive keyframe scheduler, and compares the propagated boxes against the
+reference boxes frame by frame.
+
+    python benchmarks/keyframes.py path/to/clip.mp4 --interval 5 --frames 300
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import time
+from itertools import islice
+from typing import List, Tuple
+
+import numpy as np
+import supervision as sv
+from ultralytics import YOLO
+
+from rag.services import PLAYER_DETECTION_MODEL_PATH
+from sports.common.keyframes import AdaptiveDetector
+
+
+def match_boxes(reference: sv.Detections, candidate: sv.Detections, iou_threshold: float):
+    """
+    Greedily match candidate boxes to reference boxes.
+
+    Returns:
+        Tuple[int, List[float]]: Number of reference boxes and the IoU of every
+            reference box matched above the threshold.
+    """
+    if len(reference) == 0 or len(candidate) == 0:
+        return len(reference), []
+    iou = sv.box_iou_batch(reference.xyxy, candidate.xyxy)
+    best = iou.max(axis=1)
+    return len(reference), best[best >= iou_threshold].tolist()
+
+
+def run(
+    source_video_path: str,
+    interval: int,
+    frames: int,
+    device: str,
+    iou_threshold: float
+) -> dict:
+    model = YOLO(PLAYER_DETECTION_MODEL_PATH).to(device=device)
+
+    def callback(frame: np.ndarray) -> sv.Detections:
+        result = model(frame, imgsz=1280, verbose=False)[0]
+        return sv.Detections.from_ultralytics(result)
+
+    def timed_pass(detector) -> Tuple[List[sv.Detections], float]:
+        generator = sv.get_video_frames_generator(source_path=source_video_path)
+        results = []
+        start = time.perf_counter()
+        for frame in islice(generator, frames):
+            results.append(detector(frame))
+        return results, time.perf_counter() - start
+
+    reference, reference_time = timed_pass(callback)
+    adaptive = AdaptiveDetector(callback=callback, interval=interval)
+    candidate, candidate_time = timed_pass(adaptive)
+
+    total, ious = 0, []
+    for expected, actual in zip(reference, candidate):
+        count, matched = match_boxes(expected, actual, iou_threshold)
+        total += count
+        ious += matched
+
+    return {
+        "source": source_video_path,
+        "frames": len(reference),
+        "interval": interval,
+        "keyframes": adaptive.keyframes,
+        "propagated": adaptive.propagated,
+        "reference_fps": len(reference) / reference_time,
+        "adaptive_fps": len(candidate) / candidate_time,
+        "speedup": reference_time / candidate_time,
+        "recall": len(ious) / total if total else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source_video_path")
+    parser.add_argument("--interval", type=int, default=5)
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--iou-threshold", type=float, default=0.5)
+    args = parser.parse_args()
+
+    report = run(
+        args.source_video_path,
+        interval=args.interval,
+        frames=args.frames,
+        device=args.device,
+        iou_threshold=args.iou_threshold
+    )
+    print(json.dumps(report, indent=2))
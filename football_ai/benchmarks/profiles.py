@@ -0,0 +1,82 @@
+"""
+Throughput and accuracy trade-off of the inference profiles.
+
+Runs a Service pipeline on the first frames of a clip once per profile and
+compares every profile against the ACCURATE detections.
+
+    python benchmarks/profiles.py path/to/clip.mp4 --mode PLAYER_TRACKING --frames 300
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import time
+from itertools import islice
+
+import numpy as np
+
+from benchmarks.keyframes import match_boxes
+from rag.profiles import PROFILES, Profile
+from rag.services import (
+    Service,
+    run_ball_detection,
+    run_player_detection,
+    run_player_tracking,
+    run_radar,
+    run_team_classification,
+)
+
+PIPELINES = {
+    Service.PLAYER_DETECTION: run_player_detection,
+    Service.BALL_DETECTION: run_ball_detection,
+    Service.PLAYER_TRACKING: run_player_tracking,
+    Service.TEAM_CLASSIFICATION: run_team_classification,
+    Service.RADAR: run_radar,
+}
+
+
+def run(source_video_path: str, mode: Service, frames: int, device: str) -> dict:
+    pipeline = PIPELINES[mode]
+    detections = {}
+    report = {"source": source_video_path, "mode": str(mode), "profiles": {}}
+    for name, profile in PROFILES.items():
+        generator = pipeline(source_video_path, device=device, profile=profile)
+        start = time.perf_counter()
+        detections[name] = [
+            frame_detections for _, frame_detections in islice(generator, frames)]
+        elapsed = time.perf_counter() - start
+        report["profiles"][str(name)] = {
+            "imgsz": profile.settings(mode).imgsz,
+            "keyframe_interval": profile.settings(mode).keyframe_interval,
+            "max_resolution": profile.max_resolution,
+            "fps": len(detections[name]) / elapsed,
+        }
+
+    reference = detections[Profile.ACCURATE]
+    for name, candidate in detections.items():
+        total, ious = 0, []
+        for expected, actual in zip(reference, candidate):
+            count, matched = match_boxes(expected, actual, iou_threshold=0.5)
+            total += count
+            ious += matched
+        report["profiles"][str(name)].update({
+            "recall": len(ious) / total if total else 1.0,
+            "mean_iou": float(np.mean(ious)) if ious else 0.0,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source_video_path")
+    parser.add_argument("--mode", default=str(Service.PLAYER_TRACKING))
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    print(json.dumps(
+        run(args.source_video_path, Service[args.mode.upper()], args.frames, args.device),
+        indent=2
+    ))
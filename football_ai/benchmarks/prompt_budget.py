@@ -0,0 +1,91 @@
+"""
+Size of the schema in the agent prompt and the time to build it.
+
+Fills a detections database with the tables of every service for several
+videos, then compares the estimated prompt tokens of the previous schema, the
+DDL and three sample rows of every table with all the column descriptions,
+against the summary of one video, and times the summary cold and cached.
+
+    python benchmarks/prompt_budget.py --videos 20 --frames 750
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+from chat_load import detections
+
+from rag.prompt_budget import SchemaSummaryCache, estimate_tokens
+from rag.prompts import column_descriptions
+from rag.router import DETECTION_TABLES
+
+# rows per table the SQLDatabase of langchain samples into table_info
+SAMPLE_ROWS = 3
+
+
+def legacy_table_info(engine) -> str:
+    # what SQLDatabase.get_table_info gave the prompt, every table of the database
+    parts = []
+    with engine.connect() as conn:
+        for name, sql in conn.execute(text(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'table' ORDER BY name")):
+            rows = conn.execute(text(f'SELECT * FROM "{name}" LIMIT {SAMPLE_ROWS}'))
+            columns = "\t".join(rows.keys())
+            samples = "\n".join("\t".join(str(value)[:100] for value in row) for row in rows)
+            parts.append(
+                f"{sql}\n\n/*\n{SAMPLE_ROWS} rows from {name} table:\n{columns}\n{samples}\n*/")
+    return "\n\n".join(parts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--videos", type=int, default=20)
+    parser.add_argument("--frames", type=int, default=750)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        detection_db = (Path(directory) / 'detections.db').as_posix()
+        engine = create_engine(f"sqlite:///{detection_db}")
+        with engine.begin() as conn:
+            for index in range(args.videos):
+                # a video is analysed by a few services, the composite holds the rest
+                for table in DETECTION_TABLES[index % 3::3]:
+                    df = detections('project-0', f'video-{index}', args.frames, index)
+                    # a segmentation polygon per detection, as the mask column stores
+                    df['mask'] = '[[0, 0], [1, 0], [1, 1], [0, 1]]' * 8
+                    df['interpolated'] = 0
+                    df['profile'] = 'BALANCED'
+                    if table == DETECTION_TABLES[-1]:
+                        df['service'] = 'RADAR'
+                    df.to_sql(table, conn, index=False, if_exists='append')
+
+        legacy = legacy_table_info(engine) + column_descriptions
+        cache = SchemaSummaryCache(detection_db)
+        start = time.perf_counter()
+        summary = cache.get('project-0', 'video-0')
+        cold_ms = 1000 * (time.perf_counter() - start)
+        cached_ms = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            cache.get('project-0', 'video-0')
+            cached_ms.append(1000 * (time.perf_counter() - start))
+
+        print(summary.table_info)
+        print(json.dumps({
+            "videos": args.videos,
+            "tables": len(DETECTION_TABLES),
+            "legacy_tokens": estimate_tokens(legacy),
+            "summary_tables": summary.tables,
+            "summary_tokens": summary.tokens,
+            "summary_compact": summary.compact,
+            "cold_ms": cold_ms,
+            "cached_median_ms": statistics.median(cached_ms),
+        }, indent=2))
@@ -0,0 +1,144 @@
+"""
+Wait of the inference jobs of several tenants, first come first served against
+the fair scheduler.
+
+One tenant uploads a few long videos, the others short clips right after. The
+jobs sleep for their estimated time divided by `--speed`, on the shared pool
+of the previous server and on the scheduler, and the wait of each tenant's
+jobs for a worker is reported. Then more jobs are admitted until the
+scheduler rejects one, to show the position and ETA it returns.
+
+    python benchmarks/scheduler.py --long 3 --short 6 --speed 1000
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from rag.modes import Service
+from rag.profiles import Profile
+from rag.scheduler import AdmissionRejected, InferenceScheduler
+
+# frames of a match segment and of a highlight clip at 25 fps
+LONG_FRAMES = 10 * 60 * 25
+SHORT_FRAMES = 30 * 25
+
+
+def workload(scheduler: InferenceScheduler, args) -> List[Tuple[str, float, object]]:
+    # tenant, arrival in scaled seconds and estimate of each job, in arrival order
+    jobs = [
+        ("club-a", 0.0, scheduler.estimate([Service.RADAR], Profile.ACCURATE, LONG_FRAMES))
+        for _ in range(args.long)]
+    for index in range(args.short):
+        tenant = f"club-{'bc'[index % 2]}"
+        estimate = scheduler.estimate([Service.PLAYER_TRACKING], Profile.BALANCED, SHORT_FRAMES)
+        jobs.append((tenant, 30.0 * (index + 1), estimate))
+    return jobs
+
+
+def summary(waits: Dict[str, List[float]]) -> Dict[str, Dict[str, float]]:
+    return {
+        tenant: {"p50": statistics.median(values), "max": max(values)}
+        for tenant, values in sorted(waits.items())}
+
+
+async def first_come_first_served(jobs, args) -> Tuple[Dict[str, List[float]], float]:
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    loop = asyncio.get_running_loop()
+    waits: Dict[str, List[float]] = {}
+    start = time.perf_counter()
+
+    async def submit(tenant, arrival, estimate):
+        await asyncio.sleep(arrival / args.speed)
+        queued = time.perf_counter()
+
+        def job():
+            waits.setdefault(tenant, []).append(args.speed * (time.perf_counter() - queued))
+            time.sleep(estimate.seconds / args.speed)
+
+        await loop.run_in_executor(pool, job)
+
+    await asyncio.gather(*(submit(*job) for job in jobs))
+    pool.shutdown()
+    return waits, args.speed * (time.perf_counter() - start)
+
+
+async def fair(jobs, args) -> Tuple[Dict[str, List[float]], float]:
+    scheduler = InferenceScheduler(
+        workers=args.workers, tenant_max_running=args.workers - 1,
+        tenant_quota=float('inf'), max_wait=float('inf'), weights={})
+    waits: Dict[str, List[float]] = {}
+    start = time.perf_counter()
+
+    async def submit(tenant, arrival, estimate):
+        await asyncio.sleep(arrival / args.speed)
+        queued = time.perf_counter()
+
+        def job():
+            waits.setdefault(tenant, []).append(args.speed * (time.perf_counter() - queued))
+            time.sleep(estimate.seconds / args.speed)
+
+        await scheduler.run(scheduler.submit(tenant, estimate), job)
+
+    await asyncio.gather(*(submit(*job) for job in jobs))
+    return waits, args.speed * (time.perf_counter() - start)
+
+
+async def rejection(args) -> Dict:
+    # jobs are held by their workers or queued until one would wait too long
+    scheduler = InferenceScheduler(
+        workers=args.workers, tenant_quota=3600, max_wait=1800, weights={})
+    release = threading.Event()
+    tasks, admitted = [], 0
+    estimate = scheduler.estimate([Service.RADAR], Profile.ACCURATE, SHORT_FRAMES * 2)
+    while True:
+        tenant = f"club-{admitted % 4}"
+        try:
+            ticket = scheduler.admit(tenant, estimate)
+        except AdmissionRejected as e:
+            result = {
+                "admitted": admitted, "job_seconds": estimate.seconds, "reason": e.reason,
+                "queue_position": e.position, "eta_seconds": round(e.eta_seconds)}
+            break
+        admitted += 1
+        tasks.append(asyncio.create_task(
+            scheduler.run(ticket, release.wait)))
+        await asyncio.sleep(0)
+    release.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return {**result, "last_admitted_position": ticket.admission.position,
+            "last_admitted_eta_seconds": round(ticket.admission.eta_seconds)}
+
+
+async def main(args) -> Dict:
+    jobs = workload(InferenceScheduler(workers=args.workers, weights={}), args)
+    fifo_waits, fifo_seconds = await first_come_first_served(jobs, args)
+    fair_waits, fair_seconds = await fair(jobs, args)
+    return {
+        "jobs": {tenant: sum(1 for job in jobs if job[0] == tenant)
+                 for tenant in sorted({job[0] for job in jobs})},
+        "long_job_seconds": jobs[0][2].seconds,
+        "short_job_seconds": jobs[-1][2].seconds,
+        "fifo": {"seconds": fifo_seconds, "wait_seconds": summary(fifo_waits)},
+        "fair": {"seconds": fair_seconds, "wait_seconds": summary(fair_waits)},
+        "rejection": await rejection(args),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--long", type=int, default=3)
+    parser.add_argument("--short", type=int, default=6)
+    # simulated seconds per second of the benchmark
+    parser.add_argument("--speed", type=float, default=1000)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main(args)), indent=2))
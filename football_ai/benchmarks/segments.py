@@ -0,0 +1,65 @@
+"""
+Speedup of segmented processing from 1 to N worker processes.
+
+Processes the whole clip with `run_model` once per worker count, without saving
+detections, and reports wall time and speedup over a single worker. `--backend`
+sets `INFERENCE_BACKEND` for the benchmark and its worker processes.
+
+    python benchmarks/segments.py path/to/match.mp4 --mode PLAYER_TRACKING --max-workers 8
+    python benchmarks/segments.py path/to/match.mp4 --backend ONNX --max-workers 8
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from rag.modes import Service
+from rag.profiles import get_profile
+
+
+def run(source_video_path: str, mode: Service, max_workers: int, device: str) -> dict:
+    # imported here so that the backends read the INFERENCE_BACKEND set in main
+    from rag.services import run_model
+
+    profile = get_profile()
+    report = {
+        "source": source_video_path, "mode": str(mode),
+        "backend": os.environ.get("INFERENCE_BACKEND", "torch"), "workers": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in range(1, max_workers + 1):
+            target = Path(tmp) / f"output-{workers}.mp4"
+            start = time.perf_counter()
+            for _ in run_model(
+                source_video_path, target, project_id="benchmark",
+                video_id=f"benchmark-{workers}", mode=mode, device=device,
+                with_sql=False, profile=profile, workers=workers
+            ):
+                pass
+            report["workers"][workers] = {"seconds": time.perf_counter() - start}
+
+    baseline = report["workers"][1]["seconds"]
+    for result in report["workers"].values():
+        result["speedup"] = baseline / result["seconds"]
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source_video_path")
+    parser.add_argument("--mode", default=str(Service.PLAYER_TRACKING))
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--backend", help="TORCH, ONNX or OPENVINO")
+    args = parser.parse_args()
+    if args.backend:
+        # spawned segment workers inherit the environment
+        os.environ["INFERENCE_BACKEND"] = args.backend
+
+    print(json.dumps(run(
+        Path(args.source_video_path).resolve().as_posix(), Service[args.mode.upper()],
+        args.max_workers, args.device), indent=2))
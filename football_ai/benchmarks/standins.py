@@ -0,0 +1,232 @@
+"""
+Synthetic clips and random-weight model stand-ins for offline benchmarks.
+
+The stand-ins have the architecture of the real models, so they cost the same to
+run, but random weights. The class biases of the YOLO heads are calibrated on the
+first frame of the clip so that each model reports about as many objects as the
+real one would, keeping the tracking, team and radar stages realistically loaded.
+
+    python benchmarks/standins.py /tmp/standins --frames 150 --scale x
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+from typing import Dict, Sequence
+
+import cv2
+import numpy as np
+import supervision as sv
+
+PLAYER_CLASSES = ['ball', 'goalkeeper', 'player', 'referee']
+# objects per frame the calibrated heads report, by class
+PLAYER_COUNTS = {'goalkeeper': 2, 'player': 20, 'referee': 1}
+BALL_COUNTS = {'ball': 1}
+PITCH_COUNTS = {'pitch': 1}
+PITCH_KEYPOINTS = 32
+
+TEAM_COLORS = [(40, 40, 220), (220, 180, 40), (20, 20, 20), (0, 220, 220)]
+
+
+def make_clip(
+    target_path: Path,
+    frames: int = 150,
+    resolution: Sequence[int] = (1280, 720),
+    fps: int = 25,
+    seed: int = 0
+) -> Path:
+    """
+    Write a synthetic broadcast-like clip: a striped pitch with its markings,
+    two teams of players, goalkeepers, a referee and a ball moving around.
+
+    Args:
+        target_path (Path): Where to write the clip.
+        frames (int): Number of frames.
+        resolution (Sequence[int]): Width and height of the clip.
+        fps (int): Frame rate of the clip.
+        seed (int): Seed of the object trajectories.
+
+    Returns:
+        Path: The target path.
+    """
+    w, h = resolution
+    rng = np.random.default_rng(seed)
+    # team 1, team 2, goalkeepers, referee
+    color_ids = np.array([0] * 10 + [1] * 10 + [2] * 2 + [3])
+    start = rng.uniform([0.05 * w, 0.2 * h], [0.95 * w, 0.9 * h], size=(len(color_ids), 2))
+    velocity = rng.normal(0, 2.0, size=(len(color_ids), 2))
+    phase = rng.uniform(0, 2 * np.pi, size=len(color_ids))
+
+    pitch = np.zeros((h, w, 3), dtype=np.uint8)
+    for i, x in enumerate(range(0, w, w // 10)):
+        pitch[:, x:x + w // 10] = (40, 140, 40) if i % 2 else (50, 160, 50)
+    cv2.line(pitch, (w // 2, 0), (w // 2, h), (255, 255, 255), 3)
+    cv2.circle(pitch, (w // 2, h // 2), h // 6, (255, 255, 255), 3)
+    cv2.rectangle(pitch, (0, h // 4), (w // 8, 3 * h // 4), (255, 255, 255), 3)
+    cv2.rectangle(pitch, (w - w // 8, h // 4), (w, 3 * h // 4), (255, 255, 255), 3)
+
+    video_info = sv.VideoInfo(width=w, height=h, fps=fps, total_frames=frames)
+    target_path.parent.mkdir(exist_ok=True, parents=True)
+    with sv.VideoSink(target_path.as_posix(), video_info, codec="mp4v") as sink:
+        for index in range(frames):
+            frame = pitch.copy()
+            xy = start + velocity * index + 20 * np.sin(index / 10 + phase)[:, None]
+            xy = np.abs(np.mod(xy, 2 * np.array([w, h])) - np.array([w, h]))
+            for (x, y), color_id in zip(xy.astype(int), color_ids):
+                cv2.rectangle(frame, (x - 12, y - 40), (x + 12, y), TEAM_COLORS[color_id], -1)
+                cv2.circle(frame, (x, y - 48), 8, (150, 180, 220), -1)
+            ball = (int(w / 2 + w / 3 * np.sin(index / 25)), int(h / 2 + h / 4 * np.cos(index / 17)))
+            cv2.circle(frame, ball, 6, (255, 255, 255), -1)
+            sink.write_frame(frame)
+    return target_path
+
+
+def _calibrate(model, frame: np.ndarray, names: Sequence[str], counts: Dict[str, int]) -> None:
+    import torch
+
+    image = cv2.resize(frame, (640, 640))[:, :, ::-1]
+    tensor = torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1)[None].float() / 255
+    model.eval()
+    with torch.no_grad():
+        output = model(tensor)
+    predictions = output[0] if isinstance(output, (list, tuple)) else output
+    probabilities = predictions[0, 4:4 + len(names)].clamp(1e-7, 1 - 1e-7)
+    logits = torch.log(probabilities / (1 - probabilities))
+
+    # shift each class so that its `count` most confident anchors score above 0.5,
+    # classes not listed never fire
+    head = model.model[-1]
+    for class_id, name in enumerate(names):
+        count = counts.get(name, 0)
+        if count > 0:
+            shift = -float(torch.topk(logits[class_id], count).values[-1]) + 0.1
+        else:
+            shift = -50.0
+        for branch in head.cv3:
+            branch[-1].bias.data[class_id] += shift
+
+
+def make_yolo_standin(
+    target_path: Path,
+    frame: np.ndarray,
+    names: Sequence[str],
+    counts: Dict[str, int],
+    scale: str = 'x',
+    keypoints: int = 0
+) -> Path:
+    """
+    Save a random-weight YOLOv8 checkpoint loadable by `load_yolo`.
+
+    Args:
+        target_path (Path): Where to write the `.pt` checkpoint.
+        frame (np.ndarray): Frame the class biases are calibrated on.
+        names (Sequence[str]): Class names of the real model.
+        counts (Dict[str, int]): Objects per frame to report, by class name.
+        scale (str): YOLOv8 scale, one of n, s, m, l, x.
+        keypoints (int): Number of keypoints of a pose model, 0 for detection.
+
+    Returns:
+        Path: The target path.
+    """
+    import torch
+    from ultralytics.nn.tasks import DetectionModel, PoseModel
+
+    torch.manual_seed(0)
+    if keypoints:
+        model = PoseModel(
+            f'yolov8{scale}-pose.yaml', nc=len(names),
+            data_kpt_shape=(keypoints, 3), verbose=False)
+    else:
+        model = DetectionModel(f'yolov8{scale}.yaml', nc=len(names), verbose=False)
+    model.names = dict(enumerate(names))
+    _calibrate(model, frame, names, counts)
+
+    target_path.parent.mkdir(exist_ok=True, parents=True)
+    torch.save({
+        'model': model,
+        'train_args': {'task': 'pose' if keypoints else 'detect'},
+    }, target_path)
+    return target_path
+
+
+def make_siglip_standin(target_path: Path) -> Path:
+    """
+    Save a random-weight SigLIP base vision encoder loadable with `from_pretrained`.
+
+    Args:
+        target_path (Path): Directory of the model.
+
+    Returns:
+        Path: The target path.
+    """
+    import torch
+    from transformers import SiglipVisionConfig, SiglipVisionModel
+
+    torch.manual_seed(0)
+    SiglipVisionModel(SiglipVisionConfig()).save_pretrained(target_path.as_posix())
+    return target_path
+
+
+def create_standins(
+    directory: Path,
+    frames: int = 150,
+    resolution: Sequence[int] = (1280, 720),
+    scale: str = 'x'
+) -> Dict[str, str]:
+    """
+    Write a synthetic clip and stand-ins of every model to a directory.
+
+    Args:
+        directory (Path): Output directory, reused when already populated.
+        frames (int): Number of frames of the clip.
+        resolution (Sequence[int]): Width and height of the clip.
+        scale (str): YOLOv8 scale of the detection stand-ins.
+
+    Returns:
+        Dict[str, str]: Path of the clip and environment pointing the pipelines
+            at the stand-ins.
+    """
+    from rag.services import (
+        BALL_DETECTION_MODEL_PATH,
+        PITCH_DETECTION_MODEL_PATH,
+        PLAYER_DETECTION_MODEL_PATH,
+    )
+
+    clip = directory / f"clip-{frames}-{resolution[0]}x{resolution[1]}.mp4"
+    if not clip.exists():
+        make_clip(clip, frames=frames, resolution=resolution)
+    _, frame = cv2.VideoCapture(clip.as_posix()).read()
+
+    models = directory / f"yolov8{scale}"
+    for path, names, counts, keypoints in (
+        (PLAYER_DETECTION_MODEL_PATH, PLAYER_CLASSES, PLAYER_COUNTS, 0),
+        (BALL_DETECTION_MODEL_PATH, ['ball'], BALL_COUNTS, 0),
+        (PITCH_DETECTION_MODEL_PATH, ['pitch'], PITCH_COUNTS, PITCH_KEYPOINTS),
+    ):
+        target = models / Path(path).name
+        if not target.exists():
+            make_yolo_standin(target, frame, names, counts, scale=scale, keypoints=keypoints)
+
+    siglip = directory / 'siglip-standin'
+    if not siglip.exists():
+        make_siglip_standin(siglip)
+
+    return {
+        "clip": clip.as_posix(),
+        "MODEL_FOLDER": models.as_posix(),
+        "SIGLIP_MODEL_PATH": siglip.as_posix(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("directory", type=Path)
+    parser.add_argument("--frames", type=int, default=150)
+    parser.add_argument("--resolution", type=int, nargs=2, default=(1280, 720))
+    parser.add_argument("--scale", default="x", choices=list("nsmlx"))
+    args = parser.parse_args()
+
+    print(json.dumps(create_standins(
+        args.directory, args.frames, args.resolution, args.scale), indent=2))
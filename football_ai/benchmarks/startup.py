@@ -0,0 +1,129 @@
+"""
+Import time budget and time to first /health response of the server.
+
+Imports the server module in a fresh interpreter with `-X importtime`, reports the
+slowest top-level imports and fails when the total exceeds the budget or when a
+module that should only load lazily is imported. Then starts the server with
+uvicorn and polls /health until it answers.
+
+    python benchmarks/startup.py --budget-ms 1500
+    python benchmarks/startup.py --module rag.services --no-server
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import os
+import socket
+import subprocess
+import time
+from typing import Dict, List
+
+import httpx
+
+SERVER_DIR = ROOT_DIR / 'server'
+# loaded on first use or by the warm-up task, never by the import of the server
+LAZY_MODULES = [
+    'torch', 'ultralytics', 'transformers', 'umap', 'sklearn',
+    'langchain', 'langgraph', 'google.cloud.firestore', 'google.cloud.storage',
+]
+
+
+def parse_importtime(stderr: str) -> List[Dict]:
+    """
+    Parse the `-X importtime` report.
+
+    Returns:
+        List[Dict]: Module, self and cumulative microseconds and nesting depth of
+            every import, in the order they completed.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append({
+            'module': name.strip(),
+            'self_us': int(self_us),
+            'cumulative_us': int(cumulative_us),
+            'depth': depth,
+        })
+    return imports
+
+
+def measure_imports(module: str, top: int) -> dict:
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([
+        ROOT_DIR.as_posix(), SERVER_DIR.as_posix(), os.environ.get('PYTHONPATH', '')])}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SERVER_DIR, env=env, capture_output=True, text=True)
+    imports = parse_importtime(result.stderr)
+    # top-level imports of the measured module are one level below it
+    roots = [entry for entry in imports if entry['depth'] <= 1]
+    names = {entry['module'] for entry in imports}
+    return {
+        'module': module,
+        'error': result.stderr.strip().splitlines()[-1] if result.returncode else None,
+        'total_ms': max((entry['cumulative_us'] for entry in imports), default=0) / 1000,
+        'modules': len(imports),
+        'slowest': [
+            {'module': entry['module'], 'cumulative_ms': entry['cumulative_us'] / 1000}
+            for entry in sorted(roots, key=lambda entry: -entry['cumulative_us'])[:top]
+        ],
+        'eager_heavy_modules': sorted(
+            lazy for lazy in LAZY_MODULES
+            if any(name == lazy or name.startswith(f'{lazy}.') for name in names)),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def measure_health(timeout: float) -> dict:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'backend:app', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                return {'error': server.stderr.read().strip().splitlines()[-1]}
+            try:
+                response = httpx.get(f'http://127.0.0.1:{port}/health', timeout=0.5)
+                if response.status_code == 200:
+                    return {'first_health_seconds': time.perf_counter() - start}
+            except httpx.TransportError:
+                pass
+            time.sleep(0.02)
+        return {'error': f'no /health response within {timeout}s'}
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--module", default="backend")
+    parser.add_argument("--budget-ms", type=float, default=1500)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--server", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    report = {"imports": measure_imports(args.module, args.top)}
+    if args.server:
+        report["server"] = measure_health(args.timeout)
+    imports = report["imports"]
+    report["within_budget"] = (
+        not imports["error"] and not imports["eager_heavy_modules"]
+        and imports["total_ms"] <= args.budget_ms)
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if report["within_budget"] else 1)
@@ -0,0 +1,108 @@
+"""
+Cost of streaming an agent response to the socket.
+
+Times the search of the final answer in responses of growing length, the
+previous accumulate-and-search of the whole response at every token against
+the incremental matcher, then streams an answer through a simulated socket,
+a frame per token against micro-batched frames.
+
+    python benchmarks/streaming.py --tokens 4000 --token-delay 0.002 --emit-delay 0.001
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List
+
+from rag.streaming import FINAL_ANSWER_MARKER, FinalAnswerMatcher, TokenBatcher
+
+
+def react_tokens(tokens: int, seed: int = 0) -> List[str]:
+    """
+    A response of the agent split as the model streams it, its reasoning
+    followed by the final answer in the last fifth.
+    """
+    rng = random.Random(seed)
+    words = ["the", "player", "tracker", "SELECT", "frame", "distance", "ran", "most",
+             "query", "result", ":", "\n", "Thought", "Action"]
+    reasoning = [f" {rng.choice(words)}" for _ in range(tokens * 4 // 5)]
+    answer = [f" {rng.choice(words[:6])}" for _ in range(tokens - len(reasoning) - 3)]
+    return reasoning + ["Final", " Answer", ":"] + answer
+
+
+def legacy_search(tokens: List[str]) -> str:
+    # the callback handler before the matcher, the whole response searched per token
+    content, found, answer = "", False, []
+    for token in tokens:
+        content += token
+        if FINAL_ANSWER_MARKER in content:
+            found = True
+            content = ""
+        if found:
+            answer.append(token)
+    return "".join(answer)
+
+
+def matcher_search(tokens: List[str]) -> str:
+    matcher = FinalAnswerMatcher()
+    return "".join(matcher.feed(token)[1] for token in tokens)
+
+
+def time_search(tokens: List[str], repeat: int) -> Dict[str, float]:
+    result = {}
+    for name, search in (("legacy", legacy_search), ("matcher", matcher_search)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            search(tokens)
+        result[f"{name}_ns_per_token"] = 1e9 * (time.perf_counter() - start) / repeat / len(tokens)
+    return result
+
+
+async def stream(
+    tokens: List[str], token_delay: float, emit_delay: float, batched: bool
+) -> Dict[str, float]:
+    emits = 0
+
+    async def emit(frame: str) -> None:
+        nonlocal emits
+        emits += 1
+        await asyncio.sleep(emit_delay)
+
+    batcher = TokenBatcher(emit)
+    start = time.perf_counter()
+    for token in tokens:
+        if batched:
+            await batcher.add(token)
+        else:
+            await emit(token)
+        await asyncio.sleep(token_delay)
+    await batcher.close()
+    return {"emits": emits, "stream_seconds": time.perf_counter() - start}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=5)
+    # seconds between two tokens of the model and to send a socket frame
+    parser.add_argument("--token-delay", type=float, default=0.002)
+    parser.add_argument("--emit-delay", type=float, default=0.001)
+    args = parser.parse_args()
+
+    search = {
+        length: time_search(react_tokens(length), args.repeat)
+        for length in (args.tokens // 16, args.tokens // 4, args.tokens)
+    }
+    answer = react_tokens(args.tokens)
+    print(json.dumps({
+        "search": search,
+        "per_token_emits": asyncio.run(
+            stream(answer, args.token_delay, args.emit_delay, batched=False)),
+        "batched_emits": asyncio.run(
+            stream(answer, args.token_delay, args.emit_delay, batched=True)),
+    }, indent=2))
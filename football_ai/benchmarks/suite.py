@@ -0,0 +1,353 @@
+"""
+Reproducible offline benchmark of the pipelines, end to end and per component.
+
+Every Service runs through `run_model` on a synthetic clip, and the hot components
+run on synthetic inputs, each case in a fresh process so that its peak RSS is its
+own. Models are random-weight stand-ins of the real architectures unless
+`--real-models` is given. The JSON report can be compared with a previous one to
+spot regressions between commits.
+
+    python benchmarks/suite.py --output before.json
+    python benchmarks/suite.py --baseline before.json --output after.json
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Optional
+
+SERVICES = [
+    'PITCH_DETECTION', 'PLAYER_DETECTION', 'BALL_DETECTION',
+    'PLAYER_TRACKING', 'TEAM_CLASSIFICATION', 'RADAR',
+]
+COMPONENTS = [
+    'parse_detection', 'draw_pitch_voronoi_diagram', 'extract_features',
+    'ball_tracker_update', 'radar_render',
+]
+# components too slow on CPU to run as many iterations as the others
+ITERATION_DIVISORS = {'extract_features': 20}
+
+
+def peak_rss_mib() -> float:
+    # kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def measure(
+    create_step: Callable[[], Callable[[int], None]],
+    iterations: int,
+    allocations: bool
+) -> dict:
+    """
+    Time a step function, then trace its allocations in a second pass.
+
+    Args:
+        create_step (Callable[[], Callable[[int], None]]): Creates a fresh step
+            function, called with the iteration index.
+        iterations (int): Number of timed iterations, after one warm-up call.
+        allocations (bool): Trace the allocations of a second pass.
+
+    Returns:
+        dict: Timings, peak RSS and allocation peak.
+    """
+    step = create_step()
+    step(0)
+    start = time.perf_counter()
+    for i in range(1, iterations + 1):
+        step(i)
+    seconds = time.perf_counter() - start
+    result = {
+        "iterations": iterations,
+        "seconds": seconds,
+        "ms_per_iteration": 1000 * seconds / iterations,
+        "per_second": iterations / seconds,
+        # before the traced pass, tracing has its own memory overhead
+        "peak_rss_mib": peak_rss_mib(),
+    }
+
+    if allocations:
+        step = create_step()
+        step(0)
+        tracemalloc.start()
+        for i in range(1, iterations + 1):
+            step(i)
+        result["alloc_peak_mib"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+    return result
+
+
+def _run_service(name: str, clip: str, options: dict, allocations: bool) -> dict:
+    from rag import metrics
+    from rag.profiles import get_profile
+    from rag.services import TEAM_MODEL_FOLDER, Service, run_model
+
+    profile = get_profile(options["profile"])
+    project_id = f"benchmark-{uuid.uuid4().hex[:8]}"
+
+    def run(traced: bool) -> dict:
+        video_id = uuid.uuid4().hex
+        with tempfile.TemporaryDirectory() as tmp:
+            if traced:
+                tracemalloc.start()
+            start = time.perf_counter()
+            for _ in run_model(
+                source_video_path=clip,
+                target_video_path=(Path(tmp) / "output.mp4").as_posix(),
+                project_id=project_id,
+                video_id=video_id,
+                mode=Service(name),
+                device=options["device"],
+                with_sql=False,
+                profile=profile,
+                workers=1,
+            ):
+                pass
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if traced else None
+            tracemalloc.stop()
+
+        job_path = metrics.JOBS_FOLDER / f"{video_id}.json"
+        summary = json.loads(job_path.read_text())
+        job_path.unlink()
+        return {"seconds": seconds, "peak": peak, "summary": summary}
+
+    try:
+        untraced = run(traced=False)
+        result = {
+            "frames": untraced["summary"]["frames"],
+            "seconds": untraced["seconds"],
+            "fps": untraced["summary"]["frames"] / untraced["seconds"],
+            "stages_ms": {
+                stage: values["mean_ms"]
+                for stage, values in untraced["summary"]["stages"].items()
+            },
+            "peak_rss_mib": peak_rss_mib(),
+        }
+        if allocations:
+            # a new video id, so the team model is fitted again like the first run
+            shutil.rmtree(TEAM_MODEL_FOLDER / project_id, ignore_errors=True)
+            result["alloc_peak_mib"] = run(traced=True)["peak"] / 1024 ** 2
+        return result
+    finally:
+        shutil.rmtree(TEAM_MODEL_FOLDER / project_id, ignore_errors=True)
+
+
+def _component(name: str, clip: str, options: dict) -> Callable[[], Callable[[int], None]]:
+    import cv2
+    import numpy as np
+    import pandas as pd
+    import supervision as sv
+
+    from rag.services import COLORS, CONFIG, parse_detection
+
+    rng = np.random.default_rng(0)
+
+    def random_detections(count: int, bounds=(1800, 1000)) -> sv.Detections:
+        xy = rng.uniform([0, 0], bounds, size=(count, 2))
+        return sv.Detections(
+            xyxy=np.hstack([xy, xy + [40, 80]]).astype(np.float32),
+            confidence=rng.uniform(0.3, 1.0, size=count).astype(np.float32),
+            class_id=rng.integers(0, 4, size=count),
+            tracker_id=np.arange(count),
+        )
+
+    def random_pitch_xy(count: int) -> np.ndarray:
+        return rng.uniform([0, 0], [CONFIG.length, CONFIG.width], size=(count, 2))
+
+    if name == 'parse_detection':
+        inputs = [random_detections(25) for _ in range(64)]
+
+        def create_step():
+            state = {"df": pd.DataFrame()}
+
+            def step(i: int) -> None:
+                state["df"] = parse_detection(
+                    inputs[i % len(inputs)], state["df"], i, 'benchmark', 'benchmark')
+            return step
+        return create_step
+
+    if name == 'draw_pitch_voronoi_diagram':
+        from sports.annotators.soccer import draw_pitch_voronoi_diagram
+
+        inputs = [(random_pitch_xy(11), random_pitch_xy(11)) for _ in range(64)]
+
+        def create_step():
+            def step(i: int) -> None:
+                team_1_xy, team_2_xy = inputs[i % len(inputs)]
+                draw_pitch_voronoi_diagram(
+                    config=CONFIG, team_1_xy=team_1_xy, team_2_xy=team_2_xy)
+            return step
+        return create_step
+
+    if name == 'extract_features':
+        from sports.common.team import TeamClassifier
+
+        # real crops of the clip, without the embedding cache
+        _, frame = cv2.VideoCapture(clip).read()
+        h, w, _ = frame.shape
+        detections = random_detections(options["batch_size"], bounds=(w - 40, h - 80))
+        crops = [sv.crop_image(frame, box) for box in detections.xyxy]
+        classifier = TeamClassifier(
+            device=options["device"], batch_size=options["batch_size"], cache_size=0)
+
+        def create_step():
+            def step(i: int) -> None:
+                classifier.extract_features(crops)
+            return step
+        return create_step
+
+    if name == 'ball_tracker_update':
+        from sports.common.ball import BallTracker
+
+        inputs = [random_detections(int(rng.integers(0, 3))) for _ in range(64)]
+
+        def create_step():
+            tracker = BallTracker(buffer_size=20)
+
+            def step(i: int) -> None:
+                tracker.update(inputs[i % len(inputs)])
+            return step
+        return create_step
+
+    if name == 'radar_render':
+        from sports.annotators.compositor import RadarOverlay
+
+        inputs = [(random_pitch_xy(25), rng.integers(0, 4, size=25)) for _ in range(64)]
+
+        def create_step():
+            overlay = RadarOverlay(CONFIG, COLORS)
+
+            def step(i: int) -> None:
+                overlay.render(*inputs[i % len(inputs)])
+            return step
+        return create_step
+
+    raise ValueError(f"Unknown component {name}")
+
+
+def _run_case(kind: str, name: str, clip: str, options: dict, env: Dict[str, str]) -> dict:
+    # runs in a fresh process, the stand-ins must be set before the pipelines
+    # read their paths at import time
+    os.environ.update(env)
+    try:
+        if kind == 'services':
+            return _run_service(name, clip, options, options["allocations"])
+        iterations = max(1, options["iterations"] // ITERATION_DIVISORS.get(name, 1))
+        return measure(_component(name, clip, options), iterations, options["allocations"])
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """
+    Throughput of every case relative to a baseline report, above 1 is faster.
+    """
+    changes = {}
+    for kind, key in (("services", "fps"), ("components", "per_second")):
+        for name, result in report.get(kind, {}).items():
+            before = baseline.get(kind, {}).get(name, {})
+            if key in result and before.get(key):
+                changes[f"{kind}.{name}"] = result[key] / before[key]
+    return changes
+
+
+def run(args: argparse.Namespace) -> dict:
+    from standins import create_standins, make_clip
+
+    directory = args.cache_dir or Path(tempfile.gettempdir()) / 'football_ai-benchmarks'
+    if args.real_models:
+        env = {}
+        synthetic = directory / f"clip-{args.frames}-{args.resolution[0]}x{args.resolution[1]}.mp4"
+        if not args.clip and not synthetic.exists():
+            make_clip(synthetic, frames=args.frames, resolution=args.resolution)
+        synthetic = synthetic.as_posix()
+    else:
+        env = create_standins(directory, args.frames, args.resolution, args.scale)
+        synthetic = env.pop("clip")
+    clip = args.clip or synthetic
+
+    options = {
+        "profile": args.profile,
+        "device": args.device,
+        "iterations": args.iterations,
+        "batch_size": args.batch_size,
+        "allocations": args.allocations,
+    }
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "clip": clip,
+        "models": "real" if args.real_models else f"yolov8{args.scale} stand-ins",
+        "options": options,
+        "services": {},
+        "components": {},
+    }
+    cases = [("services", name) for name in args.services]
+    cases += [("components", name) for name in args.components]
+    for kind, name in cases:
+        # a process per case, so peak RSS and import state are not shared
+        with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+            report[kind][name] = executor.submit(
+                _run_case, kind, name, clip, options, env).result()
+        print(kind, name, json.dumps(report[kind][name]), file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--services", nargs="*", default=SERVICES, choices=SERVICES)
+    parser.add_argument("--components", nargs="*", default=COMPONENTS, choices=COMPONENTS)
+    parser.add_argument("--clip", help="Bundled clip to use instead of a synthetic one.")
+    parser.add_argument("--frames", type=int, default=150)
+    parser.add_argument("--resolution", type=int, nargs=2, default=(1280, 720))
+    parser.add_argument("--scale", default="x", choices=list("nsmlx"),
+                        help="YOLOv8 scale of the stand-ins.")
+    parser.add_argument("--real-models", action="store_true",
+                        help="Use the weights of MODEL_FOLDER instead of stand-ins.")
+    parser.add_argument("--profile", default=None)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--allocations", action=argparse.BooleanOptionalAction, default=True,
+                        help="Trace allocations in a second, slower pass.")
+    parser.add_argument("--cache-dir", type=Path,
+                        help="Where clips and stand-ins are kept between runs.")
+    parser.add_argument("--baseline", type=Path, help="Previous report to compare with.")
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.baseline:
+        report["relative_throughput"] = compare(report, json.loads(args.baseline.read_text()))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
@@ -0,0 +1,79 @@
+"""
+Comparison of the team classification strategies.
+
+Samples player crops from a clip, fits every strategy on the same crops and
+reports fit time, predict time per crop and agreement with the SIGLIP labels.
+
+    python benchmarks/team.py path/to/clip.mp4 --stride 30
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import time
+from dataclasses import replace
+
+import numpy as np
+
+from rag.profiles import get_profile
+from rag.services import (
+    PLAYER_DETECTION_MODEL_PATH,
+    Service,
+    collect_player_crops,
+)
+from sports.common.backends import load_yolo
+from sports.common.team import TeamStrategy, create_team_classifier
+
+
+def agreement(labels: np.ndarray, reference: np.ndarray) -> float:
+    """
+    Fraction of crops with the same team as the reference, whichever way the two
+    clusters are numbered.
+    """
+    same = float(np.mean(labels == reference))
+    return max(same, 1 - same)
+
+
+def run(source_video_path: str, stride: int, device: str) -> dict:
+    profile = get_profile()
+    settings = profile.settings(Service.TEAM_CLASSIFICATION)
+    model = load_yolo(PLAYER_DETECTION_MODEL_PATH, device=device)
+    crops = collect_player_crops(
+        source_video_path, model, replace(settings, fit_stride=stride), profile)
+
+    report = {"source": source_video_path, "crops": len(crops), "strategies": {}}
+    labels = {}
+    for strategy in TeamStrategy:
+        start = time.perf_counter()
+        classifier = create_team_classifier(strategy, device=device)
+        classifier.fit(crops)
+        fit_time = time.perf_counter() - start
+
+        if hasattr(classifier, "cache") and classifier.cache is not None:
+            # measure inference, not cache lookups of the crops seen during fit
+            classifier.cache.entries.clear()
+        start = time.perf_counter()
+        labels[strategy] = classifier.predict(crops)
+        predict_time = time.perf_counter() - start
+
+        report["strategies"][str(strategy)] = {
+            "fit_seconds": fit_time,
+            "predict_ms_per_crop": 1000 * predict_time / max(len(crops), 1),
+        }
+
+    for strategy in TeamStrategy:
+        report["strategies"][str(strategy)]["agreement_with_siglip"] = agreement(
+            labels[strategy], labels[TeamStrategy.SIGLIP])
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source_video_path")
+    parser.add_argument("--stride", type=int, default=30)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.source_video_path, args.stride, args.device), indent=2))
@@ -0,0 +1,69 @@
+"""
+Decode and encode throughput of the video backends.
+
+Decodes a clip and re-encodes its frames with every available backend, against
+the supervision defaults.
+
+    python benchmarks/video.py path/to/clip.mp4 --frames 500
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import tempfile
+import time
+from itertools import islice
+
+import supervision as sv
+
+from sports.common.video import VideoBackend, VideoSink, get_video_frames_generator
+
+
+def measure(generator, frames: int, sink_factory) -> dict:
+    start = time.perf_counter()
+    decoded = 0
+    with sink_factory() as sink:
+        decode_time = 0.0
+        tick = time.perf_counter()
+        for frame in islice(generator, frames):
+            decode_time += time.perf_counter() - tick
+            sink.write_frame(frame)
+            decoded += 1
+            tick = time.perf_counter()
+    total = time.perf_counter() - start
+    return {
+        "frames": decoded,
+        "decode_fps": decoded / decode_time if decode_time else 0.0,
+        "total_fps": decoded / total,
+    }
+
+
+def run(source_video_path: str, frames: int) -> dict:
+    video_info = sv.VideoInfo.from_video_path(source_video_path)
+    report = {"source": source_video_path, "backends": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        target = (Path(tmp) / "output.mp4").as_posix()
+        report["backends"]["supervision"] = measure(
+            sv.get_video_frames_generator(source_video_path), frames,
+            lambda: sv.VideoSink(target, video_info, codec="avc1"))
+        for backend in VideoBackend:
+            try:
+                report["backends"][str(backend)] = measure(
+                    get_video_frames_generator(
+                        source_video_path, backend=backend, reuse_buffers=True),
+                    frames,
+                    lambda: VideoSink(target, video_info, codec="avc1", backend=backend))
+            except ImportError as e:
+                report["backends"][str(backend)] = {"error": str(e)}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("source_video_path")
+    parser.add_argument("--frames", type=int, default=500)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.source_video_path, args.frames), indent=2))
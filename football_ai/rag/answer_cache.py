@@ -0,0 +1,278 @@
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from rag import metrics
+from rag.database import get_engine, run_sync
+from rag.router import normalize_question
+
+# seconds an answer is served for, even when its video gets no new detections
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# answers kept across all videos, least recently used are evicted first
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+# Ollama embedding model matching similar questions, e.g. nomic-embed-text,
+# exact matches only when empty
+ANSWER_CACHE_EMBEDDING_MODEL = os.getenv("ANSWER_CACHE_EMBEDDING_MODEL", "")
+# cosine similarity above which a cached answer is reused for another question
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+VERSIONS_TABLE = 'detection_versions'
+
+# follow-ups refer to earlier turns of the chat, their answer depends on more
+# than the question and the video
+FOLLOW_UP = re.compile(
+    r"\b(he|him|his|she|her|they|them|their|those|these|previous|above|earlier|"
+    r"again|instead|else|also)\b")
+
+
+def bump_versions(conn: Connection, video_ids: Iterable[str]) -> None:
+    """
+    Increment the data version of videos, in the transaction appending their
+    detections, so that cached answers about them are no longer served.
+
+    Args:
+        conn (Connection): Open transaction on the detections database.
+        video_ids (Iterable[str]): The videos that got new detections.
+    """
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} "
+        "(video_id TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL NOT NULL)"))
+    for video_id in video_ids:
+        conn.execute(text(
+            f"INSERT INTO {VERSIONS_TABLE} (video_id, version, updated_at) "
+            "VALUES (:video_id, 1, :now) "
+            "ON CONFLICT(video_id) DO UPDATE SET "
+            "version = version + 1, updated_at = excluded.updated_at"),
+            {"video_id": video_id, "now": time.time()})
+
+
+def read_data_version(engine: Engine, video_id: str) -> Optional[int]:
+    """
+    The data version of a video, 0 before its first append is recorded and
+    None when the detections database cannot be read.
+    """
+    try:
+        with engine.connect() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": VERSIONS_TABLE}).first()
+            if not exists:
+                return 0
+            version = conn.execute(text(
+                f"SELECT version FROM {VERSIONS_TABLE} WHERE video_id = :video_id"),
+                {"video_id": video_id}).scalar()
+            return version or 0
+    except Exception as e:
+        logger.error(f"Could not read the data version of {video_id}: {e}")
+        return None
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+@dataclass
+class CachedAnswer:
+    """
+    A streamed agent answer.
+
+    Attributes:
+        question (str): The normalized question.
+        tokens (List[str]): The tokens in the order they were streamed.
+        created_at (float): Monotonic time the answer was stored.
+        embedding (Optional[List[float]]): Embedding of the question.
+    """
+    question: str
+    tokens: List[str]
+    created_at: float = field(default_factory=time.monotonic)
+    embedding: Optional[List[float]] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.tokens)
+
+
+# project, video, data version
+VideoKey = Tuple[str, str, int]
+
+
+class AnswerCache:
+    """
+    Cache of the agent answers keyed by video, detections data version and
+    normalized question.
+
+    Answers expire after `ttl` seconds and when new detections are appended
+    for their video, which bumps the data version stored next to the
+    detections. With an embedding model, a question also hits the answer of
+    a cached question of the same video whose embedding is similar enough.
+
+    Attributes:
+        engine (Engine): Read-only engine of the detections database.
+        ttl (float): Seconds an answer is served for.
+        max_size (int): Number of answers kept.
+        similarity (float): Cosine similarity above which questions match.
+    """
+
+    def __init__(
+        self,
+        detection_db_path: str = 'detections.db',
+        ttl: float = ANSWER_CACHE_TTL,
+        max_size: int = ANSWER_CACHE_SIZE,
+        embedding_model: str = ANSWER_CACHE_EMBEDDING_MODEL,
+        similarity: float = ANSWER_CACHE_SIMILARITY
+    ):
+        self.engine: Engine = get_engine(detection_db_path, read_only=True)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.similarity = similarity
+        self.embedding_model = embedding_model
+        self._embeddings = None
+        self._entries: "OrderedDict[Tuple[VideoKey, str], CachedAnswer]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def data_version(self, video_id: str) -> Optional[int]:
+        return read_data_version(self.engine, video_id)
+
+    async def embed(self, question: str) -> Optional[List[float]]:
+        if not self.embedding_model:
+            return None
+        try:
+            if self._embeddings is None:
+                from langchain_ollama import OllamaEmbeddings
+                self._embeddings = OllamaEmbeddings(model=self.embedding_model)
+            return await self._embeddings.aembed_query(question)
+        except Exception as e:
+            # exact matches keep working without the embedding model
+            logger.error(f"Could not embed question: {e}")
+            return None
+
+    def _expire(self, now: float) -> None:
+        expired = [
+            key for key, entry in self._entries.items() if now - entry.created_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def get(
+        self,
+        video_key: VideoKey,
+        question: str,
+        embedding: Optional[List[float]] = None
+    ) -> Optional[CachedAnswer]:
+        """
+        Look up the answer of a normalized question, by exact match first and
+        by the most similar cached question of the video otherwise.
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            entry = self._entries.get((video_key, question))
+            if entry is not None:
+                self._entries.move_to_end((video_key, question))
+                metrics.CACHE_REQUESTS.inc(cache='answer', result='hit')
+                return entry
+
+            if embedding is not None:
+                scored = [
+                    (cosine_similarity(embedding, candidate.embedding), key)
+                    for key, candidate in self._entries.items()
+                    if key[0] == video_key and candidate.embedding is not None]
+                if scored:
+                    score, key = max(scored)
+                    if score >= self.similarity:
+                        self._entries.move_to_end(key)
+                        metrics.CACHE_REQUESTS.inc(cache='answer', result='similar')
+                        return self._entries[key]
+
+        metrics.CACHE_REQUESTS.inc(cache='answer', result='miss')
+        return None
+
+    def put(self, video_key: VideoKey, answer: CachedAnswer) -> None:
+        with self._lock:
+            # answers about older data of the video can no longer be hit
+            for key in [key for key in self._entries
+                        if key[0][:2] == video_key[:2] and key[0] != video_key]:
+                del self._entries[key]
+            self._entries[(video_key, answer.question)] = answer
+            self._entries.move_to_end((video_key, answer.question))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    async def process_question(
+        self,
+        question: str,
+        project_id: str,
+        video_id: str,
+        final_answer_pre_callback: Callable,
+        token_callback: Callable,
+        answer: Callable
+    ) -> bool:
+        """
+        Replay the cached answer of a question, or run `answer` with callbacks
+        that record the streamed tokens and cache them.
+
+        Args:
+            question (str): The question of the user.
+            project_id (str): Project of the video.
+            video_id (str): The video the question is about.
+            final_answer_pre_callback (Callable): Called before the first token.
+            token_callback (Callable): Called with every token.
+            answer (Callable): Coroutine function answering on a miss, called
+                with the pre-answer and token callbacks.
+
+        Returns:
+            bool: Whether the answer was replayed from the cache.
+        """
+        normalized = normalize_question(question)
+        if not video_id or not normalized or FOLLOW_UP.search(normalized):
+            await answer(final_answer_pre_callback, token_callback)
+            return False
+
+        version = await run_sync(self.data_version, video_id)
+        if version is None:
+            await answer(final_answer_pre_callback, token_callback)
+            return False
+        video_key = (project_id, video_id, version)
+
+        embedding = None
+        if (video_key, normalized) not in self._entries:
+            embedding = await self.embed(normalized)
+        cached = self.get(video_key, normalized, embedding)
+        if cached is not None:
+            await final_answer_pre_callback()
+            for token in cached.tokens:
+                await token_callback(token)
+            return True
+
+        tokens: List[str] = []
+
+        async def record_token(token: str):
+            tokens.append(token)
+            await token_callback(token)
+
+        await answer(final_answer_pre_callback, record_token)
+        if tokens and "".join(tokens).strip():
+            self.put(video_key, CachedAnswer(normalized, tokens, embedding=embedding))
+        return False
+
+
+@lru_cache(maxsize=None)
+def get_answer_cache(detection_db_path: str = 'detections.db') -> AnswerCache:
+    return AnswerCache(detection_db_path)
@@ -0,0 +1,268 @@
+"""
+Compaction of the agent checkpoints in memory.db.
+
+The checkpointer writes a full checkpoint at every step of the agent and never
+deletes one. Compaction keeps the checkpoints of the questions and final
+answers, the latest checkpoints of every session and the latest checkpoint of
+every thread, which the agent resumes from, and deletes the intermediate tool
+steps with their pending writes. The freed pages are returned to the file
+system by incremental vacuum, a few pages at a time, so that the checkpointer
+is never blocked for long.
+
+    python rag/compaction.py --keep-recent 10
+    python rag/compaction.py --dry-run
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import argparse
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Tuple
+
+from loguru import logger
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import text
+
+from rag.database import database_path, get_engine
+from rag.history import SQLMessageHistory
+
+# most recent checkpoints of a session kept whatever they are, the turns in flight
+CHECKPOINT_KEEP_RECENT = int(os.getenv("CHECKPOINT_KEEP_RECENT", "10"))
+# hours between two compactions by the server, 0 to only compact by hand
+CHECKPOINT_COMPACTION_INTERVAL = float(os.getenv("CHECKPOINT_COMPACTION_INTERVAL", "24"))
+# checkpoints deleted, and pages vacuumed, per write transaction
+COMPACTION_BATCH = 500
+VACUUM_PAGES_PER_STEP = 1000
+# seconds between two batches, when the checkpointer gets the write lock
+COMPACTION_PAUSE = 0.01
+
+PRUNABLE_QUERY = """
+    WITH steps AS (
+        SELECT rowid AS id, thread_id, checkpoint_ns, checkpoint_id,
+            json_extract(metadata, '$.session_id') AS session_id,
+            CASE WHEN (
+                LOWER(json_extract(metadata, '$.writes.agent.messages[0].kwargs.response_metadata.finish_reason')) = 'stop'
+                OR json_extract(metadata, '$.source') = 'input'
+            ) AND COALESCE(json_extract(metadata, '$.writes.agent.messages[0].kwargs.tool_calls'), '[]') = '[]'
+            THEN 1 ELSE 0 END AS is_message
+        FROM checkpoints
+    ), ranked AS (
+        SELECT *,
+            ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY checkpoint_id DESC) AS session_rank,
+            ROW_NUMBER() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS thread_rank
+        FROM steps
+    )
+    SELECT id, thread_id, checkpoint_ns, checkpoint_id
+    FROM ranked
+    WHERE is_message = 0 AND session_rank > :keep_recent AND thread_rank > 1
+"""
+
+# what the checkpointer runs before every turn
+LATEST_CHECKPOINT_QUERY = """
+    SELECT checkpoint_id, checkpoint, metadata FROM checkpoints
+    WHERE thread_id = '1' AND checkpoint_ns = ''
+    ORDER BY checkpoint_id DESC LIMIT 1
+"""
+
+
+@dataclass(frozen=True)
+class DatabaseStats:
+    """
+    Disk use and query latency of the memory database.
+
+    Attributes:
+        file_bytes (int): Size of the database and its write-ahead log.
+        free_pages (int): Pages freed but not yet returned to the file system.
+        checkpoints (int): Rows of the checkpoints table.
+        writes (int): Rows of the pending writes table.
+        latest_checkpoint_ms (float): Time to load the latest checkpoint.
+        checkpoint_scan_ms (float): Time to read the metadata of every checkpoint.
+    """
+    file_bytes: int
+    free_pages: int
+    checkpoints: int
+    writes: int
+    latest_checkpoint_ms: float
+    checkpoint_scan_ms: float
+
+
+@dataclass(frozen=True)
+class CompactionReport:
+    """
+    Outcome of a compaction.
+
+    Attributes:
+        before (DatabaseStats): Stats before compacting.
+        after (DatabaseStats): Stats after compacting.
+        dry_run (bool): Whether nothing was deleted.
+        deleted_checkpoints (int): Tool step checkpoints deleted, or that would
+            be on a dry run.
+        deleted_writes (int): Pending writes of the deleted checkpoints.
+        vacuumed_pages (int): Pages returned to the file system.
+        seconds (float): Duration of the compaction.
+    """
+    before: DatabaseStats
+    after: DatabaseStats
+    dry_run: bool
+    deleted_checkpoints: int
+    deleted_writes: int
+    vacuumed_pages: int
+    seconds: float
+
+
+def _has_table(conn: Connection, name: str) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": name}).first() is not None
+
+
+def _timed_ms(conn: Connection, query: str) -> float:
+    start = time.perf_counter()
+    conn.execute(text(query)).fetchall()
+    return 1000 * (time.perf_counter() - start)
+
+
+def database_stats(engine: Engine, db_path: str) -> DatabaseStats:
+    path = Path(database_path(db_path))
+    file_bytes = sum(
+        file.stat().st_size for file in (path, Path(f"{path}-wal")) if file.exists())
+    with engine.connect() as conn:
+        has_writes = _has_table(conn, 'writes')
+        return DatabaseStats(
+            file_bytes=file_bytes,
+            free_pages=conn.execute(text("PRAGMA freelist_count")).scalar(),
+            checkpoints=conn.execute(text("SELECT COUNT(*) FROM checkpoints")).scalar(),
+            writes=conn.execute(text("SELECT COUNT(*) FROM writes")).scalar() if has_writes else 0,
+            latest_checkpoint_ms=_timed_ms(conn, LATEST_CHECKPOINT_QUERY),
+            checkpoint_scan_ms=_timed_ms(
+                conn, "SELECT json_extract(metadata, '$.session_id') FROM checkpoints"),
+        )
+
+
+def enable_incremental_vacuum(engine: Engine) -> bool:
+    """
+    Switch the database to incremental auto vacuum.
+
+    The mode of an existing database only changes with a full VACUUM, which
+    runs once, on the first compaction.
+
+    Returns:
+        bool: Whether the database was converted.
+    """
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # 2 is INCREMENTAL
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            return False
+        logger.info("Converting the memory database to incremental vacuum")
+        conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+    return True
+
+
+def vacuum_incrementally(engine: Engine, pause: float = COMPACTION_PAUSE) -> int:
+    """
+    Return the free pages to the file system, `VACUUM_PAGES_PER_STEP` at a time.
+
+    Returns:
+        int: Number of pages returned.
+    """
+    vacuumed = 0
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # the pragma frees a page per step, the driver cursor is stepped to the end
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            while (free := cursor.execute("PRAGMA freelist_count").fetchone()[0]) > 0:
+                cursor.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_STEP})").fetchall()
+                remaining = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                if remaining >= free:
+                    break
+                vacuumed += free - remaining
+                time.sleep(pause)
+            # the log keeps the size of the largest transaction until truncated
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        finally:
+            cursor.close()
+    return vacuumed
+
+
+def prunable_checkpoints(engine: Engine, keep_recent: int) -> List[Tuple]:
+    with engine.connect() as conn:
+        return conn.execute(text(PRUNABLE_QUERY), {"keep_recent": keep_recent}).all()
+
+
+def compact_checkpoints(
+    memory_db_path: str = 'memory.db',
+    keep_recent: int = CHECKPOINT_KEEP_RECENT,
+    dry_run: bool = False,
+    pause: float = COMPACTION_PAUSE
+) -> CompactionReport:
+    """
+    Delete the intermediate tool step checkpoints and vacuum the freed pages.
+
+    Args:
+        memory_db_path (str): Path of the memory database.
+        keep_recent (int): Most recent checkpoints of every session kept.
+        dry_run (bool): Only count what would be deleted.
+        pause (float): Seconds between two write transactions.
+
+    Returns:
+        CompactionReport: Disk use and latencies before and after.
+    """
+    start = time.perf_counter()
+    engine = get_engine(memory_db_path)
+    with engine.connect() as conn:
+        if not _has_table(conn, 'checkpoints'):
+            raise ValueError(f"No checkpoints in {memory_db_path}")
+        has_writes = _has_table(conn, 'writes')
+    # the messages are read from their own table, filled from the checkpoints once
+    SQLMessageHistory('', memory_db_path).ensure_table()
+
+    before = database_stats(engine, memory_db_path)
+    prunable = prunable_checkpoints(engine, keep_recent)
+    deleted_writes = 0
+    vacuumed_pages = 0
+    if not dry_run:
+        for index in range(0, len(prunable), COMPACTION_BATCH):
+            batch = prunable[index:index + COMPACTION_BATCH]
+            with engine.begin() as conn:
+                conn.execute(
+                    text("DELETE FROM checkpoints WHERE rowid = :id"),
+                    [{"id": row.id} for row in batch])
+                if has_writes:
+                    deleted_writes += conn.execute(text(
+                        "DELETE FROM writes WHERE thread_id = :thread_id "
+                        "AND checkpoint_ns = :checkpoint_ns AND checkpoint_id = :checkpoint_id"),
+                        [row._asdict() for row in batch]).rowcount
+            time.sleep(pause)
+        enable_incremental_vacuum(engine)
+        vacuumed_pages = vacuum_incrementally(engine, pause)
+
+    report = CompactionReport(
+        before=before,
+        after=database_stats(engine, memory_db_path),
+        dry_run=dry_run,
+        deleted_checkpoints=len(prunable),
+        deleted_writes=deleted_writes,
+        vacuumed_pages=vacuumed_pages,
+        seconds=time.perf_counter() - start,
+    )
+    if not dry_run:
+        logger.info(
+            f"Compacted {memory_db_path}: {report.deleted_checkpoints} checkpoints deleted, "
+            f"{before.file_bytes / 2**20:.1f}MB -> {report.after.file_bytes / 2**20:.1f}MB")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--db", default="memory.db")
+    parser.add_argument("--keep-recent", type=int, default=CHECKPOINT_KEEP_RECENT)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    report = compact_checkpoints(args.db, args.keep_recent, args.dry_run)
+    print(json.dumps(asdict(report), indent=2))
@@ -0,0 +1,276 @@
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+from contextlib import ExitStack
+from typing import Dict, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import supervision as sv
+
+from rag import metrics
+from rag.modes import COMPOSITE_TABLE, Service
+from rag.profiles import (
+    InferenceProfile,
+    get_profile,
+    downscale,
+    upscale_detections,
+    upscale_keypoints,
+)
+from rag.services import (
+    BALL_DETECTION_MODEL_PATH,
+    BOX_ANNOTATOR,
+    BOX_LABEL_ANNOTATOR,
+    COLORS,
+    CONFIG,
+    PITCH_DETECTION_MODEL_PATH,
+    PLAYER_DETECTION_MODEL_PATH,
+    VERTEX_LABEL_ANNOTATOR,
+    annotate_tracks,
+    create_player_detector,
+    fit_team_classifier,
+    parse_detection,
+    record_embedding_cache,
+    resolve_radar_frame,
+    save_detections,
+    shift_keypoints,
+)
+from sports.annotators.compositor import FrameCompositor, RadarOverlay
+from sports.common.backends import load_yolo
+from sports.common.ball import BallAnnotator, BallTracker
+from sports.common.team import GoalkeeperTeamResolver
+from sports.common.video import VideoSink, get_video_frames_generator
+
+PLAYER_SERVICES = (
+    Service.PLAYER_DETECTION,
+    Service.PLAYER_TRACKING,
+    Service.TEAM_CLASSIFICATION,
+    Service.RADAR,
+)
+TRACKING_SERVICES = (Service.PLAYER_TRACKING, Service.TEAM_CLASSIFICATION, Service.RADAR)
+TEAM_SERVICES = (Service.TEAM_CLASSIFICATION, Service.RADAR)
+PITCH_SERVICES = (Service.PITCH_DETECTION, Service.RADAR)
+
+Results = Dict[Service, Union[sv.Detections, sv.KeyPoints]]
+
+
+def run_composite(
+    source_video_path: str,
+    device: str,
+    services: Sequence[Service],
+    profile: InferenceProfile,
+    project_id: Optional[str] = None,
+    video_id: Optional[str] = None
+) -> Iterator[Tuple[Dict[Service, np.ndarray], Results]]:
+    """
+    Run several Services on a video in a single pass and yield, for every frame,
+    the annotated frame and the results of each Service.
+
+    The video is decoded once and each model runs once per frame, whatever the
+    number of Services sharing it: the player detections feed detection, tracking,
+    team classification and radar, the pitch keypoints feed pitch detection and
+    radar.
+
+    Args:
+        source_video_path (str): Path to the source video.
+        device (str): Device to run the models on (e.g., 'cpu', 'cuda').
+        services (Sequence[Service]): The Services to produce outputs for.
+        profile (InferenceProfile): The inference profile of the job. The shared
+            player detector uses the settings of the first requested player
+            Service.
+        project_id (Optional[str]): Project of the video, to reuse its team models.
+        video_id (Optional[str]): Id of the video, to reuse its team model.
+
+    Yields:
+        Iterator[Tuple[Dict[Service, np.ndarray], Results]]: Annotated frames and
+            results keyed by Service.
+    """
+    services = [service for service in Service if service in set(services)]
+    player_services = [service for service in services if service in PLAYER_SERVICES]
+
+    if player_services:
+        player_settings = profile.settings(player_services[0])
+        player_detection_model = load_yolo(PLAYER_DETECTION_MODEL_PATH, device=device)
+        player_detector = create_player_detector(player_detection_model, player_settings)
+        tracker = sv.ByteTrack(minimum_consecutive_frames=3)
+
+    if any(service in TEAM_SERVICES for service in services):
+        team_classifier = fit_team_classifier(
+            source_video_path, player_detection_model, player_settings, profile, device,
+            project_id=project_id, video_id=video_id)
+        goalkeeper_resolver = GoalkeeperTeamResolver()
+
+    if any(service in PITCH_SERVICES for service in services):
+        pitch_settings = profile.settings(
+            Service.PITCH_DETECTION if Service.PITCH_DETECTION in services
+            else Service.RADAR)
+        pitch_detection_model = load_yolo(PITCH_DETECTION_MODEL_PATH, device=device)
+
+    if Service.BALL_DETECTION in services:
+        ball_settings = profile.settings(Service.BALL_DETECTION)
+        ball_detection_model = load_yolo(BALL_DETECTION_MODEL_PATH, device=device)
+        ball_tracker = BallTracker(buffer_size=20)
+        ball_annotator = BallAnnotator(radius=6, buffer_size=10)
+
+        def callback(image_slice: np.ndarray) -> sv.Detections:
+            with metrics.timed('ball_detection'):
+                result = ball_detection_model(
+                    image_slice, imgsz=ball_settings.imgsz,
+                    conf=ball_settings.confidence, verbose=False)[0]
+            return sv.Detections.from_ultralytics(result)
+
+        slicer = sv.InferenceSlicer(
+            callback=callback,
+            overlap_filter_strategy=sv.OverlapFilter.NONE,
+            slice_wh=(ball_settings.imgsz, ball_settings.imgsz),
+        )
+
+    if Service.RADAR in services:
+        radar_overlay = RadarOverlay(CONFIG, COLORS)
+
+    # outputs are drawn in Service order, after the inference they need, so only
+    # the last one can be drawn on the raw frame
+    compositors = {
+        service: FrameCompositor(in_place=service == services[-1])
+        for service in services
+    }
+
+    frame_generator = metrics.timed_iter(get_video_frames_generator(
+        source_path=source_video_path, reuse_buffers=True), 'decode')
+    keypoints, transformer = None, None
+    for frame_index, frame in enumerate(frame_generator):
+        resized, scale = downscale(frame, profile.max_resolution)
+        frames, results = {}, {}
+
+        if player_services:
+            detections = upscale_detections(player_detector(resized), scale)
+
+        if any(service in PITCH_SERVICES for service in services):
+            # the pitch output needs fresh keypoints on every frame, the radar
+            # alone follows the camera motion in between keyframes
+            if (Service.PITCH_DETECTION in services or keypoints is None
+                    or player_detector.last_was_keyframe):
+                with metrics.timed('pitch_detection'):
+                    result = pitch_detection_model(
+                        resized, imgsz=pitch_settings.pitch_imgsz, verbose=False)[0]
+                keypoints = upscale_keypoints(
+                    sv.KeyPoints.from_ultralytics(result), scale)
+            else:
+                keypoints = shift_keypoints(
+                    keypoints, player_detector.last_shift / scale)
+        if Service.PITCH_DETECTION in services:
+            frames[Service.PITCH_DETECTION] = VERTEX_LABEL_ANNOTATOR.annotate(
+                compositors[Service.PITCH_DETECTION].canvas(frame), keypoints,
+                CONFIG.labels)
+            results[Service.PITCH_DETECTION] = keypoints
+
+        if Service.PLAYER_DETECTION in services:
+            annotated_frame = BOX_ANNOTATOR.annotate(
+                compositors[Service.PLAYER_DETECTION].canvas(frame), detections)
+            frames[Service.PLAYER_DETECTION] = BOX_LABEL_ANNOTATOR.annotate(
+                annotated_frame, detections)
+            results[Service.PLAYER_DETECTION] = detections
+
+        if Service.BALL_DETECTION in services:
+            ball = upscale_detections(slicer(resized).with_nms(threshold=0.1), scale)
+            with metrics.timed('tracking'):
+                ball = ball_tracker.update(ball)
+            frames[Service.BALL_DETECTION] = ball_annotator.annotate(
+                compositors[Service.BALL_DETECTION].canvas(frame), ball)
+            results[Service.BALL_DETECTION] = ball
+
+        if any(service in TRACKING_SERVICES for service in services):
+            with metrics.timed('tracking'):
+                # the tracker writes tracker ids into the detections it is given,
+                # which are also the untracked PLAYER_DETECTION results
+                tracked = tracker.update_with_detections(
+                    detections[np.arange(len(detections))])
+        for service in (Service.PLAYER_TRACKING, Service.TEAM_CLASSIFICATION):
+            if service in services:
+                frames[service] = annotate_tracks(compositors[service].canvas(frame), tracked)
+                results[service] = tracked
+
+        if Service.RADAR in services:
+            radar_detections, color_lookup, pitch_xy, transformer = resolve_radar_frame(
+                frame, frame_index, tracked, keypoints, transformer,
+                team_classifier, goalkeeper_resolver)
+            annotated_frame = annotate_tracks(
+                compositors[Service.RADAR].canvas(frame), radar_detections, color_lookup)
+            frames[Service.RADAR] = radar_overlay.annotate(
+                annotated_frame, pitch_xy, color_lookup)
+            results[Service.RADAR] = radar_detections
+
+        yield frames, results
+
+    if any(service in TEAM_SERVICES for service in services):
+        record_embedding_cache(team_classifier)
+
+
+def run_composite_model(
+    source_video_path: str,
+    target_video_paths: Dict[Service, str],
+    project_id: str,
+    video_ids: Dict[Service, str],
+    device: str = 'cpu',
+    with_sql: bool = True,
+    profile: Optional[InferenceProfile] = None
+) -> Iterator[float]:
+    """
+    Composite counterpart of `run_model`: writes one annotated video per Service
+    and appends the detections of all of them to the `COMPOSITE` table.
+
+    Args:
+        source_video_path (str): Path to the source video.
+        target_video_paths (Dict[Service, str]): Output video path per Service.
+        project_id (str): Project of the video.
+        video_ids (Dict[Service, str]): Id of the output clip of each Service,
+            recorded with its detections.
+        device (str): Device to run the models on (e.g., 'cpu', 'cuda').
+        with_sql (bool): Save the detections to the detections database.
+        profile (Optional[InferenceProfile]): The inference profile of the job.
+
+    Yields:
+        Iterator[float]: Progress percentage.
+    """
+    profile = profile or get_profile()
+    services = list(target_video_paths)
+
+    video_info = sv.VideoInfo.from_video_path((ROOT_DIR / source_video_path).as_posix())
+    total_frames = video_info.total_frames
+    if total_frames <= 30:
+        raise ValueError("Video is too short")
+
+    # the team model is persisted under the id of the first clip
+    frame_generator = run_composite(
+        source_video_path=source_video_path, device=device, services=services,
+        profile=profile, project_id=project_id, video_id=video_ids[services[0]])
+
+    with metrics.job(COMPOSITE_TABLE, video_ids[services[0]]) as timer:
+        dfs = {service: pd.DataFrame() for service in services}
+        frame_count = 0
+        with ExitStack() as stack:
+            video_sinks = {
+                service: stack.enter_context(VideoSink(
+                    (ROOT_DIR / target).as_posix(), video_info, codec="avc1"))
+                for service, target in target_video_paths.items()
+            }
+            for frames, results in frame_generator:
+                with metrics.timed('encode'):
+                    for service, frame in frames.items():
+                        video_sinks[service].write_frame(frame)
+                for service, detections in results.items():
+                    # pitch keypoints have no detections table
+                    if isinstance(detections, sv.Detections) and len(detections) > 0:
+                        dfs[service] = parse_detection(
+                            detections, dfs[service], frame_count, project_id,
+                            video_ids[service])
+                timer.frame()
+                yield (frame_count / total_frames) * 100
+                frame_count += 1
+            print("Video processing complete!", frame_count, "frames processed of", total_frames)
+
+        for service in dfs:
+            dfs[service]['service'] = str(service)
+        save_detections(
+            pd.concat(dfs.values(), ignore_index=True), COMPOSITE_TABLE, profile, with_sql)
@@ -0,0 +1,80 @@
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import asyncio
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Callable, TypeVar, Union
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+# connections kept per database, and threads running queries for the event loop
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+# milliseconds a connection waits for the write lock before failing
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", "10000"))
+
+T = TypeVar('T')
+
+# queries get threads of their own so that they never queue behind model
+# loading or other work of the default executor
+_executor = ThreadPoolExecutor(DB_POOL_SIZE, thread_name_prefix='sqlite')
+
+
+def database_path(db_path: Union[str, Path]) -> str:
+    return (ROOT_DIR / db_path).as_posix()
+
+
+def _configure_connection(dbapi_connection, _record, read_only: bool) -> None:
+    # not every SQLite build has the math functions
+    dbapi_connection.create_function('SQRT', 1, math.sqrt, deterministic=True)
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT}")
+    if not read_only:
+        # readers no longer wait for the writer, the mode is stored in the file
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.close()
+
+
+def create_pooled_engine(db_path: Union[str, Path], read_only: bool = False) -> Engine:
+    """
+    Create an engine keeping up to `DB_POOL_SIZE` connections to a database.
+
+    Args:
+        db_path (Union[str, Path]): Path of the database, relative to the package.
+        read_only (bool): Open the connections read-only.
+
+    Returns:
+        Engine: The engine.
+    """
+    path = database_path(db_path)
+    url = f"sqlite:///file:{path}?mode=ro&uri=true" if read_only else f"sqlite:///{path}"
+    engine = create_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=0,
+        connect_args={"check_same_thread": False},
+    )
+    event.listen(engine, 'connect', partial(_configure_connection, read_only=read_only))
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_engine(db_path: Union[str, Path] = 'detections.db', read_only: bool = False) -> Engine:
+    """
+    The engine of a database shared by the whole process.
+    """
+    return create_pooled_engine(db_path, read_only=read_only)
+
+
+async def run_sync(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Run blocking database work on the database threads and wait for it without
+    blocking the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
@@ -0,0 +1,200 @@
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import text
+
+from rag.database import get_engine, run_sync
+from rag.streaming import extract_final_answer
+
+# kept apart from the agent so that reading the history does not load langchain
+FINAL_ANSWER = "Final Answer: "
+
+MESSAGES_TABLE = 'chat_messages'
+# messages per page of the history endpoint
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))
+HISTORY_MAX_PAGE_SIZE = 500
+
+# the checkpoints of the agent are the source of the messages written before
+# the messages table existed
+CHECKPOINT_MESSAGES_QUERY = """
+    WITH json_data AS (
+        SELECT *,
+            json_extract(metadata, '$.writes.agent.messages[0].kwargs.response_metadata.finish_reason') as finish_reason,
+            json_extract(metadata, '$.writes.agent.messages[0].kwargs.tool_calls') as tool_calls,
+            json_extract(metadata, '$.source') as source,
+            json_extract(metadata, '$.session_id') as session_id,
+            json_extract(metadata, '$.sender') as sender
+        FROM checkpoints
+    )
+    SELECT
+        session_id,
+        checkpoint_id,
+        metadata
+    FROM json_data
+    WHERE thread_id = 1
+    AND (
+        LOWER(finish_reason) = 'stop'
+        OR source = 'input'
+    )
+    AND session_id IS NOT NULL
+    AND (tool_calls IS NULL OR tool_calls = '[]')
+
+    ORDER BY checkpoint_id ASC
+"""
+
+_ready = set()
+_ready_lock = threading.Lock()
+
+
+def checkpoint_message(metadata: dict) -> Optional[Tuple[str, str]]:
+    """
+    The sender and text of the message a checkpoint recorded, None for the
+    checkpoints of tool calls.
+    """
+    writes = metadata.get('writes') or {}
+    if writes.get('agent'):
+        message = extract_final_answer(writes['agent']['messages'][0]['kwargs']['content'])
+        return ("system", message) if message else None
+    if writes.get('__start__'):
+        return metadata.get('sender'), writes['__start__']['messages']
+    return None
+
+
+def create_messages_table(conn: Connection) -> bool:
+    """
+    Create the messages table and fill it from the agent checkpoints.
+
+    Returns:
+        bool: Whether the table was created.
+    """
+    exists = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": MESSAGES_TABLE}).first()
+    if exists:
+        return False
+
+    conn.execute(text(f"""
+        CREATE TABLE {MESSAGES_TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id TEXT NOT NULL,
+            checkpoint_id TEXT,
+            sender TEXT,
+            message TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )"""))
+    # pages of a session are read backwards from a message id
+    conn.execute(text(
+        f"CREATE INDEX ix_{MESSAGES_TABLE}_session ON {MESSAGES_TABLE} (session_id, id)"))
+    conn.execute(text(
+        f"CREATE UNIQUE INDEX ux_{MESSAGES_TABLE}_checkpoint "
+        f"ON {MESSAGES_TABLE} (session_id, checkpoint_id)"))
+
+    has_checkpoints = conn.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'checkpoints'")).first()
+    if has_checkpoints:
+        rows = []
+        for session_id, checkpoint_id, metadata in conn.execute(text(CHECKPOINT_MESSAGES_QUERY)):
+            message = checkpoint_message(json.loads(metadata))
+            if message is not None:
+                rows.append({
+                    "session_id": str(session_id), "checkpoint_id": checkpoint_id,
+                    "sender": message[0], "message": message[1], "created_at": time.time(),
+                })
+        if rows:
+            conn.execute(text(
+                f"INSERT OR IGNORE INTO {MESSAGES_TABLE} "
+                "(session_id, checkpoint_id, sender, message, created_at) "
+                "VALUES (:session_id, :checkpoint_id, :sender, :message, :created_at)"), rows)
+    return True
+
+
+class SQLMessageHistory():
+    """
+    Chat messages of a project, one row per message in the memory database.
+
+    Attributes:
+        project_id (str): The project, session of the agent.
+        raw_memory (Engine): Engine of the memory database.
+    """
+
+    def __init__(self, project_id: str, memory_db_path: str = "memory.db") -> None:
+        self.project_id = project_id
+        self.raw_memory = get_engine(memory_db_path)
+
+    def ensure_table(self) -> None:
+        # once per database and process, the backfill runs when the table is created
+        key = str(self.raw_memory.url)
+        if key in _ready:
+            return
+        with _ready_lock:
+            if key not in _ready:
+                with self.raw_memory.begin() as conn:
+                    create_messages_table(conn)
+                _ready.add(key)
+
+    def add_turn(self, sender: str, question: str, answer: Optional[str] = None) -> None:
+        """
+        Record a question and its answer once the answer is streamed.
+        """
+        self.ensure_table()
+        rows = [{"sender": sender, "message": question}]
+        if answer:
+            rows.append({"sender": "system", "message": answer})
+        now = time.time()
+        with self.raw_memory.begin() as conn:
+            conn.execute(text(
+                f"INSERT INTO {MESSAGES_TABLE} (session_id, sender, message, created_at) "
+                "VALUES (:session_id, :sender, :message, :created_at)"),
+                [{**row, "session_id": self.project_id, "created_at": now} for row in rows])
+
+    def get_history(
+        self,
+        before: Optional[int] = None,
+        limit: int = HISTORY_PAGE_SIZE
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        A page of messages, newest first.
+
+        Args:
+            before (Optional[int]): Cursor of the page, the messages older than
+                this id. The newest messages when None.
+            limit (int): Messages per page.
+
+        Returns:
+            Tuple[List[Dict], Optional[str]]: The messages and the cursor of the
+                next page, None on the last page.
+        """
+        self.ensure_table()
+        query = (
+            f"SELECT id, sender, message FROM {MESSAGES_TABLE} "
+            "WHERE session_id = :project_id {before} ORDER BY id DESC LIMIT :limit")
+        params = {"project_id": self.project_id, "limit": limit + 1}
+        if before is not None:
+            params["before"] = before
+        with self.raw_memory.connect() as conn:
+            rows = conn.execute(text(query.format(
+                before="AND id < :before" if before is not None else "")), params).all()
+
+        messages = [
+            {"id": str(row.id), "sender": row.sender, "message": row.message}
+            for row in rows[:limit]]
+        next_cursor = str(rows[limit - 1].id) if len(rows) > limit else None
+        return messages, next_cursor
+
+    async def aget_history(
+        self,
+        before: Optional[int] = None,
+        limit: int = HISTORY_PAGE_SIZE
+    ) -> Tuple[List[Dict], Optional[str]]:
+        return await run_sync(self.get_history, before, limit)
+
+    async def aadd_turn(self, sender: str, question: str, answer: Optional[str] = None) -> None:
+        await run_sync(self.add_turn, sender, question, answer)
@@ -0,0 +1,229 @@
+"""
+Chat models of the agent, hosted or served locally, with a concurrency limit
+per model.
+
+The local services keep the static prefix of the prompt, the base prompt, the
+context, the schema of the video and the tools, in the KV cache of the server
+across questions: Ollama keeps the model loaded for `LOCAL_LLM_KEEP_ALIVE`
+with a fixed context size and reuses the longest common prefix of the
+previous request, llama.cpp servers are asked to `cache_prompt`, and vLLM
+does the same when started with `--enable-prefix-caching`. The prefix only
+hits when it is byte for byte the same, which is why the base prompt and the
+schema summary are cached.
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from enum import Enum
+from functools import lru_cache
+from typing import AsyncIterator, Optional, Sequence
+
+from loguru import logger
+
+from rag import metrics
+from rag.prompts import sql_agent_system_prompt
+
+
+class LLMService(str, Enum):
+    """
+    Enum class representing the providers of the agent's chat model.
+    """
+    GOOGLE = 'google'
+    GROQ = 'groq'
+    # Ollama
+    LOCAL = 'local'
+    # llama.cpp server, vLLM or any OpenAI-compatible server
+    OPENAI = 'openai'
+    # responses recorded from another service, replayed without network
+    RECORDED = 'recorded'
+
+    def __str__(self):
+        return self.value
+
+
+# service of the agent in the server
+AGENT_LLM_SERVICE = LLMService(os.getenv("AGENT_LLM_SERVICE", "google"))
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "llama3.1")
+# Ollama or OpenAI-compatible endpoint, e.g. http://localhost:8080/v1, their
+# defaults when empty
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "")
+# how long Ollama keeps the model and its cached prefix loaded after a request
+LOCAL_LLM_KEEP_ALIVE = os.getenv("LOCAL_LLM_KEEP_ALIVE", "30m")
+# context size of the local model, a change reloads the model and drops its cache
+LOCAL_LLM_NUM_CTX = int(os.getenv("LOCAL_LLM_NUM_CTX", "8192"))
+# seconds a request to a local server may take when the caller sets no timeout,
+# a hung server would otherwise hold its slot of the model gate forever
+LOCAL_LLM_TIMEOUT = float(os.getenv("LOCAL_LLM_TIMEOUT", "300"))
+# questions answered at once per model, the others wait in arrival order
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LOCAL_LLM_CONCURRENCY = int(os.getenv("LOCAL_LLM_CONCURRENCY", "2"))
+# JSON lines file every response of the agent's model is appended to
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH", "")
+# recording replayed by the recorded service, and the factor on its latencies
+LLM_RECORDING = os.getenv("LLM_RECORDING", "")
+LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1"))
+
+SERVICE_MODELS = {
+    LLMService.GOOGLE: "gemini-1.5-pro",
+    LLMService.GROQ: "llama-3.1-70b-versatile",
+    LLMService.LOCAL: LOCAL_LLM_MODEL,
+    LLMService.OPENAI: LOCAL_LLM_MODEL,
+    LLMService.RECORDED: "recorded",
+}
+# services answering without a network connection
+LOCAL_SERVICES = {LLMService.LOCAL, LLMService.OPENAI, LLMService.RECORDED}
+
+SQL_AGENT_PROMPT = "langchain-ai/sql-agent-system-prompt"
+PROMPT_CACHE_FOLDER = ROOT_DIR / 'prompt_cache'
+
+LLM_QUEUE_SECONDS = metrics.Histogram(
+    'agent_llm_queue_seconds', 'Time a question waits for its model.', labels=('model',))
+LLM_WAITING = metrics.Gauge(
+    'agent_llm_waiting', 'Questions waiting for their model.', labels=('model',))
+
+
+class ModelGate:
+    """
+    Concurrency limit of a model, the questions beyond it wait in arrival order.
+
+    Attributes:
+        model (str): The model.
+        limit (int): Questions answered at once.
+        waiting (int): Questions waiting.
+    """
+
+    def __init__(self, model: str, limit: int):
+        self.model = model
+        self.limit = limit
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        start = time.perf_counter()
+        self.waiting += 1
+        LLM_WAITING.set(self.waiting, model=self.model)
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            LLM_WAITING.set(self.waiting, model=self.model)
+        waited = time.perf_counter() - start
+        LLM_QUEUE_SECONDS.observe(waited, model=self.model)
+        if waited > 1:
+            logger.info(f"Question waited {waited:.1f}s for {self.model}")
+        try:
+            yield
+        finally:
+            self._semaphore.release()
+
+
+@lru_cache(maxsize=None)
+def get_model_gate(service: str, model: str) -> ModelGate:
+    limit = LOCAL_LLM_CONCURRENCY if LLMService(service) in LOCAL_SERVICES else LLM_CONCURRENCY
+    return ModelGate(model, limit)
+
+
+@lru_cache(maxsize=None)
+def base_system_message(dialect: str = "SQLite", top_k: int = 5, offline: bool = False) -> str:
+    """
+    The base prompt of the SQL agent from the LangChain hub, pulled once and
+    kept on disk, the bundled copy when offline or the hub cannot be reached.
+    """
+    path = PROMPT_CACHE_FOLDER / f"sql_agent_system_prompt_{dialect}_{top_k}.txt"
+    if path.exists():
+        return path.read_text()
+    if not offline:
+        try:
+            from langchain import hub
+            message = hub.pull(SQL_AGENT_PROMPT).format(dialect=dialect, top_k=top_k)
+            path.parent.mkdir(exist_ok=True, parents=True)
+            path.write_text(message)
+            return message
+        except Exception as e:
+            logger.warning(f"Could not pull {SQL_AGENT_PROMPT}, using the bundled prompt: {e}")
+    return sql_agent_system_prompt.format(dialect=dialect, top_k=top_k)
+
+
+def create_chat_model(
+    service: str,
+    model: Optional[str] = None,
+    temperature: float = 0,
+    max_tokens: Optional[int] = None,
+    timeout: Optional[float] = None,
+    max_retries: int = 2,
+    streaming: bool = False,
+    callbacks: Sequence = ()
+):
+    """
+    Create the chat model of a service, importing only its provider.
+
+    Args:
+        service (str): One of `LLMService`.
+        model (Optional[str]): Model name, the default of the service when None.
+        temperature (float): Sampling temperature.
+        max_tokens (Optional[int]): Tokens generated at most.
+        timeout (Optional[float]): Seconds a request may take,
+            `LOCAL_LLM_TIMEOUT` for the local services when None.
+        max_retries (int): Retries of a failed request. Ollama does not
+            retry.
+        streaming (bool): Whether tokens are streamed to the callbacks.
+            Ollama always streams.
+        callbacks (Sequence): Callback handlers of the model.
+
+    Returns:
+        BaseChatModel: The chat model.
+
+    Raises:
+        ImportError: If the provider package of the service is not installed.
+    """
+    service = LLMService(service)
+    model = model or SERVICE_MODELS[service]
+    callbacks = list(callbacks)
+    if LLM_RECORD_PATH and service != LLMService.RECORDED:
+        from rag.recorded_llm import LLMRecorder
+        callbacks.append(LLMRecorder(LLM_RECORD_PATH))
+
+    if service == LLMService.GOOGLE:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        return ChatGoogleGenerativeAI(
+            model=model, temperature=temperature, max_tokens=max_tokens, timeout=timeout,
+            max_retries=max_retries, streaming=streaming, callbacks=callbacks)
+    if service == LLMService.GROQ:
+        from langchain_groq import ChatGroq
+        return ChatGroq(
+            model=model, temperature=temperature, max_tokens=max_tokens, timeout=timeout,
+            max_retries=max_retries, streaming=streaming, callbacks=callbacks)
+    if service in LOCAL_SERVICES:
+        timeout = timeout or LOCAL_LLM_TIMEOUT
+    if service == LLMService.LOCAL:
+        from langchain_ollama import ChatOllama
+        # ChatOllama has no timeout, retry or streaming options, the timeout
+        # goes to its httpx client and the tokens are always streamed
+        return ChatOllama(
+            model=model, temperature=temperature, num_predict=max_tokens,
+            base_url=LOCAL_LLM_BASE_URL or None, keep_alive=LOCAL_LLM_KEEP_ALIVE,
+            num_ctx=LOCAL_LLM_NUM_CTX, client_kwargs={"timeout": timeout},
+            callbacks=callbacks)
+    if service == LLMService.OPENAI:
+        try:
+            from langchain_openai import ChatOpenAI
+        except ImportError as e:
+            raise ImportError(
+                "The openai service needs langchain-openai: pip install langchain-openai") from e
+        return ChatOpenAI(
+            model=model, temperature=temperature, max_tokens=max_tokens, timeout=timeout,
+            max_retries=max_retries, streaming=streaming, callbacks=callbacks,
+            base_url=LOCAL_LLM_BASE_URL or "http://localhost:8080/v1",
+            api_key=os.getenv("LOCAL_LLM_API_KEY", "local"), stream_usage=True,
+            # llama.cpp reuses the KV cache of the common prefix of the last request
+            extra_body={"cache_prompt": True})
+
+    from rag.recorded_llm import RecordedChatModel
+    return RecordedChatModel.from_file(
+        LLM_RECORDING or None, latency_scale=1 / LLM_REPLAY_SPEED, callbacks=callbacks)
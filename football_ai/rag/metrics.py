@@ -0,0 +1,291 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+ROOT_DIR = Path(__file__).parent.parent
+JOBS_FOLDER = ROOT_DIR / 'jobs'
+
+T = TypeVar("T")
+
+# seconds, from a fraction of a frame to a whole job
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+    30.0, 60.0, 300.0,
+)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """
+    Base class of the metrics, values are kept per combination of label values.
+
+    Attributes:
+        name (str): Name of the metric in the exposition format.
+        help (str): Description of the metric.
+        labels (Tuple[str, ...]): Names of the labels.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], float] = {}
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            return [
+                f"{self.name}{_format_labels(self.labels, key)} {value}"
+                for key, value in self.values.items()
+            ]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        return '\n'.join(lines + self.samples())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        self.sums: Dict[Tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self.sums[key] = self.sums.get(key, 0.0) + value
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self.lock:
+            for key, counts in self.counts.items():
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    labels = _format_labels(self.labels, key, f'le="{le}"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labels, key)
+                lines.append(f"{self.name}_sum{labels} {self.sums[key]}")
+                lines.append(f"{self.name}_count{labels} {counts[-1]}")
+        return lines
+
+
+REGISTRY: List[Metric] = []
+
+STAGE_SECONDS = Histogram(
+    'pipeline_stage_seconds', 'Time spent in each stage of the pipelines.',
+    labels=('service', 'stage'))
+FRAMES_TOTAL = Counter(
+    'pipeline_frames_total', 'Frames processed by the pipelines.', labels=('service',))
+JOBS_TOTAL = Counter(
+    'pipeline_jobs_total', 'Finished jobs by outcome.', labels=('service', 'status'))
+JOB_FPS = Gauge(
+    'pipeline_job_fps', 'Frames per second of the last job of each Service.',
+    labels=('service',))
+JOBS_IN_PROGRESS = Gauge('pipeline_jobs_in_progress', 'Jobs currently running.')
+QUEUE_DEPTH = Gauge(
+    'pipeline_queue_depth', 'Items waiting in the internal queues.', labels=('queue',))
+CACHE_REQUESTS = Counter(
+    'pipeline_cache_requests_total', 'Cache lookups by cache and result.',
+    labels=('cache', 'result'))
+
+
+def render() -> str:
+    """
+    Render every metric in the Prometheus text exposition format.
+    """
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+class JobTimer:
+    """
+    Per-job accumulator of stage timings, also feeding the global metrics.
+
+    Attributes:
+        service (str): Service of the job, used as metric label.
+        job_id (str): Id of the job, the video id of its output.
+        stages (Dict[str, List[float]]): Total seconds and count per stage.
+        frames (int): Frames processed so far.
+    """
+
+    def __init__(self, service: str, job_id: str):
+        self.service = str(service)
+        self.job_id = job_id
+        self.stages: Dict[str, List[float]] = {}
+        self.frames = 0
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    def add(self, stage: str, seconds: float) -> None:
+        total = self.stages.setdefault(stage, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+        STAGE_SECONDS.observe(seconds, service=self.service, stage=stage)
+
+    def frame(self, count: int = 1) -> None:
+        self.frames += count
+        FRAMES_TOTAL.inc(count, service=self.service)
+
+    def finish(self, status: str = 'success') -> None:
+        self.finished = time.perf_counter()
+        JOBS_TOTAL.inc(service=self.service, status=status)
+        if self.frames:
+            JOB_FPS.set(self.fps, service=self.service)
+
+    @property
+    def seconds(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def fps(self) -> float:
+        return self.frames / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self) -> dict:
+        return {
+            'job_id': self.job_id,
+            'service': self.service,
+            'frames': self.frames,
+            'seconds': self.seconds,
+            'fps': self.fps,
+            'stages': {
+                stage: {'seconds': total, 'count': count, 'mean_ms': 1000 * total / count}
+                for stage, (total, count) in self.stages.items()
+            },
+        }
+
+    def save(self, directory: Path = JOBS_FOLDER) -> Path:
+        """
+        Write the timing summary to `<directory>/<job_id>.json`.
+        """
+        directory.mkdir(exist_ok=True, parents=True)
+        path = directory / f"{self.job_id}.json"
+        path.write_text(json.dumps(self.summary(), indent=2))
+        return path
+
+
+_current_job: ContextVar[Optional[JobTimer]] = ContextVar('current_job', default=None)
+
+
+@contextmanager
+def job(service: str, job_id: str) -> Iterator[JobTimer]:
+    """
+    Time a job: stages timed inside the block are attributed to it, and its
+    summary is saved when the block exits.
+
+    Args:
+        service (str): Service of the job.
+        job_id (str): Id of the job.
+
+    Yields:
+        JobTimer: The timer of the job.
+    """
+    timer = JobTimer(service, job_id)
+    token = _current_job.set(timer)
+    JOBS_IN_PROGRESS.inc()
+    status = 'error'
+    try:
+        yield timer
+        status = 'success'
+    finally:
+        JOBS_IN_PROGRESS.dec()
+        _current_job.reset(token)
+        timer.finish(status)
+        timer.save()
+
+
+def current_job() -> Optional[JobTimer]:
+    return _current_job.get()
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """
+    Time a block as a stage of the current job.
+
+    Args:
+        stage (str): Name of the stage, e.g. 'player_detection'.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timer = _current_job.get()
+        if timer is not None:
+            timer.add(stage, elapsed)
+        else:
+            STAGE_SECONDS.observe(elapsed, service='', stage=stage)
+
+
+def timed_iter(iterable: Iterable[T], stage: str) -> Iterator[T]:
+    """
+    Time every step of an iterator, e.g. frame decoding, as a stage.
+
+    Args:
+        iterable (Iterable[T]): The iterable to time.
+        stage (str): Name of the stage.
+
+    Yields:
+        T: The items of the iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        with timed(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
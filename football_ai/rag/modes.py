@@ -0,0 +1,28 @@
+from enum import Enum
+
+
+class Service(str, Enum):
+    """
+    Enum class representing different modes of operation for Soccer AI video analysis.
+    """
+    PITCH_DETECTION = 'PITCH_DETECTION'
+    PLAYER_DETECTION = 'PLAYER_DETECTION'
+    BALL_DETECTION = 'BALL_DETECTION'
+    PLAYER_TRACKING = 'PLAYER_TRACKING'
+    TEAM_CLASSIFICATION = 'TEAM_CLASSIFICATION'
+    RADAR = 'RADAR'
+
+    def __contains__(self, item):
+        try:
+            self(item)
+        except ValueError:
+            return False
+        return True  
+
+    def __str__(self):
+        return self.value
+
+
+# all the outputs of a composite job share one detections table, rows are told
+# apart by their `service` and `video_id` columns
+COMPOSITE_TABLE = 'COMPOSITE'
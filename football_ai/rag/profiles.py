@@ -0,0 +1,192 @@
+import os
+from dataclasses import dataclass, field, replace
+from enum import Enum
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
+
+import numpy as np
+
+from rag.modes import Service
+
+if TYPE_CHECKING:
+    # the server reads the profiles, it only needs these once a job runs
+    import supervision as sv
+
+
+class Profile(str, Enum):
+    """
+    Enum class representing the inference profiles a user can pick for a job.
+    """
+    FAST = 'FAST'
+    BALANCED = 'BALANCED'
+    ACCURATE = 'ACCURATE'
+
+    def __str__(self):
+        return self.value
+
+
+@dataclass(frozen=True)
+class ServiceSettings:
+    """
+    Inference settings of a single Service.
+
+    Attributes:
+        imgsz (int): Inference size of the player (or ball) detection model.
+        pitch_imgsz (int): Inference size of the pitch keypoint model.
+        confidence (float): Minimum confidence kept by the detection models.
+        keyframe_interval (int): Run detection at most every N frames and
+            propagate boxes in between.
+        fit_stride (int): Frame stride used to sample crops for team fitting.
+        batch_size (int): Number of crops embedded per team classifier batch.
+        team_strategy (Optional[str]): Team classification strategy, SIGLIP or
+            COLOR. None uses the `TEAM_CLASSIFIER_STRATEGY` environment variable.
+    """
+    imgsz: int = 1280
+    pitch_imgsz: int = 640
+    confidence: float = 0.25
+    keyframe_interval: int = 1
+    fit_stride: int = 60
+    batch_size: int = 32
+    team_strategy: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class InferenceProfile:
+    """
+    A named set of per-Service inference settings.
+
+    Attributes:
+        name (Profile): Name of the profile, recorded with the results.
+        max_resolution (Optional[int]): Longest side, in pixels, decoded frames are
+            downscaled to before being shared between models. None keeps the
+            source resolution.
+        services (Dict[Service, ServiceSettings]): Settings overriding `default`
+            for specific services.
+        default (ServiceSettings): Settings of services without an override.
+    """
+    name: Profile
+    max_resolution: Optional[int] = None
+    services: Dict[Service, ServiceSettings] = field(default_factory=dict)
+    default: ServiceSettings = ServiceSettings()
+
+    def settings(self, service: Service) -> ServiceSettings:
+        return self.services.get(service, self.default)
+
+
+_ACCURATE = ServiceSettings()
+_BALANCED = ServiceSettings(imgsz=960, confidence=0.3, keyframe_interval=2)
+_FAST = ServiceSettings(
+    imgsz=640, pitch_imgsz=480, confidence=0.35, keyframe_interval=5,
+    fit_stride=90, batch_size=64, team_strategy='COLOR')
+
+PROFILES: Dict[Profile, InferenceProfile] = {
+    Profile.ACCURATE: InferenceProfile(
+        name=Profile.ACCURATE,
+        default=_ACCURATE,
+    ),
+    Profile.BALANCED: InferenceProfile(
+        name=Profile.BALANCED,
+        max_resolution=1280,
+        default=_BALANCED,
+        services={
+            # the ball is too small and too fast to be propagated between frames
+            Service.BALL_DETECTION: replace(_BALANCED, imgsz=640, keyframe_interval=1),
+        },
+    ),
+    Profile.FAST: InferenceProfile(
+        name=Profile.FAST,
+        max_resolution=960,
+        default=_FAST,
+        services={
+            Service.BALL_DETECTION: replace(_FAST, keyframe_interval=1),
+        },
+    ),
+}
+
+DEFAULT_PROFILE = Profile(os.getenv("DEFAULT_INFERENCE_PROFILE", "ACCURATE").upper())
+
+
+def get_profile(name: Optional[str] = None) -> InferenceProfile:
+    """
+    Look up an inference profile by name.
+
+    Args:
+        name (Optional[str]): Case-insensitive profile name. Defaults to the
+            `DEFAULT_INFERENCE_PROFILE` environment variable.
+
+    Returns:
+        InferenceProfile: The matching profile.
+
+    Raises:
+        ValueError: If the profile does not exist.
+    """
+    if name is None:
+        return PROFILES[DEFAULT_PROFILE]
+    try:
+        return PROFILES[Profile(name.upper())]
+    except ValueError:
+        raise ValueError(
+            f"Unknown inference profile {name}, expected one of "
+            f"{', '.join(profile.value for profile in Profile)}") from None
+
+
+def downscale(frame: np.ndarray, max_resolution: Optional[int]) -> Tuple[np.ndarray, float]:
+    """
+    Downscale a frame so that its longest side fits the profile resolution.
+
+    Args:
+        frame (np.ndarray): The decoded frame.
+        max_resolution (Optional[int]): Longest side in pixels, or None.
+
+    Returns:
+        Tuple[np.ndarray, float]: The (possibly) resized frame and the scale that
+            was applied to it.
+    """
+    h, w = frame.shape[:2]
+    if not max_resolution or max(h, w) <= max_resolution:
+        return frame, 1.0
+    import cv2
+
+    scale = max_resolution / max(h, w)
+    resized = cv2.resize(
+        frame, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+    return resized, scale
+
+
+def upscale_detections(detections: 'sv.Detections', scale: float) -> 'sv.Detections':
+    """
+    Map detections found on a downscaled frame back to source coordinates.
+
+    Args:
+        detections (sv.Detections): Detections on the downscaled frame.
+        scale (float): Scale returned by `downscale`.
+
+    Returns:
+        sv.Detections: A copy of the detections in source coordinates.
+    """
+    if scale == 1.0:
+        return detections
+    upscaled = detections[np.arange(len(detections))]
+    upscaled.xyxy = detections.xyxy / scale
+    return upscaled
+
+
+def upscale_keypoints(keypoints: 'sv.KeyPoints', scale: float) -> 'sv.KeyPoints':
+    """
+    Map keypoints found on a downscaled frame back to source coordinates.
+
+    Args:
+        keypoints (sv.KeyPoints): Keypoints on the downscaled frame.
+        scale (float): Scale returned by `downscale`.
+
+    Returns:
+        sv.KeyPoints: Keypoints in source coordinates.
+    """
+    if scale == 1.0:
+        return keypoints
+    import supervision as sv
+
+    return sv.KeyPoints(
+        xy=keypoints.xy / scale,
+        confidence=keypoints.confidence,
+        class_id=keypoints.class_id
+    )
@@ -0,0 +1,151 @@
+import os
+import sys
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Iterator, Optional
+
+from rag.metrics import JOBS_FOLDER
+
+# seconds between two stack samples of the profiled thread
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+# deepest stack kept, recursion past it is cut at the root
+PROFILE_MAX_DEPTH = 128
+
+
+class ProfileFormat(str, Enum):
+    """
+    Enum class representing the outputs of a profiled job.
+    """
+    COLLAPSED = 'COLLAPSED'
+    TORCH = 'TORCH'
+    TORCH_TABLE = 'TORCH_TABLE'
+
+    def __str__(self):
+        return self.value
+
+
+PROFILE_SUFFIXES: Dict[ProfileFormat, str] = {
+    # folded stacks, for flamegraph.pl, speedscope or inferno
+    ProfileFormat.COLLAPSED: '.collapsed.txt',
+    # chrome trace of the torch operators, for chrome://tracing or perfetto
+    ProfileFormat.TORCH: '.torch.json',
+    ProfileFormat.TORCH_TABLE: '.torch.txt',
+}
+
+
+def profile_path(job_id: str, format: ProfileFormat, directory: Path = JOBS_FOLDER) -> Path:
+    return directory / f"{job_id}{PROFILE_SUFFIXES[ProfileFormat(format)]}"
+
+
+class StackSampler:
+    """
+    Sampling profiler of a single thread.
+
+    A background thread reads the current stack of the profiled thread every
+    `interval` seconds and counts identical stacks. The profiled thread itself is
+    never interrupted, so its overhead is one stack walk per sample.
+
+    Attributes:
+        thread_id (int): Identifier of the profiled thread.
+        interval (float): Seconds between two samples.
+        stacks (Counter): Number of samples of each collapsed stack.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _label(frame) -> str:
+        code = frame.f_code
+        # ';' separates the frames of the folded format
+        label = f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+        return label.replace(';', ':')
+
+    def sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        labels = []
+        while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+            labels.append(self._label(frame))
+            frame = frame.f_back
+        if labels:
+            self.stacks[';'.join(reversed(labels))] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        """
+        Render the samples in the folded stack format, one `stack count` per line.
+        """
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+@contextmanager
+def profile_job(
+    job_id: str,
+    directory: Path = JOBS_FOLDER,
+    interval: float = PROFILE_SAMPLE_INTERVAL,
+    with_torch: bool = True
+) -> Iterator[StackSampler]:
+    """
+    Profile the calling thread for the duration of the block and save the outputs
+    next to the job timings.
+
+    The Python stacks are sampled, and the torch operators of the models, on
+    every thread, are recorded by the torch profiler when torch is installed.
+    Work done in other processes, such as the workers of segmented jobs, is not
+    profiled.
+
+    Args:
+        job_id (str): Id of the job, prefix of the output files.
+        directory (Path): Where to write the outputs.
+        interval (float): Seconds between two stack samples.
+        with_torch (bool): Also run the torch profiler.
+
+    Yields:
+        StackSampler: The running sampler.
+    """
+    sampler = StackSampler(threading.get_ident(), interval=interval)
+    torch_profiler = None
+    if with_torch:
+        try:
+            import torch
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            torch_profiler = torch.profiler.profile(activities=activities)
+        except ImportError:
+            pass
+
+    if torch_profiler is not None:
+        torch_profiler.__enter__()
+    sampler.start()
+    try:
+        yield sampler
+    finally:
+        sampler.stop()
+        directory.mkdir(exist_ok=True, parents=True)
+        profile_path(job_id, ProfileFormat.COLLAPSED, directory).write_text(sampler.collapsed())
+        if torch_profiler is not None:
+            torch_profiler.__exit__(None, None, None)
+            torch_profiler.export_chrome_trace(
+                profile_path(job_id, ProfileFormat.TORCH, directory).as_posix())
+            profile_path(job_id, ProfileFormat.TORCH_TABLE, directory).write_text(
+                torch_profiler.key_averages().table(sort_by='self_cpu_time_total', row_limit=50))
@@ -0,0 +1,251 @@
+"""
+Compact schema of the detections for the system prompt of the agent.
+
+The prompt used to embed the DDL and sample rows of every detections table and
+the description of every column, for each LLM call of every question. The
+summary lists only the tables holding the video, with the type of each column
+and its range or most frequent values for that video, and the descriptions of
+the columns it lists. It is cached per video and data version, and falls back
+to column names only when it exceeds the prompt budget.
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import text
+
+from rag import metrics
+from rag.answer_cache import read_data_version
+from rag.database import get_engine
+from rag.prompts import column_descriptions
+from rag.router import DETECTION_TABLES
+
+# approximate tokens the schema may take in the prompt, above it the column
+# statistics are left out
+PROMPT_SCHEMA_BUDGET = int(os.getenv("PROMPT_SCHEMA_BUDGET", "1500"))
+# schema summaries kept across videos
+SCHEMA_SUMMARY_CACHE_SIZE = int(os.getenv("SCHEMA_SUMMARY_CACHE_SIZE", "256"))
+# most frequent values listed for a text column
+TOP_VALUES = 6
+# columns the agent is told not to read
+HIDDEN_COLUMNS = {'mask'}
+# characters per token of English and SQL for the usual tokenizers
+CHARS_PER_TOKEN = 4
+
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+SCHEMA_TOKENS = metrics.Histogram(
+    'agent_schema_tokens', 'Estimated tokens of the schema in the agent prompt.',
+    buckets=TOKEN_BUCKETS)
+PROMPT_TOKENS = metrics.Histogram(
+    'agent_prompt_tokens', 'Prompt tokens of each LLM call of the agent.',
+    buckets=TOKEN_BUCKETS)
+QUESTION_PROMPT_TOKENS = metrics.Histogram(
+    'agent_question_prompt_tokens', 'Prompt tokens of all the LLM calls of a question.',
+    buckets=TOKEN_BUCKETS + (128000, 256000))
+FIRST_TOKEN_SECONDS = metrics.Histogram(
+    'agent_first_token_seconds', 'Time from the start of an LLM call to its first token.')
+QUESTION_SECONDS = metrics.Histogram(
+    'agent_question_seconds', 'Time to answer a question with the agent.')
+
+
+def estimate_tokens(content: str) -> int:
+    return math.ceil(len(content) / CHARS_PER_TOKEN)
+
+
+def prompt_tokens(response: Any) -> Optional[int]:
+    """
+    Prompt tokens of an LLM call as reported by the provider, from the usage
+    metadata of the message or the token usage of the response.
+    """
+    for generations in getattr(response, 'generations', None) or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+            if usage and usage.get('input_tokens') is not None:
+                return usage['input_tokens']
+    usage = (getattr(response, 'llm_output', None) or {}).get('token_usage') or {}
+    return usage.get('prompt_tokens')
+
+
+def _describe_columns(columns: set) -> str:
+    # the lines of the descriptions of the columns present
+    lines = [
+        line for line in column_descriptions.strip().splitlines()
+        if not line.startswith('- ') or line[2:].split(':')[0] in columns]
+    return "\n".join(lines)
+
+
+@dataclass(frozen=True)
+class SchemaSummary:
+    """
+    Schema of the detections of a video, as given to the agent.
+
+    Attributes:
+        tables (List[str]): Tables holding detections of the video.
+        table_info (str): Columns of each table with their statistics.
+        column_descriptions (str): Descriptions of the listed columns.
+        tokens (int): Estimated tokens of the summary.
+        compact (bool): Whether the statistics were left out for the budget.
+        build_ms (float): Time to compute the summary.
+    """
+    tables: List[str]
+    table_info: str
+    column_descriptions: str
+    tokens: int
+    compact: bool
+    build_ms: float
+
+
+def _column_stats(
+    conn: Connection, table: str, columns: List[Tuple[str, str]], params: Dict
+) -> Tuple[int, Dict[str, str]]:
+    where = "video_id = :video_id" + (" AND project = :project" if 'project' in params else "")
+    numeric = [name for name, kind in columns if kind not in ('TEXT', '')]
+    aggregates = ["COUNT(*)"] + [
+        f'MIN("{name}"), MAX("{name}"), COUNT(DISTINCT "{name}")' for name in numeric]
+    row = conn.execute(text(
+        f'SELECT {", ".join(aggregates)} FROM "{table}" WHERE {where}'), params).one()
+
+    stats: Dict[str, str] = {}
+    for index, name in enumerate(numeric):
+        low, high, distinct = row[1 + 3 * index:4 + 3 * index]
+        if low is None:
+            stats[name] = "empty"
+        elif distinct > TOP_VALUES:
+            # the distinct ids of a column tell the agent how many objects there are
+            stats[name] = (
+                f"{low:g}..{high:g}" if isinstance(low, float)
+                else f"{low}..{high}, {distinct} distinct")
+    # text columns and numbers with few values, e.g. flags, list their values
+    for name, kind in columns:
+        if name in stats:
+            continue
+        values = conn.execute(text(
+            f'SELECT "{name}", COUNT(*) FROM "{table}" WHERE {where} '
+            f'GROUP BY 1 ORDER BY 2 DESC LIMIT {TOP_VALUES + 1}'), params).all()
+        listed = ", ".join(f"{value!r}: {count}" for value, count in values[:TOP_VALUES])
+        stats[name] = listed + (", ..." if len(values) > TOP_VALUES else "")
+    return row[0], stats
+
+
+def summarize_schema(
+    conn: Connection, project_id: str, video_id: str, budget: int = PROMPT_SCHEMA_BUDGET
+) -> SchemaSummary:
+    """
+    Summarize the detections tables holding a video.
+
+    Args:
+        conn (Connection): Connection to the detections database.
+        project_id (str): Project of the video.
+        video_id (str): The video.
+        budget (int): Tokens the summary may take before the statistics are
+            left out.
+
+    Returns:
+        SchemaSummary: The tables, their columns and descriptions.
+    """
+    start = time.perf_counter()
+    existing = {row[0] for row in conn.execute(
+        text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+    tables, detailed, compact, listed = [], [], [], set()
+    for table in DETECTION_TABLES:
+        if table not in existing:
+            continue
+        if not conn.execute(
+                text(f'SELECT 1 FROM "{table}" WHERE video_id = :video_id LIMIT 1'),
+                {"video_id": video_id}).first():
+            continue
+        columns = [
+            (row[1], row[2].upper()) for row in conn.execute(text(f'PRAGMA table_info("{table}")'))]
+        params = {"video_id": video_id}
+        if any(name == 'project' for name, _ in columns):
+            params["project"] = project_id
+        visible = [(name, kind) for name, kind in columns if name not in HIDDEN_COLUMNS]
+        rows, stats = _column_stats(conn, table, visible, params)
+
+        tables.append(table)
+        listed.update(name for name, _ in visible)
+        detailed.append(f"{table} ({rows} rows):\n" + "\n".join(
+            f"  {name} {kind}: {stats[name]}" for name, kind in visible))
+        compact.append(f"{table} ({rows} rows): " + ", ".join(
+            f"{name} {kind}" for name, kind in visible))
+
+    descriptions = _describe_columns(listed)
+    table_info = "\n".join(detailed)
+    is_compact = estimate_tokens(table_info + descriptions) > budget
+    if is_compact:
+        table_info = "\n".join(compact)
+    return SchemaSummary(
+        tables=tables,
+        table_info=table_info,
+        column_descriptions=descriptions,
+        tokens=estimate_tokens(table_info + descriptions),
+        compact=is_compact,
+        build_ms=1000 * (time.perf_counter() - start),
+    )
+
+
+class SchemaSummaryCache:
+    """
+    Schema summaries keyed by video and detections data version, so that new
+    detections of a video give it a new summary.
+
+    Attributes:
+        engine (Engine): Read-only engine of the detections database.
+        max_size (int): Number of summaries kept.
+        budget (int): Tokens a summary may take with its statistics.
+    """
+
+    def __init__(
+        self,
+        detection_db_path: str = 'detections.db',
+        max_size: int = SCHEMA_SUMMARY_CACHE_SIZE,
+        budget: int = PROMPT_SCHEMA_BUDGET
+    ):
+        self.engine: Engine = get_engine(detection_db_path, read_only=True)
+        self.max_size = max_size
+        self.budget = budget
+        self._entries: "OrderedDict[Tuple[str, str, int], SchemaSummary]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, project_id: str, video_id: str) -> SchemaSummary:
+        version = read_data_version(self.engine, video_id)
+        key = (str(project_id), str(video_id), version)
+        with self._lock:
+            if version is not None and key in self._entries:
+                self._entries.move_to_end(key)
+                metrics.CACHE_REQUESTS.inc(cache='schema', result='hit')
+                return self._entries[key]
+
+        metrics.CACHE_REQUESTS.inc(cache='schema', result='miss')
+        with self.engine.connect() as conn:
+            summary = summarize_schema(conn, str(project_id), str(video_id), self.budget)
+        SCHEMA_TOKENS.observe(summary.tokens)
+        logger.info(
+            f"Schema summary of video {video_id}: {len(summary.tables)} tables, "
+            f"~{summary.tokens} tokens in {summary.build_ms:.0f}ms")
+        if version is None:
+            return summary
+        with self._lock:
+            # older versions of the video are never asked for again
+            for stale in [k for k in self._entries if k[:2] == key[:2] and k != key]:
+                del self._entries[stale]
+            self._entries[key] = summary
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return summary
+
+
+@lru_cache(maxsize=None)
+def get_schema_summaries(detection_db_path: str = 'detections.db') -> SchemaSummaryCache:
+    return SchemaSummaryCache(detection_db_path)
@@ -75,6 +75,22 @@
 
 # """
 
+# copy of langchain-ai/sql-agent-system-prompt on the LangChain hub, used offline
+sql_agent_system_prompt = """System: You are an agent designed to interact with a SQL database.
+Given an input question, create a syntactically correct {dialect} query to run, then look at the results of the query and return the answer.
+Unless the user specifies a specific number of examples they wish to obtain, always limit your query to at most {top_k} results.
+You can order the results by a relevant column to return the most interesting examples in the database.
+Never query for all the columns from a specific table, only ask for the relevant columns given the question.
+You have access to tools for interacting with the database.
+Only use the below tools. Only use the information returned by the below tools to construct your final answer.
+You MUST double check your query before executing it. If you get an error while executing a query, rewrite the query and try again.
+
+DO NOT make any DML statements (INSERT, UPDATE, DELETE, DROP etc.) to the database.
+
+To start you should ALWAYS look at the tables in the database to see what you can query.
+Do NOT skip this step.
+Then you should query the schema of the most relevant tables."""
+
 sql_system_message = """
 {base_system_message} 
 
@@ -83,7 +99,7 @@ sql_system_message = """
 You have access to the following tables: 
 {tables}
 
-Here is the schema and example data from each table: 
+Here are the columns of each table for this video, with their type and their range or most frequent values: 
 {table_info}
 
 You can use the following tools:
@@ -142,6 +158,9 @@ The following columns are available in the dataset:
 - tracker_id: The unique ID assigned to the detected object. This should be used when asking for information about a specific object.
 - class_name: The type or kind of the detected object. This can take the value of `player`, `goalkeeper`, `ball`,  or `referee`.
 - frame: The frame number in which the object was detected.
+- interpolated: 1 when the bounding box was propagated from a previous frame instead of detected. Prefer rows where this is 0 for precise measurements.
+- profile: The inference profile (`FAST`, `BALANCED` or `ACCURATE`) the video was processed with.
+- service: Only in the `COMPOSITE` table, the analysis (e.g. `PLAYER_TRACKING`, `RADAR`) that produced the row. Filter on it to avoid counting the same detection once per analysis.
 - project: The name of the current project that should be queried.
 - video_id: The video within the project that the detection was made.
 """
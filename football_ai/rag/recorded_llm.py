@@ -0,0 +1,251 @@
+"""
+Recording and replay of the responses of the agent's chat model.
+
+`LLMRecorder` appends every response of a model, its text, tool calls, prompt
+tokens and latencies, to a JSON lines file. `RecordedChatModel` replays them
+with the same latencies, so that the agent, its tools and the streaming path
+can be run and benchmarked without network access or a GPU.
+
+    LLM_RECORD_PATH=recording.jsonl      record the answers of the agent
+    AGENT_LLM_SERVICE=recorded LLM_RECORDING=recording.jsonl
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import asyncio
+import json
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun, BaseCallbackHandler, CallbackManagerForLLMRun
+)
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import Field
+
+from rag.prompt_budget import estimate_tokens, prompt_tokens
+
+DEFAULT_ANSWER = "Final Answer: I don't know."
+
+
+def call_question(messages: Sequence[BaseMessage], metadata: Optional[Dict]) -> str:
+    """
+    The question an LLM call is answering, given in the metadata of the run by
+    the agent, the last human message otherwise.
+    """
+    if metadata and metadata.get('question'):
+        return metadata['question']
+    humans = [message for message in messages if message.type == 'human']
+    return str(humans[-1].content) if humans else ""
+
+
+def call_step(messages: Sequence[BaseMessage], question: str) -> int:
+    """
+    The step of an LLM call in the answer to a question: the model calls made
+    since it was asked, so that a question asked again starts over.
+
+    The agent renders the conversation into one human message, where the calls
+    are the AI messages written after the last time the question appears.
+    """
+    step = 0
+    for message in reversed(messages):
+        if message.type == 'human':
+            break
+        step += message.type == 'ai'
+    if step:
+        return step
+    humans = [message for message in messages if message.type == 'human']
+    rendered = str(humans[-1].content) if humans else ""
+    position = rendered.rfind(question) if question else -1
+    if position < 0:
+        position = max(rendered.rfind("HumanMessage("), 0)
+    return rendered.count("AIMessage(", position)
+
+
+def load_recording(path: Path) -> Dict[str, List[Dict]]:
+    """
+    The recorded responses of each question, in the order of their steps.
+    """
+    recording: Dict[str, List[Dict]] = {}
+    for line in Path(path).read_text().splitlines():
+        if line.strip():
+            record = json.loads(line)
+            recording.setdefault(record['question'], []).append(record)
+    for steps in recording.values():
+        steps.sort(key=lambda record: record['step'])
+    return recording
+
+
+class LLMRecorder(BaseCallbackHandler):
+    """
+    Callback handler appending the responses of a chat model to a JSON lines
+    file, one line per LLM call, numbered by their step in the answer.
+
+    Attributes:
+        path (Path): The recording.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._calls: Dict[UUID, Dict] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(
+        self,
+        serialized: Dict,
+        messages: List[List[BaseMessage]],
+        *,
+        run_id: UUID,
+        metadata: Optional[Dict] = None,
+        **kwargs: Any
+    ) -> None:
+        question = call_question(messages[0], metadata)
+        self._calls[run_id] = {
+            "question": question, "step": call_step(messages[0], question),
+            "start": time.perf_counter(), "first_token": None,
+        }
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        call = self._calls.get(run_id)
+        if call is not None and call["first_token"] is None:
+            call["first_token"] = time.perf_counter()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._calls.pop(run_id, None)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        end = time.perf_counter()
+        message = response.generations[0][0].message
+        record = {
+            "question": call["question"],
+            "step": call["step"],
+            "content": message.content,
+            "tool_calls": [
+                {"name": tool_call["name"], "args": tool_call["args"], "id": tool_call["id"]}
+                for tool_call in getattr(message, 'tool_calls', [])],
+            "prompt_tokens": prompt_tokens(response),
+            "first_token_seconds": (call["first_token"] or end) - call["start"],
+            "seconds": end - call["start"],
+        }
+        with self._lock, self.path.open('a') as file:
+            file.write(json.dumps(record) + "\n")
+
+
+class RecordedChatModel(BaseChatModel):
+    """
+    Chat model replaying recorded responses with their latencies.
+
+    The response of a call is the recorded one of the same question and step,
+    the step being read from the conversation, or of the first recorded
+    question for questions that were not recorded. Tools are
+    accepted and ignored, the tool calls are those recorded.
+
+    Attributes:
+        recording (Dict[str, List[Dict]]): Responses per question, in step order.
+        latency_scale (float): Factor on the recorded latencies, 0 to answer
+            right away.
+    """
+    recording: Dict[str, List[Dict]] = Field(default_factory=dict)
+    latency_scale: float = 1.0
+
+    @classmethod
+    def from_file(cls, path: Optional[str], **kwargs: Any) -> "RecordedChatModel":
+        return cls(recording=load_recording(path) if path else {}, **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "recorded"
+
+    def bind_tools(self, tools: Sequence, **kwargs: Any) -> "RecordedChatModel":
+        return self
+
+    def _question(self, messages: List[BaseMessage]) -> str:
+        # the agent renders the conversation into one human message, the
+        # recorded question asked last in it is the one being answered
+        question = call_question(messages, None)
+        if question in self.recording:
+            return question
+        found = [(question.rfind(recorded), recorded) for recorded in self.recording]
+        position, recorded = max(found, default=(-1, ""))
+        return recorded if position >= 0 else next(iter(self.recording), "")
+
+    def _record(self, messages: List[BaseMessage]) -> Dict:
+        question = self._question(messages)
+        step = call_step(messages, question)
+        steps = self.recording.get(question, [])
+        if step < len(steps):
+            return steps[step]
+        return {"content": DEFAULT_ANSWER, "tool_calls": []}
+
+    def _usage(self, record: Dict, messages: List[BaseMessage]) -> Dict[str, int]:
+        # the prompt of the replay, not the recorded one, is what the agent sent
+        input_tokens = estimate_tokens("".join(str(message.content) for message in messages))
+        output_tokens = estimate_tokens(str(record.get("content", "")))
+        return {
+            "input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        record = self._record(messages)
+        time.sleep(record.get("seconds", 0) * self.latency_scale)
+        message = AIMessage(
+            content=record.get("content", ""),
+            tool_calls=[
+                {**tool_call, "type": "tool_call"} for tool_call in record.get("tool_calls", [])],
+            usage_metadata=self._usage(record, messages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> ChatResult:
+        # streamed like the hosted models of the agent, token callbacks included
+        return await agenerate_from_stream(
+            self._astream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        record = self._record(messages)
+        first_token = record.get("first_token_seconds", 0) * self.latency_scale
+        await asyncio.sleep(first_token)
+        pieces = re.findall(r"\s*\S+|\s+$", str(record.get("content", "")))
+        rest = max(record.get("seconds", 0) * self.latency_scale - first_token, 0)
+        for index, piece in enumerate(pieces):
+            if index:
+                await asyncio.sleep(rest / len(pieces))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content="",
+            tool_call_chunks=[
+                {"name": tool_call["name"], "args": json.dumps(tool_call["args"]),
+                 "id": tool_call.get("id"), "index": index}
+                for index, tool_call in enumerate(record.get("tool_calls", []))],
+            usage_metadata=self._usage(record, messages)))
@@ -0,0 +1,414 @@
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import re
+import time
+from dataclasses import dataclass
+from enum import Enum
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Pattern, Tuple
+
+from loguru import logger
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import TextClause, text
+
+from rag import metrics
+from rag.database import get_engine, run_sync
+from rag.modes import COMPOSITE_TABLE, Service
+
+DETECTION_TABLES = [str(service) for service in Service] + [COMPOSITE_TABLE]
+# same rule the agent is given in its system prompt
+MIN_CONFIDENCE = 0.8
+
+ROUTER_REQUESTS = metrics.Counter(
+    'agent_router_requests_total', 'Chat questions by fast path intent.',
+    labels=('intent',))
+
+
+class Intent(str, Enum):
+    """
+    Enum class representing the questions answered without the agent.
+    """
+    DISTANCE_LEADER = 'DISTANCE_LEADER'
+    BALL_HALF = 'BALL_HALF'
+    OBJECT_COUNT = 'OBJECT_COUNT'
+    MOST_VISIBLE = 'MOST_VISIBLE'
+    BALL_DETECTED = 'BALL_DETECTED'
+    VIDEO_LENGTH = 'VIDEO_LENGTH'
+
+    def __str__(self):
+        return self.value
+
+
+# qualifiers the templates cannot honour, e.g. "who ran the most in the first
+# half" or "how many players and referees", go to the agent
+UNSUPPORTED = re.compile(
+    r"\b(team|teams|between|after|before|first|second|last|minutes?|seconds?|"
+    r"compare|than|each|per|average|and|or|except|without)\b|\d")
+# only the ball template knows about parts of the pitch
+REGIONS = re.compile(r"\b(half|side|area|box|zone|third|wing|goal|corner)\b")
+
+TEMPLATES: List[Tuple[Intent, Pattern]] = [
+    (Intent.DISTANCE_LEADER, re.compile(
+        r"\b(who|which player)\b.*\b(ran|run|runs|covered|cover|moved|move|travell?ed)\b"
+        r".*\b(most|furthest|farthest|longest|distance)\b")),
+    (Intent.BALL_HALF, re.compile(
+        r"\bball\b.*\b(?P<side>left|right)( side| half)\b")),
+    (Intent.OBJECT_COUNT, re.compile(
+        r"\bhow many (different |distinct |unique )?"
+        r"(?P<class_name>players?|goalkeepers?|goalies?|referees?|refs?)\b")),
+    (Intent.MOST_VISIBLE, re.compile(
+        r"^(?=.*\b(which|what|who)\b)(?=.*\b(most|longest)\b)"
+        r"(?=.*\b(seen|visible|on screen|appear|appears|appeared|detected|tracked)\b)")),
+    (Intent.BALL_DETECTED, re.compile(
+        r"\bhow (often|many frames|long)\b.*\bball\b.*\b(detected|seen|visible|tracked)\b")),
+    # the frame rate is not stored, "how long" in seconds is left to the agent
+    (Intent.VIDEO_LENGTH, re.compile(
+        r"\bhow many frames\b.*\b(video|clip)\b")),
+]
+
+CLASS_NAMES = {
+    'player': 'player', 'goalkeeper': 'goalkeeper', 'goalie': 'goalkeeper',
+    'referee': 'referee', 'ref': 'referee',
+}
+# class of the detections each intent reads, OBJECT_COUNT reads the one asked for
+INTENT_CLASSES = {
+    Intent.DISTANCE_LEADER: 'player',
+    Intent.BALL_HALF: 'ball',
+    Intent.MOST_VISIBLE: 'player',
+    Intent.BALL_DETECTED: 'ball',
+}
+# the COMPOSITE table stores a detection once per analysis sharing it, the
+# templates read the rows of one of them, tracked ones first
+SERVICE_PREFERENCE = [
+    str(service) for service in (
+        Service.PLAYER_TRACKING, Service.TEAM_CLASSIFICATION, Service.RADAR,
+        Service.BALL_DETECTION, Service.PLAYER_DETECTION)]
+
+# `{service}` is filled in when the query is compiled for a table
+_FILTER = (
+    "project = :project AND video_id = :video_id AND confidence > :confidence{service}")
+
+SQL_TEMPLATES: Dict[Intent, str] = {
+    # distance between box centers of consecutive detections of each tracker,
+    # in pixels, the detections have no pitch coordinates
+    Intent.DISTANCE_LEADER: f"""
+        WITH centers AS (
+            SELECT tracker_id, frame,
+                   (x_min + x_max) / 2.0 AS x, (y_min + y_max) / 2.0 AS y
+            FROM {{table}}
+            WHERE {_FILTER} AND class_name = 'player' AND tracker_id IS NOT NULL
+        ), steps AS (
+            SELECT tracker_id,
+                   x - LAG(x) OVER tracks AS dx, y - LAG(y) OVER tracks AS dy
+            FROM centers
+            WINDOW tracks AS (PARTITION BY tracker_id ORDER BY frame)
+        )
+        SELECT tracker_id, SUM(SQRT(dx * dx + dy * dy)) AS distance, COUNT(*) + 1 AS frames
+        FROM steps
+        WHERE dx IS NOT NULL
+        GROUP BY tracker_id
+        ORDER BY distance DESC
+        LIMIT 1
+    """,
+    # the frame width is not stored, the right edge of the furthest detection
+    # stands in for it
+    Intent.BALL_HALF: f"""
+        WITH ball AS (
+            SELECT frame, AVG((x_min + x_max) / 2.0) AS x
+            FROM {{table}}
+            WHERE {_FILTER} AND class_name = 'ball'
+            GROUP BY frame
+        ), width AS (
+            SELECT MAX(x_max) AS w
+            FROM {{table}}
+            WHERE project = :project AND video_id = :video_id
+        )
+        SELECT SUM(x < w / 2.0) AS left_frames, SUM(x >= w / 2.0) AS right_frames,
+               COUNT(*) AS frames
+        FROM ball, width
+    """,
+    Intent.OBJECT_COUNT: f"""
+        WITH objects AS (
+            SELECT frame, tracker_id
+            FROM {{table}}
+            WHERE {_FILTER} AND class_name = :class_name
+        )
+        SELECT (SELECT COUNT(DISTINCT tracker_id) FROM objects) AS tracked,
+               (SELECT MAX(count) FROM (
+                    SELECT COUNT(*) AS count FROM objects GROUP BY frame)) AS most_in_frame,
+               -- whether the table holds the class at all, at any confidence
+               EXISTS (SELECT 1 FROM {{table}}
+                       WHERE project = :project AND video_id = :video_id
+                       AND class_name = :class_name) AS stored
+    """,
+    Intent.MOST_VISIBLE: f"""
+        SELECT tracker_id, COUNT(DISTINCT frame) AS frames
+        FROM {{table}}
+        WHERE {_FILTER} AND class_name = 'player' AND tracker_id IS NOT NULL
+        GROUP BY tracker_id
+        ORDER BY frames DESC
+        LIMIT 1
+    """,
+    Intent.BALL_DETECTED: f"""
+        SELECT (SELECT COUNT(DISTINCT frame) FROM {{table}}
+                WHERE {_FILTER} AND class_name = 'ball') AS ball_frames,
+               (SELECT MAX(frame) + 1 FROM {{table}}
+                WHERE project = :project AND video_id = :video_id) AS frames
+    """,
+    Intent.VIDEO_LENGTH: """
+        SELECT MAX(frame) + 1 AS frames
+        FROM {table}
+        WHERE project = :project AND video_id = :video_id
+    """,
+}
+
+
+@dataclass(frozen=True)
+class FastAnswer:
+    """
+    An answer computed without the agent.
+
+    Attributes:
+        intent (Intent): The matched question template.
+        text (str): The answer.
+        query_ms (float): Time spent running the SQL.
+    """
+    intent: Intent
+    text: str
+    query_ms: float
+
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", question.lower())).strip()
+
+
+def match_intent(question: str) -> Optional[Tuple[Intent, Dict[str, str]]]:
+    """
+    Match a question against the templates.
+
+    Args:
+        question (str): The question of the user.
+
+    Returns:
+        Optional[Tuple[Intent, Dict[str, str]]]: The intent and the values it
+            captured, or None when the question needs the agent.
+    """
+    question = normalize_question(question)
+    if UNSUPPORTED.search(question):
+        return None
+    for intent, pattern in TEMPLATES:
+        match = pattern.search(question)
+        if match and intent != Intent.BALL_HALF and REGIONS.search(question):
+            return None
+        if match:
+            return intent, {
+                key: value for key, value in match.groupdict().items() if value}
+    return None
+
+
+@lru_cache(maxsize=None)
+def compiled_query(intent: Intent, table: str) -> TextClause:
+    """
+    The query of an intent over a detections table, compiled once.
+    """
+    if table not in DETECTION_TABLES:
+        raise ValueError(f"Unknown detections table {table}")
+    service = " AND service = :service" if table == COMPOSITE_TABLE else ""
+    return text(SQL_TEMPLATES[intent].format(table=f'"{table}"', service=service))
+
+
+def _plural(name: str, count: int) -> str:
+    return name if count == 1 else f"{name}s"
+
+
+def format_answer(intent: Intent, row: Optional[dict], params: Dict[str, str]) -> Optional[str]:
+    """
+    Phrase the result of a query, None when there is nothing to answer from.
+    """
+    if row is None:
+        return None
+
+    if intent == Intent.DISTANCE_LEADER:
+        if row['tracker_id'] is None:
+            return None
+        return (
+            f"Player #{int(row['tracker_id'])} covered the most ground, moving about "
+            f"{row['distance']:.0f} pixels on screen over {row['frames']} frames.")
+
+    if intent == Intent.BALL_HALF:
+        if not row['frames']:
+            return None
+        side = params['side']
+        frames = row['left_frames'] if side == 'left' else row['right_frames']
+        return (
+            f"The ball was in the {side} half in {frames} of the {row['frames']} "
+            f"frames it was detected in ({100 * frames / row['frames']:.0f}%).")
+
+    if intent == Intent.OBJECT_COUNT:
+        name = params['class_name']
+        if row['tracked']:
+            return (
+                f"{row['tracked']} different {_plural(name, row['tracked'])} were tracked, "
+                f"with at most {row['most_in_frame']} in a single frame.")
+        if row['most_in_frame']:
+            return (
+                f"At most {row['most_in_frame']} "
+                f"{_plural(name, row['most_in_frame'])} were detected in a single frame.")
+        if row['stored']:
+            return f"No {_plural(name, 2)} were detected with confidence in this video."
+        # the analysis of the video does not detect this class, e.g. players
+        # in a ball detection, the agent can say so better
+        return None
+
+    if intent == Intent.MOST_VISIBLE:
+        if row['tracker_id'] is None:
+            return None
+        return (
+            f"Player #{int(row['tracker_id'])} was on screen the longest, "
+            f"tracked in {row['frames']} frames.")
+
+    if intent == Intent.BALL_DETECTED:
+        if not row['frames']:
+            return None
+        return (
+            f"The ball was detected in {row['ball_frames']} of the {row['frames']} "
+            f"frames ({100 * row['ball_frames'] / row['frames']:.0f}%).")
+
+    if intent == Intent.VIDEO_LENGTH:
+        if not row['frames']:
+            return None
+        return f"The video has {row['frames']} frames."
+    return None
+
+
+class FastPathRouter:
+    """
+    Answers common analytics questions with precompiled SQL over the detections
+    tables, in front of the agent.
+
+    Attributes:
+        engine (Engine): Read-only engine of the detections database.
+    """
+
+    def __init__(self, detection_db_path: str = 'detections.db'):
+        self.engine: Engine = get_engine(detection_db_path, read_only=True)
+        self.tables: Dict[str, str] = {}
+        self.services: Dict[Tuple[str, str], Optional[str]] = {}
+
+    def find_table(self, video_id: str) -> Optional[str]:
+        """
+        Find the detections table holding a video, cached per video.
+        """
+        if video_id in self.tables:
+            return self.tables[video_id]
+
+        with self.engine.connect() as conn:
+            existing = {row[0] for row in conn.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+            for table in DETECTION_TABLES:
+                if table in existing and conn.execute(
+                        text(f'SELECT 1 FROM "{table}" WHERE video_id = :video_id LIMIT 1'),
+                        {"video_id": video_id}).first():
+                    self.tables[video_id] = table
+                    return table
+        return None
+
+    def find_service(self, video_id: str, class_name: str) -> Optional[str]:
+        """
+        The analysis whose rows of the COMPOSITE table the templates read for a
+        class of a video, None when none of them detected it.
+        """
+        key = (video_id, class_name)
+        if key not in self.services:
+            with self.engine.connect() as conn:
+                present = {row[0] for row in conn.execute(text(
+                    f'SELECT DISTINCT service FROM "{COMPOSITE_TABLE}" '
+                    'WHERE video_id = :video_id AND class_name = :class_name'),
+                    {"video_id": video_id, "class_name": class_name})}
+            self.services[key] = next(
+                (service for service in SERVICE_PREFERENCE if service in present),
+                next(iter(sorted(present)), None))
+        return self.services[key]
+
+    def answer(self, question: str, project_id: str, video_id: str) -> Optional[FastAnswer]:
+        """
+        Answer a question without the agent.
+
+        Args:
+            question (str): The question of the user.
+            project_id (str): Project of the video.
+            video_id (str): The video the question is about.
+
+        Returns:
+            Optional[FastAnswer]: The answer, or None when the agent is needed.
+        """
+        matched = match_intent(question)
+        if matched is None or not video_id:
+            ROUTER_REQUESTS.inc(intent='FALLTHROUGH')
+            return None
+        intent, params = matched
+
+        try:
+            start = time.perf_counter()
+            table = self.find_table(video_id)
+            if table is None:
+                ROUTER_REQUESTS.inc(intent='FALLTHROUGH')
+                return None
+            query_params = {
+                "project": project_id,
+                "video_id": video_id,
+                "confidence": MIN_CONFIDENCE,
+            }
+            if 'class_name' in params:
+                params['class_name'] = CLASS_NAMES[params['class_name'].rstrip('s')]
+                query_params['class_name'] = params['class_name']
+            if table == COMPOSITE_TABLE:
+                class_name = INTENT_CLASSES.get(intent, params.get('class_name'))
+                # frame counts of the video do not depend on the analysis
+                service = self.find_service(video_id, class_name) if class_name else None
+                if class_name and service is None:
+                    ROUTER_REQUESTS.inc(intent='FALLTHROUGH')
+                    return None
+                query_params['service'] = service
+            with self.engine.connect() as conn:
+                row = conn.execute(compiled_query(intent, table), query_params).mappings().first()
+            query_ms = 1000 * (time.perf_counter() - start)
+        except Exception as e:
+            # the agent can still answer, e.g. from an older table layout
+            logger.error(f"Fast path {intent} failed: {e}")
+            ROUTER_REQUESTS.inc(intent='FALLTHROUGH')
+            return None
+
+        answer = format_answer(intent, dict(row) if row is not None else None, params)
+        ROUTER_REQUESTS.inc(intent=str(intent) if answer else 'FALLTHROUGH')
+        return FastAnswer(intent, answer, query_ms) if answer else None
+
+    async def process_question(
+        self,
+        question: str,
+        project_id: str,
+        video_id: str,
+        final_answer_pre_callback: Callable,
+        token_callback: Callable
+    ) -> Optional[FastAnswer]:
+        """
+        Answer a question through the same callbacks as the agent streams with.
+
+        Returns:
+            Optional[FastAnswer]: The streamed answer, or None when nothing was
+                streamed and the question must go to the agent.
+        """
+        answer = await run_sync(self.answer, question, project_id, video_id)
+        if answer is None:
+            return None
+        await final_answer_pre_callback()
+        for token in re.findall(r"\S+\s*", answer.text):
+            await token_callback(token)
+        return answer
+
+
+@lru_cache(maxsize=None)
+def get_router(detection_db_path: str = 'detections.db') -> FastPathRouter:
+    return FastPathRouter(detection_db_path)
@@ -0,0 +1,286 @@
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import os
+import re
+import sqlite3
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+from langchain_community.utilities import SQLDatabase
+from langchain_community.utilities.sql_database import truncate_word
+from loguru import logger
+from sqlalchemy import event, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+
+from rag import metrics
+from rag.database import create_pooled_engine
+from rag.router import DETECTION_TABLES
+
+# seconds an agent query may run before SQLite interrupts it
+AGENT_QUERY_TIMEOUT = float(os.getenv("AGENT_QUERY_TIMEOUT", "5"))
+# rows returned to the agent, the rest is cut and flagged
+AGENT_QUERY_MAX_ROWS = int(os.getenv("AGENT_QUERY_MAX_ROWS", "200"))
+# queries slower than this are logged with their plan
+AGENT_SLOW_QUERY_SECONDS = float(os.getenv("AGENT_SLOW_QUERY_SECONDS", "1"))
+# columns the views filter the detections on
+VIEW_COLUMNS = {'video_id', 'project'}
+# virtual machine instructions between two timeout checks
+PROGRESS_INTERVAL = 10_000
+
+# everything else, writes, pragmas, attach, is denied while an agent query runs
+ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+AGENT_QUERIES = metrics.Counter(
+    'agent_sql_queries_total', 'Agent SQL queries by outcome.', labels=('outcome',))
+AGENT_QUERY_SECONDS = metrics.Histogram(
+    'agent_sql_query_seconds', 'Wall time of the agent SQL queries.')
+
+
+class QueryRejected(SQLAlchemyError):
+    """
+    A query the sandbox refused or stopped, the message is shown to the agent
+    so that it can rewrite the query.
+    """
+
+
+def _query_only(dbapi_connection, _record) -> None:
+    dbapi_connection.execute("PRAGMA query_only = ON")
+
+
+@lru_cache(maxsize=None)
+def get_agent_engine(detection_db_path: str = 'detections.db') -> Engine:
+    """
+    Read-only engine shared by the agents. Its connections hold the filtered
+    views of the last agent that used them, so it is kept apart from the
+    engine of the other readers.
+    """
+    engine = create_pooled_engine(detection_db_path, read_only=True)
+    event.listen(engine, 'connect', _query_only)
+    return engine
+
+
+def _literal(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def query_plan(conn, command: str, parameters: Optional[Dict] = None) -> List[Dict]:
+    """
+    The `EXPLAIN QUERY PLAN` rows of a query, with their id, parent and detail.
+    """
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {command}"), parameters or {})
+    return [{"id": row[0], "parent": row[1], "detail": row[3]} for row in rows]
+
+
+def plan_rejection(plan: Sequence[Dict], tables: Sequence[str]) -> Optional[str]:
+    """
+    Find the step of a plan that makes its cost grow with the square of the
+    detections, None when the plan is acceptable.
+
+    Joined tables are siblings in the plan, so two full reads of detection
+    tables under the same parent are a cross product, and a full read below a
+    correlated subquery is repeated for every outer row. A search constrained
+    only by the columns the views filter on still reads the whole video.
+    """
+    def read_in_full(detail: str) -> Optional[str]:
+        words = detail.split()
+        if len(words) < 2 or words[0] not in ("SCAN", "SEARCH"):
+            return None
+        name = words[1].removeprefix("main.")
+        if name not in tables:
+            return None
+        if words[0] == "SEARCH" and set(re.findall(r"(\w+)[=<>]", detail)) - VIEW_COLUMNS:
+            return None
+        return name
+
+    by_id = {step["id"]: step for step in plan}
+    scans: Dict[int, List[str]] = {}
+    for step in plan:
+        table = read_in_full(step["detail"])
+        if table is None:
+            continue
+        scans.setdefault(step["parent"], []).append(table)
+        if len(scans[step["parent"]]) > 1:
+            return (
+                f"joining {' and '.join(scans[step['parent']])} without a join "
+                "condition SQLite can use scans every pair of detections")
+
+        parent = by_id.get(step["parent"])
+        while parent is not None:
+            if parent["detail"].startswith("CORRELATED"):
+                return f"the correlated subquery reads all of {table} for every row"
+            parent = by_id.get(parent["parent"])
+    return None
+
+
+class SandboxedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase for the agent tools limited to the detections of one video.
+
+    The database is opened read-only. On every connection the detection tables
+    are shadowed by TEMP views filtered on the project and video, and while a
+    query of the agent runs, reads of the underlying tables, writes and pragmas
+    are denied by an authorizer. Queries whose plan scans the detections
+    quadratically are rejected before running, running queries are
+    interrupted after `timeout` seconds and at most `max_rows` rows are
+    returned.
+
+    Attributes:
+        project_id (str): Project of the video.
+        video_id (str): The only video the agent can read.
+        timeout (float): Seconds a query may run.
+        max_rows (int): Rows returned to the agent.
+        slow_query_seconds (float): Queries slower than this are logged.
+    """
+
+    def __init__(
+        self,
+        detection_db_path: str,
+        project_id: str,
+        video_id: str,
+        timeout: float = AGENT_QUERY_TIMEOUT,
+        max_rows: int = AGENT_QUERY_MAX_ROWS,
+        slow_query_seconds: float = AGENT_SLOW_QUERY_SECONDS,
+        **kwargs: Any
+    ):
+        # a view of the shared pool, the connect event below is its own
+        engine = get_agent_engine(detection_db_path).execution_options()
+        self.project_id = project_id
+        self.video_id = video_id
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.slow_query_seconds = slow_query_seconds
+
+        with engine.connect() as conn:
+            existing = {row[0] for row in conn.execute(
+                text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+            self.views: Dict[str, str] = {}
+            for table in DETECTION_TABLES:
+                if table not in existing:
+                    continue
+                columns = {row[1] for row in conn.execute(
+                    text(f'PRAGMA main.table_info("{table}")'))}
+                conditions = [f"video_id = {_literal(video_id)}"]
+                if 'project' in columns:
+                    conditions.append(f"project = {_literal(project_id)}")
+                self.views[table] = (
+                    f'CREATE TEMP VIEW "{table}" AS '
+                    f'SELECT * FROM main."{table}" WHERE {" AND ".join(conditions)}')
+
+        event.listen(engine, 'engine_connect', self._reset_views)
+        super().__init__(engine, include_tables=list(self.views) or None, **kwargs)
+
+    def _reset_views(self, conn: Connection) -> None:
+        # replace the views another agent left on the pooled connection
+        dbapi_connection = conn.connection.dbapi_connection
+        dbapi_connection.execute("PRAGMA query_only = OFF")
+        try:
+            stale = dbapi_connection.execute(
+                "SELECT name FROM sqlite_temp_master WHERE type = 'view'").fetchall()
+            for (name,) in stale:
+                dbapi_connection.execute(f'DROP VIEW temp."{name}"')
+            for statement in self.views.values():
+                dbapi_connection.execute(statement)
+        finally:
+            dbapi_connection.execute("PRAGMA query_only = ON")
+
+    def _authorize(self, action: int, arg1, arg2, database, view) -> int:
+        if action not in ALLOWED_ACTIONS:
+            return sqlite3.SQLITE_DENY
+        # the detections are only readable through the filtered views
+        if action == sqlite3.SQLITE_READ and database == 'main' and arg1 in self.views and not view:
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK
+
+    def run(
+        self,
+        command: str,
+        fetch: str = "all",
+        include_columns: bool = False,
+        *,
+        parameters: Optional[Dict[str, Any]] = None,
+        execution_options: Optional[Dict[str, Any]] = None
+    ) -> Union[str, Sequence[Dict[str, Any]]]:
+        """
+        Run a query of the agent within the limits of the sandbox.
+
+        Raises:
+            QueryRejected: If the query is denied, too costly or times out.
+        """
+        if fetch not in ("all", "one"):
+            raise ValueError(f"Unsupported fetch mode {fetch}")
+
+        with self._engine.connect() as conn:
+            try:
+                plan = query_plan(conn, command, parameters)
+            except DBAPIError as e:
+                AGENT_QUERIES.inc(outcome='invalid')
+                raise e
+            reason = plan_rejection(plan, list(self.views))
+            if reason is not None:
+                AGENT_QUERIES.inc(outcome='rejected')
+                logger.warning(f"Rejected agent query, {reason}: {command}")
+                raise QueryRejected(
+                    f"Query rejected, {reason}. Filter or aggregate each table first, "
+                    "for example in a CTE, and join on frame or tracker_id.")
+
+            dbapi_connection = conn.connection.dbapi_connection
+            deadline = time.monotonic() + self.timeout
+            dbapi_connection.set_progress_handler(
+                lambda: int(time.monotonic() > deadline), PROGRESS_INTERVAL)
+            dbapi_connection.set_authorizer(self._authorize)
+            start = time.perf_counter()
+            try:
+                cursor = conn.execute(
+                    text(command), parameters or {}, execution_options=execution_options)
+                limit = 1 if fetch == "one" else self.max_rows
+                rows = cursor.fetchmany(limit + 1) if cursor.returns_rows else []
+            except DBAPIError as e:
+                if "interrupted" in str(e):
+                    AGENT_QUERIES.inc(outcome='timeout')
+                    logger.warning(
+                        f"Agent query interrupted after {self.timeout}s: {command}\n"
+                        + "\n".join(step["detail"] for step in plan))
+                    raise QueryRejected(
+                        f"Query cancelled after {self.timeout:g} seconds. Filter on "
+                        "class_name, frame or tracker_id, or aggregate, to read fewer rows.")
+                if "not authorized" in str(e):
+                    AGENT_QUERIES.inc(outcome='denied')
+                    raise QueryRejected(
+                        "Query denied, only SELECT statements on the detection tables "
+                        "of this video are allowed.")
+                AGENT_QUERIES.inc(outcome='error')
+                raise e
+            finally:
+                dbapi_connection.set_authorizer(None)
+                dbapi_connection.set_progress_handler(None, PROGRESS_INTERVAL)
+                conn.rollback()
+            elapsed = time.perf_counter() - start
+
+        AGENT_QUERIES.inc(outcome='ok')
+        AGENT_QUERY_SECONDS.observe(elapsed)
+        if elapsed > self.slow_query_seconds:
+            logger.warning(
+                f"Slow agent query took {elapsed:.2f}s for {len(rows)} rows: {command}\n"
+                + "\n".join(step["detail"] for step in plan))
+
+        truncated = len(rows) > limit
+        result = [
+            {column: truncate_word(value, length=self._max_string_length)
+             for column, value in row._asdict().items()}
+            for row in rows[:limit]]
+        if not include_columns:
+            result = [tuple(row.values()) for row in result]
+        if not result:
+            return ""
+        if truncated:
+            return (
+                f"{result}\n(only the first {limit} rows are shown, "
+                "aggregate or add a LIMIT to see the rest)")
+        return str(result)
@@ -0,0 +1,414 @@
+"""
+Admission control and fair scheduling of the inference jobs of the server.
+
+Every upload is estimated in seconds of work, its frames times the cost per
+frame of the models its services load and its profile, before it is admitted.
+A tenant may have at most `TENANT_QUOTA_SECONDS` of work queued and running,
+and a job that would wait longer than `SCHEDULER_MAX_WAIT` is rejected, with
+its queue position and ETA, rather than held on an open request. An admitted
+job holds its place in the queue from then on, through the ticket it is run
+with.
+
+Admitted jobs are served by weighted fair queuing across tenants: each job is
+tagged with the virtual time its tenant would finish it on a fair share of the
+workers, and the worker that frees up takes the smallest tag. A tenant runs at
+most `TENANT_MAX_RUNNING` jobs at once, so that long jobs of one tenant never
+hold every worker. The cost per frame starts from static defaults and follows
+the measured run time of the jobs.
+"""
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import asyncio
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from loguru import logger
+
+from rag import metrics
+from rag.modes import COMPOSITE_TABLE, Service
+from rag.profiles import Profile
+
+T = TypeVar("T")
+
+# jobs run at once, one pipeline each
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "3"))
+# jobs of one tenant run at once, one worker is left to the other tenants
+TENANT_MAX_RUNNING = int(os.getenv("TENANT_MAX_RUNNING", str(max(1, SCHEDULER_WORKERS - 1))))
+# estimated seconds of work a tenant may have queued and running
+TENANT_QUOTA_SECONDS = float(os.getenv("TENANT_QUOTA_SECONDS", "3600"))
+# estimated seconds a job may wait for a worker before it is rejected
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "1800"))
+# share of the workers of some tenants, e.g. "coach@club.com=2,demo@club.com=0.5"
+TENANT_WEIGHTS = os.getenv("TENANT_WEIGHTS", "")
+# seconds between the queue updates sent to a waiting job
+QUEUE_UPDATE_INTERVAL = 5.0
+
+# seconds per frame of each stage of the pipelines on CPU with the accurate
+# profile, until the jobs of the server measure them
+STAGE_FRAME_SECONDS = {
+    'decode': 0.02,
+    'player_detection': 0.13,
+    'pitch_detection': 0.1,
+    'ball_detection': 0.18,
+    'tracking': 0.05,
+    'team_classification': 0.15,
+    'radar': 0.02,
+}
+# stages each Service runs, a composite job decodes once and runs each model
+# once per frame for all its services, as rag.composite does
+SERVICE_STAGES = {
+    Service.PITCH_DETECTION: ('decode', 'pitch_detection'),
+    Service.PLAYER_DETECTION: ('decode', 'player_detection'),
+    Service.BALL_DETECTION: ('decode', 'ball_detection'),
+    Service.PLAYER_TRACKING: ('decode', 'player_detection', 'tracking'),
+    Service.TEAM_CLASSIFICATION: (
+        'decode', 'player_detection', 'tracking', 'team_classification'),
+    Service.RADAR: (
+        'decode', 'player_detection', 'tracking', 'team_classification',
+        'pitch_detection', 'radar'),
+}
+# cost of a profile relative to the accurate one, smaller models and keyframes
+PROFILE_COST = {Profile.FAST: 0.3, Profile.BALANCED: 0.6, Profile.ACCURATE: 1.0}
+# frames assumed when the length of an upload cannot be read, 30s at 25 fps
+DEFAULT_FRAMES = 750
+# weight of the last job in the measured cost of its kind
+CALIBRATION_WEIGHT = 0.3
+
+WAIT_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0)
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    'scheduler_queue_wait_seconds', 'Time inference jobs wait for a worker.',
+    labels=('service',), buckets=WAIT_BUCKETS)
+ADMISSIONS = metrics.Counter(
+    'scheduler_admissions_total', 'Inference jobs by admission result.', labels=('result',))
+QUEUED_WORK_SECONDS = metrics.Gauge(
+    'scheduler_queued_work_seconds', 'Estimated seconds of work waiting for a worker.')
+ESTIMATE_RATIO = metrics.Histogram(
+    'scheduler_estimate_ratio', 'Run time of inference jobs over their estimate.',
+    labels=('service',), buckets=(0.25, 0.5, 0.8, 1.0, 1.25, 2.0, 4.0, 8.0))
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """
+    Weights of the tenants from `tenant=weight` pairs separated by commas.
+    """
+    weights = {}
+    for pair in value.split(','):
+        tenant, _, weight = pair.strip().rpartition('=')
+        if tenant and weight:
+            weights[tenant] = float(weight)
+    return weights
+
+
+def count_frames(path: Path) -> Optional[int]:
+    """
+    Frames of a video from its container, None when it cannot be read.
+    """
+    try:
+        import cv2
+        capture = cv2.VideoCapture(Path(path).as_posix())
+        try:
+            # unreadable files and streams report 0 or -1
+            frames = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+            return frames if frames > 0 else None
+        finally:
+            capture.release()
+    except Exception as e:
+        logger.warning(f"Could not count the frames of {path}: {e}")
+        return None
+
+
+@dataclass(frozen=True)
+class JobEstimate:
+    """
+    Estimated work of an inference job.
+
+    Attributes:
+        kind (str): The Service of the job, or the composite table for jobs
+            of several services.
+        services (Tuple[str, ...]): The sorted services of the job.
+        profile (Profile): Inference profile of the job.
+        frames (int): Frames of the video.
+        seconds (float): Estimated run time on one worker.
+    """
+    kind: str
+    services: Tuple[str, ...]
+    profile: Profile
+    frames: int
+    seconds: float
+
+
+@dataclass(frozen=True)
+class Admission:
+    """
+    Place of a job in the queue.
+
+    Attributes:
+        position (int): Jobs running or queued ahead of it.
+        eta_seconds (float): Estimated wait before it starts.
+    """
+    position: int
+    eta_seconds: float
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a job is over the quota of its tenant or would wait too long.
+
+    Attributes:
+        reason (str): 'quota' or 'busy'.
+        position (int): Jobs that would run or be queued ahead of it.
+        eta_seconds (float): Estimated wait it would have had.
+    """
+
+    def __init__(self, reason: str, position: int, eta_seconds: float):
+        self.reason = reason
+        self.position = position
+        self.eta_seconds = eta_seconds
+        detail = (
+            "The queued videos of this account are over its quota" if reason == 'quota'
+            else "The server is busy")
+        super().__init__(f"{detail}, retry in about {eta_seconds / 60:.0f} minutes")
+
+
+@dataclass(eq=False)
+class Ticket:
+    """
+    A job holding its place in the queue, from its admission until its run
+    ends or it is released.
+
+    Attributes:
+        tenant (str): Account the job is run for.
+        estimate (JobEstimate): Estimated work of the job.
+        admission (Admission): Its place when it was admitted.
+    """
+    tenant: str
+    estimate: JobEstimate
+    admission: Admission
+    start: float
+    finish: float
+    seq: int
+    started: asyncio.Future
+    queued_at: float = field(default_factory=time.perf_counter)
+    started_at: Optional[float] = None
+    # the run of the job in the pool, once it started
+    future: Optional[asyncio.Future] = None
+
+
+class InferenceScheduler:
+    """
+    Weighted fair queue of the inference jobs in front of a pool of workers.
+
+    The state is only touched from the event loop, the jobs run in the pool.
+
+    Attributes:
+        workers (int): Jobs run at once.
+        tenant_max_running (int): Jobs of one tenant run at once.
+        tenant_quota (float): Estimated seconds of work per tenant.
+        max_wait (float): Estimated wait above which jobs are rejected.
+        weights (Dict[str, float]): Share of the tenants, 1 when not listed.
+    """
+
+    def __init__(
+        self,
+        workers: int = SCHEDULER_WORKERS,
+        tenant_max_running: int = TENANT_MAX_RUNNING,
+        tenant_quota: float = TENANT_QUOTA_SECONDS,
+        max_wait: float = SCHEDULER_MAX_WAIT,
+        weights: Optional[Dict[str, float]] = None
+    ):
+        self.workers = workers
+        self.tenant_max_running = tenant_max_running
+        self.tenant_quota = tenant_quota
+        self.max_wait = max_wait
+        self.weights = parse_weights(TENANT_WEIGHTS) if weights is None else weights
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        self._queued: List[Ticket] = []
+        self._running: List[Ticket] = []
+        # virtual time of the fair share, and the last finish tag of each tenant
+        self._virtual = 0.0
+        self._finish: Dict[str, float] = {}
+        # measured run time over the static estimate, per set of services
+        self._calibration: Dict[Tuple[str, ...], float] = {}
+        self._seq = itertools.count()
+
+    def estimate(
+        self, services: Sequence[Service], profile: Profile, frames: Optional[int] = None
+    ) -> JobEstimate:
+        """
+        Estimate the run time of a job from its frames, services and profile.
+        """
+        key = tuple(sorted({str(service) for service in services}))
+        kind = key[0] if len(key) == 1 else COMPOSITE_TABLE
+        frames = frames or DEFAULT_FRAMES
+        stages = {stage for service in key for stage in SERVICE_STAGES[Service(service)]}
+        per_frame = sum(STAGE_FRAME_SECONDS[stage] for stage in stages)
+        seconds = (
+            frames * per_frame * PROFILE_COST[Profile(profile)]
+            * self._calibration.get(key, 1.0))
+        return JobEstimate(
+            kind=kind, services=key, profile=Profile(profile), frames=frames, seconds=seconds)
+
+    def _tags(self, tenant: str, estimate: JobEstimate) -> Tuple[float, float]:
+        start = max(self._virtual, self._finish.get(tenant, 0.0))
+        return start, start + estimate.seconds / self.weights.get(tenant, 1.0)
+
+    def _place(self, finish: float, ticket: Optional[Ticket] = None) -> Admission:
+        # fluid approximation: the work ahead is shared by all the workers
+        now = time.perf_counter()
+        ahead = [job for job in self._queued if job.finish <= finish and job is not ticket]
+        position = len(self._running) + len(ahead)
+        if position < self.workers:
+            return Admission(position=position, eta_seconds=0.0)
+        remaining = sum(
+            max(job.estimate.seconds - (now - job.started_at), 0.0) for job in self._running)
+        work = remaining + sum(job.estimate.seconds for job in ahead)
+        return Admission(position=position, eta_seconds=work / self.workers)
+
+    def submit(
+        self, tenant: str, estimate: JobEstimate, admission: Optional[Admission] = None
+    ) -> Ticket:
+        """
+        Queue a job without admission control, it waits for `run`.
+        """
+        start, finish = self._tags(tenant, estimate)
+        ticket = Ticket(
+            tenant=tenant, estimate=estimate,
+            admission=admission or self._place(finish), start=start, finish=finish,
+            seq=next(self._seq), started=asyncio.get_running_loop().create_future())
+        self._finish[tenant] = finish
+        self._queued.append(ticket)
+        self._dispatch()
+        return ticket
+
+    def admit(self, tenant: str, estimate: JobEstimate) -> Ticket:
+        """
+        Check that a job may be queued, before its upload is processed, and
+        queue it. The check and the queuing happen at once, so that jobs
+        arriving together see each other.
+
+        Args:
+            tenant (str): Account the job is run for.
+            estimate (JobEstimate): Estimated work of the job.
+
+        Returns:
+            Ticket: The queued job, to `run` or `release`.
+
+        Raises:
+            AdmissionRejected: If the tenant is over its quota or the wait is
+                over `max_wait`.
+        """
+        place = self._place(self._tags(tenant, estimate)[1])
+        work = sum(
+            job.estimate.seconds for job in self._queued + self._running if job.tenant == tenant)
+        if work and work + estimate.seconds > self.tenant_quota:
+            ADMISSIONS.inc(result='quota')
+            # retrying makes sense once the work of the tenant is done
+            raise AdmissionRejected('quota', place.position, max(place.eta_seconds, work / self.workers))
+        if place.eta_seconds > self.max_wait:
+            ADMISSIONS.inc(result='busy')
+            raise AdmissionRejected('busy', place.position, place.eta_seconds)
+        ADMISSIONS.inc(result='admitted')
+        return self.submit(tenant, estimate, place)
+
+    def _dispatch(self) -> None:
+        while len(self._running) < self.workers:
+            running = {}
+            for job in self._running:
+                running[job.tenant] = running.get(job.tenant, 0) + 1
+            eligible = [
+                job for job in self._queued
+                if running.get(job.tenant, 0) < self.tenant_max_running]
+            if not eligible:
+                break
+            job = min(eligible, key=lambda job: (job.finish, job.seq))
+            self._queued.remove(job)
+            self._running.append(job)
+            self._virtual = max(self._virtual, job.start)
+            job.started_at = time.perf_counter()
+            QUEUE_WAIT_SECONDS.observe(job.started_at - job.queued_at, service=job.estimate.kind)
+            job.started.set_result(None)
+        metrics.QUEUE_DEPTH.set(len(self._queued), queue='jobs')
+        QUEUED_WORK_SECONDS.set(sum(job.estimate.seconds for job in self._queued))
+
+    def release(self, job: Ticket) -> None:
+        """
+        Give up the place of a job that is not running in the pool. Releasing
+        twice, or a job whose run ended, does nothing.
+        """
+        if job.future is not None and not job.future.done():
+            # its worker is given back when the thread is done
+            return
+        if job in self._queued:
+            self._queued.remove(job)
+            # a job leaving the queue gives its share back to its tenant
+            if self._finish.get(job.tenant) == job.finish:
+                self._finish[job.tenant] = job.start
+        if job in self._running:
+            self._running.remove(job)
+        if not self._queued and not self._running:
+            # idle, the tags start over
+            self._virtual = 0.0
+            self._finish.clear()
+        self._dispatch()
+
+    def _calibrate(self, job: Ticket, seconds: float) -> None:
+        ratio = seconds / job.estimate.seconds if job.estimate.seconds > 0 else 1.0
+        ESTIMATE_RATIO.observe(ratio, service=job.estimate.kind)
+        previous = self._calibration.get(job.estimate.services, 1.0)
+        self._calibration[job.estimate.services] = (
+            (1 - CALIBRATION_WEIGHT) * previous + CALIBRATION_WEIGHT * previous * ratio)
+
+    def _ended(self, job: Ticket, future: asyncio.Future) -> None:
+        # the worker is given back when the thread is done, not when the request
+        # awaiting it goes away
+        if not future.cancelled() and future.exception() is None:
+            self._calibrate(job, time.perf_counter() - job.started_at)
+        self.release(job)
+
+    async def run(
+        self,
+        ticket: Ticket,
+        fn: Callable[[], T],
+        on_wait: Optional[Callable[[Admission], Awaitable[None]]] = None
+    ) -> T:
+        """
+        Run a queued job in the pool once it is its turn.
+
+        Args:
+            ticket (Ticket): The job, from `admit` or `submit`.
+            fn (Callable[[], T]): The job, run in a worker thread.
+            on_wait (Optional[Callable]): Called with the place of the job
+                while it waits, every `QUEUE_UPDATE_INTERVAL` seconds.
+
+        Returns:
+            T: What the job returned.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while not ticket.started.done():
+                if on_wait:
+                    await on_wait(self._place(ticket.finish, ticket))
+                await asyncio.wait({ticket.started}, timeout=QUEUE_UPDATE_INTERVAL)
+            waited = ticket.started_at - ticket.queued_at
+            if waited > 1:
+                logger.info(
+                    f"{ticket.estimate.kind} job of {ticket.tenant} waited {waited:.1f}s "
+                    "for a worker")
+            ticket.future = loop.run_in_executor(self._executor, fn)
+            ticket.future.add_done_callback(partial(self._ended, ticket))
+            # a cancelled request leaves the thread running, and its worker taken
+            return await asyncio.shield(ticket.future)
+        finally:
+            self.release(ticket)
+
+
+@lru_cache(maxsize=None)
+def get_scheduler() -> InferenceScheduler:
+    return InferenceScheduler()
@@ -0,0 +1,316 @@
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import supervision as sv
+
+from rag import metrics
+from rag.modes import Service
+from rag.profiles import InferenceProfile
+from rag.services import (
+    MIN_SEGMENT_FRAMES,
+    PLAYER_DETECTION_MODEL_PATH,
+    create_frame_generator,
+    fit_team_classifier,
+    parse_detection,
+    save_detections,
+)
+from sports.common.backends import load_yolo
+from sports.common.video import VideoSink, get_video_frames_generator
+
+# frames a segment processes before its range, to warm up the tracker and the
+# keyframe scheduler, and to match its tracker ids with the previous segment
+SEGMENT_OVERLAP = 30
+
+
+@dataclass(frozen=True)
+class Segment:
+    """
+    A range of frames processed by one worker.
+
+    Attributes:
+        index (int): Position of the segment in the video.
+        start (int): First frame written by the segment.
+        end (int): Frame the segment stops at, excluded.
+        overlap (int): Frames processed before `start` and only used to warm up
+            the trackers and reconcile tracker ids.
+    """
+    index: int
+    start: int
+    end: int
+    overlap: int = 0
+
+
+def plan_segments(
+    total_frames: int,
+    workers: int,
+    keyframe_interval: int = 1,
+    overlap: int = SEGMENT_OVERLAP
+) -> List[Segment]:
+    """
+    Split a video into one segment per worker.
+
+    Boundaries are aligned to the keyframe interval of the profile, so every
+    segment starts on a frame the detector runs on, and segments shorter than
+    `MIN_SEGMENT_FRAMES` are avoided by using fewer workers.
+
+    Args:
+        total_frames (int): Number of frames of the video.
+        workers (int): Number of worker processes.
+        keyframe_interval (int): Detection keyframe interval of the profile.
+        overlap (int): Warm-up frames before each segment but the first.
+
+    Returns:
+        List[Segment]: Consecutive segments covering the video.
+    """
+    count = max(1, min(workers, total_frames // MIN_SEGMENT_FRAMES))
+    step = max(keyframe_interval, 1)
+    bounds = [round(total_frames * i / count / step) * step for i in range(count)]
+    bounds.append(total_frames)
+    return [
+        Segment(index=i, start=start, end=end, overlap=min(overlap, start))
+        for i, (start, end) in enumerate(zip(bounds, bounds[1:]))
+    ]
+
+
+def _init_worker(threads: int) -> None:
+    import sports.common.backends as backends
+
+    # share the cores between the workers instead of oversubscribing them, the
+    # torch threads and the sessions of exported models are sized when the
+    # models are loaded, after this runs
+    backends.INTRA_OP_THREADS = threads
+    backends.INTER_OP_THREADS = 1
+
+
+def _run_segment(
+    source_video_path: str,
+    target_video_path: str,
+    project_id: str,
+    video_id: str,
+    mode: Service,
+    device: str,
+    profile: InferenceProfile,
+    segment: Segment
+) -> pd.DataFrame:
+    # workers have their own registry, their timings are only kept in the job files
+    with metrics.job(mode, f"{video_id}.segment-{segment.index}") as timer:
+        frame_generator = create_frame_generator(
+            mode, source_video_path, device, profile,
+            project_id=project_id, video_id=video_id,
+            start=segment.start - segment.overlap, end=segment.end)
+        video_info = sv.VideoInfo.from_video_path(source_video_path)
+
+        df = pd.DataFrame()
+        with VideoSink(target_video_path, video_info, codec="avc1") as video_sink:
+            for frame_index, (frame, detections) in enumerate(
+                    frame_generator, segment.start - segment.overlap):
+                if frame_index >= segment.start:
+                    with metrics.timed('encode'):
+                        video_sink.write_frame(frame)
+                if len(detections) > 0:
+                    df = parse_detection(detections, df, frame_index, project_id, video_id)
+                timer.frame()
+    return df
+
+
+def reconcile_tracker_ids(
+    previous: pd.DataFrame,
+    current: pd.DataFrame,
+    iou_threshold: float = 0.5
+) -> Dict[int, int]:
+    """
+    Match the tracker ids of a segment with the ids of the previous segment, using
+    the frames both processed.
+
+    Args:
+        previous (pd.DataFrame): Detections of the previous segment in the shared
+            frames, with final tracker ids.
+        current (pd.DataFrame): Detections of the current segment in the shared
+            frames, with its own tracker ids.
+        iou_threshold (float): Minimum IoU for two boxes to be the same object.
+
+    Returns:
+        Dict[int, int]: Previous tracker id of each matched current tracker id.
+    """
+    votes: Dict[tuple, int] = {}
+    columns = ['x_min', 'y_min', 'x_max', 'y_max']
+    previous = previous.dropna(subset=['tracker_id'])
+    current = current.dropna(subset=['tracker_id'])
+    for frame, current_frame in current.groupby('frame'):
+        previous_frame = previous[previous['frame'] == frame]
+        if len(previous_frame) == 0:
+            continue
+        iou = sv.box_iou_batch(
+            current_frame[columns].to_numpy(dtype=float),
+            previous_frame[columns].to_numpy(dtype=float))
+        for i, j in zip(*np.nonzero(iou >= iou_threshold)):
+            key = (int(current_frame['tracker_id'].iloc[i]),
+                   int(previous_frame['tracker_id'].iloc[j]))
+            votes[key] = votes.get(key, 0) + 1
+
+    # one to one assignment, most agreed pairs first
+    mapping, taken = {}, set()
+    for (current_id, previous_id), _ in sorted(votes.items(), key=lambda item: -item[1]):
+        if current_id not in mapping and previous_id not in taken:
+            mapping[current_id] = previous_id
+            taken.add(previous_id)
+    return mapping
+
+
+def stitch_detections(segments: List[Segment], dfs: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate the detections of the segments, dropping the warm-up frames and
+    renumbering tracker ids so that objects crossing a boundary keep their id and
+    new objects never reuse one.
+
+    Args:
+        segments (List[Segment]): The segments, in order.
+        dfs (List[pd.DataFrame]): Detections of each segment.
+
+    Returns:
+        pd.DataFrame: Detections of the whole video.
+    """
+    stitched = []
+    previous = pd.DataFrame()
+    next_id = 1
+    for segment, df in zip(segments, dfs):
+        if len(df) == 0:
+            continue
+        tracked = 'tracker_id' in df and df['tracker_id'].notna().any()
+        if tracked:
+            warmup = df[df['frame'] < segment.start]
+            mapping = (
+                reconcile_tracker_ids(previous, warmup) if len(previous) > 0 else {})
+            for tracker_id in sorted(df['tracker_id'].dropna().unique()):
+                if int(tracker_id) not in mapping:
+                    mapping[int(tracker_id)] = next_id
+                    next_id += 1
+            df = df.copy()
+            df['tracker_id'] = df['tracker_id'].map(
+                lambda tracker_id: mapping.get(int(tracker_id)) if pd.notna(tracker_id)
+                else tracker_id)
+            next_id = max(next_id, int(df['tracker_id'].max()) + 1)
+
+        df = df[df['frame'] >= segment.start]
+        stitched.append(df)
+        previous = df
+    return pd.concat(stitched, ignore_index=True) if stitched else pd.DataFrame()
+
+
+def concat_videos(paths: List[Path], target_video_path: Path) -> None:
+    """
+    Concatenate encoded segments, without re-encoding when ffmpeg is available.
+
+    Args:
+        paths (List[Path]): Segment videos, in order.
+        target_video_path (Path): Output video.
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.writelines(f"file '{path.as_posix()}'\n" for path in paths)
+        try:
+            subprocess.run(
+                [ffmpeg, '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0',
+                 '-i', f.name, '-c', 'copy', target_video_path.as_posix()],
+                check=True)
+        finally:
+            os.unlink(f.name)
+        return
+
+    video_info = sv.VideoInfo.from_video_path(paths[0].as_posix())
+    with VideoSink(target_video_path.as_posix(), video_info, codec="avc1") as video_sink:
+        for path in paths:
+            for frame in get_video_frames_generator(
+                    source_path=path.as_posix(), reuse_buffers=True):
+                video_sink.write_frame(frame)
+
+
+def run_segmented_model(
+    source_video_path: str,
+    target_video_path: str,
+    project_id: str,
+    video_id: str,
+    mode: Service,
+    device: str = 'cpu',
+    with_sql: bool = True,
+    profile: Optional[InferenceProfile] = None,
+    workers: int = 2
+) -> Iterator[float]:
+    """
+    Segmented counterpart of `run_model`: processes ranges of the video in
+    parallel worker processes, each with its own models, then stitches the encoded
+    segments and their detections.
+
+    The team model is fitted once before the workers start and persisted, so all
+    segments load the same one and agree on the team ids.
+
+    Args:
+        source_video_path (str): Path to the source video.
+        target_video_path (str): Path to the output video.
+        project_id (str): Project of the video.
+        video_id (str): Id of the output clip.
+        mode (Service): The Service to run.
+        device (str): Device to run the models on (e.g., 'cpu', 'cuda').
+        with_sql (bool): Save the detections to the detections database.
+        profile (Optional[InferenceProfile]): The inference profile of the job.
+        workers (int): Number of worker processes.
+
+    Yields:
+        Iterator[float]: Progress percentage, as segments complete.
+    """
+    source = (ROOT_DIR / source_video_path).as_posix()
+    target = ROOT_DIR / target_video_path
+    settings = profile.settings(mode)
+    video_info = sv.VideoInfo.from_video_path(source)
+    segments = plan_segments(
+        video_info.total_frames, workers, keyframe_interval=settings.keyframe_interval)
+
+    with metrics.job(mode, video_id) as timer:
+        if mode in (Service.TEAM_CLASSIFICATION, Service.RADAR):
+            player_detection_model = load_yolo(PLAYER_DETECTION_MODEL_PATH, device=device)
+            fit_team_classifier(
+                source, player_detection_model, settings, profile, device,
+                project_id=project_id, video_id=video_id)
+
+        with tempfile.TemporaryDirectory(dir=target.parent) as tmp:
+            paths = [Path(tmp) / f"segment-{segment.index}{target.suffix}" for segment in segments]
+            dfs: List[Optional[pd.DataFrame]] = [None] * len(segments)
+            # spawned workers do not inherit CUDA or thread pool state from the server
+            with ProcessPoolExecutor(
+                max_workers=len(segments),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(max(1, (os.cpu_count() or 1) // len(segments)),)
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        _run_segment, source, path.as_posix(), project_id, video_id,
+                        mode, device, profile, segment): segment
+                    for segment, path in zip(segments, paths)
+                }
+                done = 0
+                for future in as_completed(futures):
+                    segment = futures[future]
+                    dfs[segment.index] = future.result()
+                    done += segment.end - segment.start
+                    timer.frame(segment.end - segment.start)
+                    yield (done / video_info.total_frames) * 100
+
+            with metrics.timed('concat'):
+                concat_videos(paths, target)
+            print("Video processing complete!", len(segments), "segments processed")
+
+        save_detections(stitch_detections(segments, dfs), str(mode), profile, with_sql)
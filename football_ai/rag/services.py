@@ -2,35 +2,70 @@ import sys
 from pathlib import Path
 ROOT_DIR = Path(__file__).parent.parent
 sys.path.append(ROOT_DIR.as_posix())
-from enum import Enum
-from typing import Iterator, List
+from dataclasses import replace
+from typing import Dict, Iterator, List, Optional, Tuple
 from videoprops import get_video_properties
 import os
+import warnings
+import cv2
 import numpy as np
 import supervision as sv
 from ultralytics import YOLO
 import pandas as pd
-from sqlalchemy import create_engine
-
-from sports.annotators.soccer import draw_pitch, draw_points_on_pitch
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from rag import metrics
+from rag.answer_cache import bump_versions
+from rag.database import get_engine
+from rag.modes import Service
+from rag.profiles import (
+    InferenceProfile,
+    Profile,
+    PROFILES,
+    ServiceSettings,
+    get_profile,
+    downscale,
+    upscale_detections,
+    upscale_keypoints,
+)
+from sports.annotators.compositor import RadarOverlay
+from sports.common.backends import load_yolo
 from sports.common.ball import BallTracker, BallAnnotator
-from sports.common.team import TeamClassifier
+from sports.common.keyframes import AdaptiveDetector, INTERPOLATED_KEY
+from sports.common.team import (
+    CentroidTeamClassifier,
+    GoalkeeperTeamResolver,
+    TeamModelStore,
+    create_team_classifier,
+    tracker_keys,
+)
+from sports.common.video import VideoSink, get_video_frames_generator
 from sports.common.view import ViewTransformer
 from sports.configs.soccer import SoccerPitchConfiguration
 
-MODEL_FOLDER = ROOT_DIR / 'aimodels'
+MODEL_FOLDER = Path(os.getenv("MODEL_FOLDER", ROOT_DIR / 'aimodels'))
 PLAYER_DETECTION_MODEL_PATH = MODEL_FOLDER / 'football-player-detection.pt'
 PITCH_DETECTION_MODEL_PATH =  MODEL_FOLDER /  'football-pitch-detection.pt'
 BALL_DETECTION_MODEL_PATH = MODEL_FOLDER /  'football-ball-detection.pt'
+TEAM_MODEL_FOLDER = ROOT_DIR / 'team_models'
+
+# a warm start only needs a few crops to adapt the centroids to the new clip
+WARM_FIT_STRIDE_FACTOR = 4
+
+# long videos are split in segments processed by this many worker processes
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", 1))
+MIN_SEGMENT_FRAMES = 300
 
 BALL_CLASS_ID = 0
 GOALKEEPER_CLASS_ID = 1
 PLAYER_CLASS_ID = 2
 REFEREE_CLASS_ID = 3
 
-STRIDE = 60
 CONFIG = SoccerPitchConfiguration()
 
+# the run_* pipelines annotate frames in place: nothing reads the raw frame once
+# its annotation starts, and the frame buffer is written out before the next one
 COLORS = ['#FF1493', '#00BFFF', '#FF6347', '#FFD700']
 VERTEX_LABEL_ANNOTATOR = sv.VertexLabelAnnotator(
     color=[sv.Color.from_hex(color) for color in CONFIG.colors],
@@ -73,28 +108,6 @@ ELLIPSE_LABEL_ANNOTATOR = sv.LabelAnnotator(
 )
 
 
-class Service(str, Enum):
-    """
-    Enum class representing different modes of operation for Soccer AI video analysis.
-    """
-    PITCH_DETECTION = 'PITCH_DETECTION'
-    PLAYER_DETECTION = 'PLAYER_DETECTION'
-    BALL_DETECTION = 'BALL_DETECTION'
-    PLAYER_TRACKING = 'PLAYER_TRACKING'
-    TEAM_CLASSIFICATION = 'TEAM_CLASSIFICATION'
-    RADAR = 'RADAR'
-
-    def __contains__(self, item):
-        try:
-            self(item)
-        except ValueError:
-            return False
-        return True  
-
-    def __str__(self):
-        return self.value  
-
-
 def get_crops(frame: np.ndarray, detections: sv.Detections) -> List[np.ndarray]:
     """
     Extract crops from the frame based on detected bounding boxes.
@@ -126,327 +139,753 @@ def resolve_goalkeepers_team_id(
     Returns:
         np.ndarray: Array containing team IDs for the detected goalkeepers.
 
-    This function calculates the centroids of the two teams based on the positions of
-    the players. Then, it assigns each goalkeeper to the nearest team's centroid by
-    calculating the distance between each goalkeeper and the centroids of the two teams.
+    Single frame version of `GoalkeeperTeamResolver`, in image coordinates and
+    without memory of previous frames.
+    """
+    return GoalkeeperTeamResolver().resolve(
+        players.get_anchors_coordinates(sv.Position.BOTTOM_CENTER),
+        players_team_id,
+        goalkeepers.get_anchors_coordinates(sv.Position.BOTTOM_CENTER)
+    )
+
+
+def shift_keypoints(keypoints: sv.KeyPoints, shift: np.ndarray) -> sv.KeyPoints:
+    """
+    Translate the visible pitch keypoints by a camera displacement.
+
+    Args:
+        keypoints (sv.KeyPoints): Keypoints from the last keyframe.
+        shift (np.ndarray): The (x, y) displacement in pixels.
+
+    Returns:
+        sv.KeyPoints: Shifted keypoints. Undetected keypoints stay at the origin.
+    """
+    xy = keypoints.xy.copy()
+    visible = (xy[..., 0] > 1) & (xy[..., 1] > 1)
+    xy[visible] += shift
+    return sv.KeyPoints(
+        xy=xy, confidence=keypoints.confidence, class_id=keypoints.class_id)
+
+
+def create_pitch_transformer(keypoints: sv.KeyPoints) -> Optional[ViewTransformer]:
+    """
+    Build the image to pitch homography from the detected pitch keypoints.
+
+    Args:
+        keypoints (sv.KeyPoints): Pitch keypoints of the frame.
+
+    Returns:
+        Optional[ViewTransformer]: The transformer, or None when too few keypoints
+            are visible to compute it.
     """
-    goalkeepers_xy = goalkeepers.get_anchors_coordinates(sv.Position.BOTTOM_CENTER)
-    players_xy = players.get_anchors_coordinates(sv.Position.BOTTOM_CENTER)
-    team_0_centroid = players_xy[players_team_id == 0].mean(axis=0)
-    team_1_centroid = players_xy[players_team_id == 1].mean(axis=0)
-    goalkeepers_team_id = []
-    for goalkeeper_xy in goalkeepers_xy:
-        dist_0 = np.linalg.norm(goalkeeper_xy - team_0_centroid)
-        dist_1 = np.linalg.norm(goalkeeper_xy - team_1_centroid)
-        goalkeepers_team_id.append(0 if dist_0 < dist_1 else 1)
-    return np.array(goalkeepers_team_id)
+    mask = (keypoints.xy[0][:, 0] > 1) & (keypoints.xy[0][:, 1] > 1)
+    if mask.sum() < 4:
+        return None
+    try:
+        return ViewTransformer(
+            source=keypoints.xy[0][mask].astype(np.float32),
+            target=np.array(CONFIG.vertices)[mask].astype(np.float32)
+        )
+    except (ValueError, cv2.error):
+        return None
 
 
-def render_radar(
+def to_pitch_coordinates(
     detections: sv.Detections,
-    keypoints: sv.KeyPoints,
-    color_lookup: np.ndarray
+    transformer: Optional[ViewTransformer]
 ) -> np.ndarray:
-    mask = (keypoints.xy[0][:, 0] > 1) & (keypoints.xy[0][:, 1] > 1)
-    transformer = ViewTransformer(
-        source=keypoints.xy[0][mask].astype(np.float32),
-        target=np.array(CONFIG.vertices)[mask].astype(np.float32)
-    )
+    """
+    Project the bottom center of the detections onto the pitch.
+
+    Args:
+        detections (sv.Detections): Detections in image coordinates.
+        transformer (Optional[ViewTransformer]): Image to pitch transformer.
+
+    Returns:
+        np.ndarray: (N, 2) pitch coordinates, NaN when there is no transformer.
+    """
+    if transformer is None:
+        return np.full((len(detections), 2), np.nan, dtype=np.float32)
     xy = detections.get_anchors_coordinates(anchor=sv.Position.BOTTOM_CENTER)
-    transformed_xy = transformer.transform_points(points=xy)
-
-    radar = draw_pitch(config=CONFIG)
-    radar = draw_points_on_pitch(
-        config=CONFIG, xy=transformed_xy[color_lookup == 0],
-        face_color=sv.Color.from_hex(COLORS[0]), radius=20, pitch=radar)
-    radar = draw_points_on_pitch(
-        config=CONFIG, xy=transformed_xy[color_lookup == 1],
-        face_color=sv.Color.from_hex(COLORS[1]), radius=20, pitch=radar)
-    radar = draw_points_on_pitch(
-        config=CONFIG, xy=transformed_xy[color_lookup == 2],
-        face_color=sv.Color.from_hex(COLORS[2]), radius=20, pitch=radar)
-    radar = draw_points_on_pitch(
-        config=CONFIG, xy=transformed_xy[color_lookup == 3],
-        face_color=sv.Color.from_hex(COLORS[3]), radius=20, pitch=radar)
-    return radar
-
-
-def run_pitch_detection(source_video_path: str, device: str) -> Iterator[np.ndarray]:
+    return transformer.transform_points(points=xy).reshape(-1, 2)
+
+
+def annotate_tracks(
+    frame: np.ndarray,
+    detections: sv.Detections,
+    color_lookup: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Draw tracked detections as ellipses labelled with their tracker id.
+
+    Args:
+        frame (np.ndarray): The frame to draw on, modified in place.
+        detections (sv.Detections): Tracked detections.
+        color_lookup (Optional[np.ndarray]): Color index per detection. Defaults
+            to the class id.
+
+    Returns:
+        np.ndarray: The annotated frame.
+    """
+    labels = [str(tracker_id) for tracker_id in detections.tracker_id]
+    frame = ELLIPSE_ANNOTATOR.annotate(
+        frame, detections, custom_color_lookup=color_lookup)
+    return ELLIPSE_LABEL_ANNOTATOR.annotate(
+        frame, detections, labels=labels, custom_color_lookup=color_lookup)
+
+
+def resolve_radar_frame(
+    frame: np.ndarray,
+    frame_index: int,
+    detections: sv.Detections,
+    keypoints: sv.KeyPoints,
+    transformer: Optional[ViewTransformer],
+    team_classifier: CentroidTeamClassifier,
+    goalkeeper_resolver: GoalkeeperTeamResolver
+) -> Tuple[sv.Detections, np.ndarray, np.ndarray, Optional[ViewTransformer]]:
+    """
+    Assign teams to the tracked people of a frame and locate them on the pitch.
+
+    Args:
+        frame (np.ndarray): The source frame.
+        frame_index (int): Index of the frame in the video.
+        detections (sv.Detections): Tracked detections of the frame.
+        keypoints (sv.KeyPoints): Pitch keypoints of the frame.
+        transformer (Optional[ViewTransformer]): Homography of the previous frame,
+            kept when the keypoints of this frame are unusable.
+        team_classifier (CentroidTeamClassifier): The fitted team classifier.
+        goalkeeper_resolver (GoalkeeperTeamResolver): Goalkeeper team state.
+
+    Returns:
+        Tuple[sv.Detections, np.ndarray, np.ndarray, Optional[ViewTransformer]]:
+            Players, goalkeepers and referees, their color index, their pitch
+            coordinates and the homography of this frame.
+    """
+    players = detections[detections.class_id == PLAYER_CLASS_ID]
+    crops = get_crops(frame, players)
+    with metrics.timed('team_classification'):
+        players_team_id = team_classifier.predict(
+            crops, keys=tracker_keys(players.tracker_id, frame_index))
+
+    goalkeepers = detections[detections.class_id == GOALKEEPER_CLASS_ID]
+    referees = detections[detections.class_id == REFEREE_CLASS_ID]
+    detections = sv.Detections.merge([players, goalkeepers, referees])
+
+    transformer = create_pitch_transformer(keypoints) or transformer
+    pitch_xy = to_pitch_coordinates(detections, transformer)
+    players_end = len(players)
+    goalkeepers_end = players_end + len(goalkeepers)
+    goalkeepers_team_id = goalkeeper_resolver.resolve(
+        pitch_xy[:players_end], players_team_id,
+        pitch_xy[players_end:goalkeepers_end], goalkeepers.tracker_id)
+
+    color_lookup = np.concatenate([
+        players_team_id,
+        goalkeepers_team_id,
+        np.full(len(referees), REFEREE_CLASS_ID)
+    ]).astype(int)
+    return detections, color_lookup, pitch_xy, transformer
+
+
+def create_player_detector(
+    player_detection_model: YOLO,
+    settings: ServiceSettings
+) -> AdaptiveDetector:
+    """
+    Wrap the player detection model in a keyframe scheduler.
+
+    Args:
+        player_detection_model (YOLO): The loaded player detection model.
+        settings (ServiceSettings): Inference settings of the running Service.
+
+    Returns:
+        AdaptiveDetector: Detector running the model on keyframes only.
+    """
+    def callback(frame: np.ndarray) -> sv.Detections:
+        with metrics.timed('player_detection'):
+            result = player_detection_model(
+                frame, imgsz=settings.imgsz, conf=settings.confidence, verbose=False)[0]
+        return sv.Detections.from_ultralytics(result)
+
+    return AdaptiveDetector(callback=callback, interval=settings.keyframe_interval)
+
+
+def collect_player_crops(
+    source_video_path: str,
+    player_detection_model: YOLO,
+    settings: ServiceSettings,
+    profile: InferenceProfile
+) -> List[np.ndarray]:
+    """
+    Sample player crops from the video to fit the team classifier.
+
+    Args:
+        source_video_path (str): Path to the source video.
+        player_detection_model (YOLO): The loaded player detection model.
+        settings (ServiceSettings): Inference settings of the running Service.
+        profile (InferenceProfile): The inference profile of the job.
+
+    Returns:
+        List[np.ndarray]: Crops of the detected players, in source resolution.
+    """
+    frame_generator = get_video_frames_generator(
+        source_path=source_video_path, stride=settings.fit_stride)
+
+    crops = []
+    for frame in frame_generator:
+        resized, scale = downscale(frame, profile.max_resolution)
+        result = player_detection_model(
+            resized, imgsz=settings.imgsz, conf=settings.confidence, verbose=False)[0]
+        detections = upscale_detections(sv.Detections.from_ultralytics(result), scale)
+        crops += get_crops(frame, detections[detections.class_id == PLAYER_CLASS_ID])
+    return crops
+
+
+def restore_team_model(
+    team_classifier: CentroidTeamClassifier,
+    state: Dict[str, np.ndarray]
+) -> bool:
+    """
+    Load a persisted team model into a classifier.
+
+    Args:
+        team_classifier (CentroidTeamClassifier): The classifier to restore.
+        state (Dict[str, np.ndarray]): State loaded from the team model store.
+
+    Returns:
+        bool: False, with a warning, when the state cannot be loaded (for example
+            an archive written by an older version) and the classifier should be
+            fitted from scratch instead.
+    """
+    try:
+        team_classifier.set_state(state)
+    except (KeyError, ValueError) as e:
+        warnings.warn(f"Could not restore the team model, fitting a new one: {e}")
+        return False
+    return True
+
+
+def fit_team_classifier(
+    source_video_path: str,
+    player_detection_model: YOLO,
+    settings: ServiceSettings,
+    profile: InferenceProfile,
+    device: str,
+    project_id: Optional[str] = None,
+    video_id: Optional[str] = None
+) -> CentroidTeamClassifier:
+    """
+    Fit a team classifier for the video, reusing persisted models when possible.
+
+    A model already fitted on the video is loaded as is. Otherwise the latest model
+    of the project is updated online with a sparse sample of crops, and only when
+    there is none, or the crops drift too far from it, is a model fitted from
+    scratch. The result is saved for the next jobs on the video.
+
+    Args:
+        source_video_path (str): Path to the source video.
+        player_detection_model (YOLO): The loaded player detection model.
+        settings (ServiceSettings): Inference settings of the running Service.
+        profile (InferenceProfile): The inference profile of the job.
+        device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        project_id (Optional[str]): Project of the video. None disables persistence.
+        video_id (Optional[str]): Id of the video. None disables persistence.
+
+    Returns:
+        CentroidTeamClassifier: The fitted classifier.
+    """
+    team_classifier = create_team_classifier(
+        settings.team_strategy, device=device, batch_size=settings.batch_size)
+    if project_id is None or video_id is None:
+        with metrics.timed('team_fit'):
+            team_classifier.fit(collect_player_crops(
+                source_video_path, player_detection_model, settings, profile))
+        return team_classifier
+
+    store = TeamModelStore(TEAM_MODEL_FOLDER)
+    state = store.load(project_id, video_id, team_classifier.strategy)
+    if state is not None and restore_team_model(team_classifier, state):
+        metrics.CACHE_REQUESTS.inc(cache='team_model', result='hit')
+        return team_classifier
+
+    state = store.latest(project_id, team_classifier.strategy)
+    with metrics.timed('team_fit'):
+        if state is not None and restore_team_model(team_classifier, state):
+            metrics.CACHE_REQUESTS.inc(cache='team_model', result='warm')
+            crops = collect_player_crops(
+                source_video_path, player_detection_model,
+                replace(settings, fit_stride=settings.fit_stride * WARM_FIT_STRIDE_FACTOR),
+                profile)
+            if not team_classifier.partial_fit(crops):
+                team_classifier.fit(collect_player_crops(
+                    source_video_path, player_detection_model, settings, profile))
+        else:
+            metrics.CACHE_REQUESTS.inc(cache='team_model', result='miss')
+            team_classifier.fit(collect_player_crops(
+                source_video_path, player_detection_model, settings, profile))
+
+    store.save(team_classifier, project_id, video_id)
+    return team_classifier
+
+
+def record_embedding_cache(team_classifier: CentroidTeamClassifier) -> None:
+    """
+    Add the embedding cache lookups of a finished job to the cache metrics.
+    """
+    cache = getattr(team_classifier, 'cache', None)
+    if cache is not None:
+        metrics.CACHE_REQUESTS.inc(cache.hits, cache='embedding', result='hit')
+        metrics.CACHE_REQUESTS.inc(cache.misses, cache='embedding', result='miss')
+
+
+def run_pitch_detection(
+    source_video_path: str,
+    device: str,
+    profile: InferenceProfile = PROFILES[Profile.ACCURATE],
+    start: int = 0,
+    end: Optional[int] = None
+) -> Iterator[np.ndarray]:
     """
     Run pitch detection on a video and yield annotated frames.
 
     Args:
         source_video_path (str): Path to the source video.
         device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        profile (InferenceProfile): Inference sizes, thresholds and resolution.
+        start (int): Index of the first frame to process.
+        end (Optional[int]): Index of the frame to stop at. None processes the
+            rest of the video.
 
     Yields:
         Iterator[np.ndarray]: Iterator over annotated frames.
     """
-    pitch_detection_model = YOLO(PITCH_DETECTION_MODEL_PATH).to(device=device)
-    frame_generator = sv.get_video_frames_generator(source_path=source_video_path)
+    settings = profile.settings(Service.PITCH_DETECTION)
+    pitch_detection_model = load_yolo(PITCH_DETECTION_MODEL_PATH, device=device)
+    frame_generator = metrics.timed_iter(get_video_frames_generator(
+        source_path=source_video_path, start=start, end=end, reuse_buffers=True), 'decode')
     for frame in frame_generator:
-        result = pitch_detection_model(frame, verbose=False)[0]
-        keypoints = sv.KeyPoints.from_ultralytics(result)
-
-        annotated_frame = frame.copy()
-        annotated_frame = VERTEX_LABEL_ANNOTATOR.annotate(
-            annotated_frame, keypoints, CONFIG.labels)
+        resized, scale = downscale(frame, profile.max_resolution)
+        with metrics.timed('pitch_detection'):
+            result = pitch_detection_model(
+                resized, imgsz=settings.pitch_imgsz, verbose=False)[0]
+        keypoints = upscale_keypoints(sv.KeyPoints.from_ultralytics(result), scale)
+
+        with metrics.timed('annotation'):
+            annotated_frame = VERTEX_LABEL_ANNOTATOR.annotate(
+                frame, keypoints, CONFIG.labels)
         yield annotated_frame, keypoints
 
 
-def run_player_detection(source_video_path: str, device: str) -> Iterator[np.ndarray]:
+def run_player_detection(
+    source_video_path: str,
+    device: str,
+    profile: InferenceProfile = PROFILES[Profile.ACCURATE],
+    start: int = 0,
+    end: Optional[int] = None
+) -> Iterator[np.ndarray]:
     """
     Run player detection on a video and yield annotated frames.
 
     Args:
         source_video_path (str): Path to the source video.
         device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        profile (InferenceProfile): Inference sizes, thresholds, keyframe interval
+            and resolution.
+        start (int): Index of the first frame to process.
+        end (Optional[int]): Index of the frame to stop at. None processes the
+            rest of the video.
 
     Yields:
         Iterator[np.ndarray]: Iterator over annotated frames.
     """
-    player_detection_model = YOLO(PLAYER_DETECTION_MODEL_PATH).to(device=device)
-    frame_generator = sv.get_video_frames_generator(source_path=source_video_path)
+    settings = profile.settings(Service.PLAYER_DETECTION)
+    player_detection_model = load_yolo(PLAYER_DETECTION_MODEL_PATH, device=device)
+    player_detector = create_player_detector(player_detection_model, settings)
+    frame_generator = metrics.timed_iter(get_video_frames_generator(
+        source_path=source_video_path, start=start, end=end, reuse_buffers=True), 'decode')
     for frame in frame_generator:
-        result = player_detection_model(frame, imgsz=1280, verbose=False)[0]
-        detections = sv.Detections.from_ultralytics(result)
-        annotated_frame = frame.copy()
-        annotated_frame = BOX_ANNOTATOR.annotate(annotated_frame, detections)
-        annotated_frame = BOX_LABEL_ANNOTATOR.annotate(annotated_frame, detections)
+        resized, scale = downscale(frame, profile.max_resolution)
+        detections = upscale_detections(player_detector(resized), scale)
+        with metrics.timed('annotation'):
+            annotated_frame = BOX_ANNOTATOR.annotate(frame, detections)
+            annotated_frame = BOX_LABEL_ANNOTATOR.annotate(annotated_frame, detections)
         yield annotated_frame, detections
 
 
-def run_ball_detection(source_video_path: str, device: str) -> Iterator[np.ndarray]:
+def run_ball_detection(
+    source_video_path: str,
+    device: str,
+    profile: InferenceProfile = PROFILES[Profile.ACCURATE],
+    start: int = 0,
+    end: Optional[int] = None
+) -> Iterator[np.ndarray]:
     """
     Run ball detection on a video and yield annotated frames.
 
     Args:
         source_video_path (str): Path to the source video.
         device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        profile (InferenceProfile): Inference sizes, thresholds and resolution.
+        start (int): Index of the first frame to process.
+        end (Optional[int]): Index of the frame to stop at. None processes the
+            rest of the video.
 
     Yields:
         Iterator[np.ndarray]: Iterator over annotated frames.
     """
-    ball_detection_model = YOLO(BALL_DETECTION_MODEL_PATH).to(device=device)
-    frame_generator = sv.get_video_frames_generator(source_path=source_video_path)
+    settings = profile.settings(Service.BALL_DETECTION)
+    ball_detection_model = load_yolo(BALL_DETECTION_MODEL_PATH, device=device)
+    frame_generator = metrics.timed_iter(get_video_frames_generator(
+        source_path=source_video_path, start=start, end=end, reuse_buffers=True), 'decode')
     ball_tracker = BallTracker(buffer_size=20)
     ball_annotator = BallAnnotator(radius=6, buffer_size=10)
 
     def callback(image_slice: np.ndarray) -> sv.Detections:
-        result = ball_detection_model(image_slice, imgsz=640, verbose=False)[0]
+        with metrics.timed('ball_detection'):
+            result = ball_detection_model(
+                image_slice, imgsz=settings.imgsz, conf=settings.confidence,
+                verbose=False)[0]
         return sv.Detections.from_ultralytics(result)
 
     slicer = sv.InferenceSlicer(
         callback=callback,
         overlap_filter_strategy=sv.OverlapFilter.NONE,
-        slice_wh=(640, 640),
+        slice_wh=(settings.imgsz, settings.imgsz),
     )
 
     for frame in frame_generator:
-        detections = slicer(frame).with_nms(threshold=0.1)
-        detections = ball_tracker.update(detections)
-        annotated_frame = frame.copy()
-        annotated_frame = ball_annotator.annotate(annotated_frame, detections)
+        resized, scale = downscale(frame, profile.max_resolution)
+        detections = upscale_detections(slicer(resized).with_nms(threshold=0.1), scale)
+        with metrics.timed('tracking'):
+            detections = ball_tracker.update(detections)
+        with metrics.timed('annotation'):
+            annotated_frame = ball_annotator.annotate(frame, detections)
         yield annotated_frame, detections
 
 
-def run_player_tracking(source_video_path: str, device: str) -> Iterator[np.ndarray]:
+def run_player_tracking(
+    source_video_path: str,
+    device: str,
+    profile: InferenceProfile = PROFILES[Profile.ACCURATE],
+    start: int = 0,
+    end: Optional[int] = None
+) -> Iterator[np.ndarray]:
     """
     Run player tracking on a video and yield annotated frames with tracked players.
 
     Args:
         source_video_path (str): Path to the source video.
         device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        profile (InferenceProfile): Inference sizes, thresholds, keyframe interval
+            and resolution.
+        start (int): Index of the first frame to process.
+        end (Optional[int]): Index of the frame to stop at. None processes the
+            rest of the video.
 
     Yields:
         Iterator[np.ndarray]: Iterator over annotated frames.
     """
-    player_detection_model = YOLO(PLAYER_DETECTION_MODEL_PATH).to(device=device)
-    frame_generator = sv.get_video_frames_generator(source_path=source_video_path)
+    settings = profile.settings(Service.PLAYER_TRACKING)
+    player_detection_model = load_yolo(PLAYER_DETECTION_MODEL_PATH, device=device)
+    player_detector = create_player_detector(player_detection_model, settings)
+    frame_generator = metrics.timed_iter(get_video_frames_generator(
+        source_path=source_video_path, start=start, end=end, reuse_buffers=True), 'decode')
     tracker = sv.ByteTrack(minimum_consecutive_frames=3)
     for frame in frame_generator:
-        result = player_detection_model(frame, imgsz=1280, verbose=False)[0]
-        detections = sv.Detections.from_ultralytics(result)
-        detections = tracker.update_with_detections(detections)
+        resized, scale = downscale(frame, profile.max_resolution)
+        detections = upscale_detections(player_detector(resized), scale)
+        with metrics.timed('tracking'):
+            detections = tracker.update_with_detections(detections)
 
-        labels = [str(tracker_id) for tracker_id in detections.tracker_id]
-
-        annotated_frame = frame.copy()
-        annotated_frame = ELLIPSE_ANNOTATOR.annotate(annotated_frame, detections)
-        annotated_frame = ELLIPSE_LABEL_ANNOTATOR.annotate(
-            annotated_frame, detections, labels=labels)
+        with metrics.timed('annotation'):
+            annotated_frame = annotate_tracks(frame, detections)
         yield annotated_frame, detections
 
 
-def run_team_classification(source_video_path: str, device: str) -> Iterator[np.ndarray]:
+def run_team_classification(
+    source_video_path: str,
+    device: str,
+    profile: InferenceProfile = PROFILES[Profile.ACCURATE],
+    project_id: Optional[str] = None,
+    video_id: Optional[str] = None,
+    start: int = 0,
+    end: Optional[int] = None
+) -> Iterator[np.ndarray]:
     """
     Run team classification on a video and yield annotated frames with team colors.
 
     Args:
         source_video_path (str): Path to the source video.
         device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        profile (InferenceProfile): Inference sizes, thresholds, keyframe interval,
+            crop sampling stride, batch size and resolution.
+        project_id (Optional[str]): Project of the video, to reuse its team models.
+        video_id (Optional[str]): Id of the video, to reuse its team model.
+        start (int): Index of the first frame to process.
+        end (Optional[int]): Index of the frame to stop at. None processes the
+            rest of the video.
 
     Yields:
         Iterator[np.ndarray]: Iterator over annotated frames.
     """
-    player_detection_model = YOLO(PLAYER_DETECTION_MODEL_PATH).to(device=device)
-    frame_generator = sv.get_video_frames_generator(
-        source_path=source_video_path, stride=STRIDE)
-
-    crops = []
-    for frame in frame_generator:
-        result = player_detection_model(frame, imgsz=1280, verbose=False)[0]
-        detections = sv.Detections.from_ultralytics(result)
-        crops += get_crops(frame, detections[detections.class_id == PLAYER_CLASS_ID])
-
-    team_classifier = TeamClassifier(device=device)
-    team_classifier.fit(crops)
-
-    frame_generator = sv.get_video_frames_generator(source_path=source_video_path)
+    settings = profile.settings(Service.TEAM_CLASSIFICATION)
+    player_detection_model = load_yolo(PLAYER_DETECTION_MODEL_PATH, device=device)
+    team_classifier = fit_team_classifier(
+        source_video_path, player_detection_model, settings, profile, device,
+        project_id=project_id, video_id=video_id)
+
+    player_detector = create_player_detector(player_detection_model, settings)
+    frame_generator = metrics.timed_iter(get_video_frames_generator(
+        source_path=source_video_path, start=start, end=end, reuse_buffers=True), 'decode')
     tracker = sv.ByteTrack(minimum_consecutive_frames=3)
     for frame in frame_generator:
-        result = player_detection_model(frame, imgsz=1280, verbose=False)[0]
-        detections = sv.Detections.from_ultralytics(result)
-        detections = tracker.update_with_detections(detections)
-
-        labels = [str(tracker_id) for tracker_id in detections.tracker_id]
+        resized, scale = downscale(frame, profile.max_resolution)
+        detections = upscale_detections(player_detector(resized), scale)
+        with metrics.timed('tracking'):
+            detections = tracker.update_with_detections(detections)
 
-        annotated_frame = frame.copy()
-        annotated_frame = ELLIPSE_ANNOTATOR.annotate(annotated_frame, detections)
-        annotated_frame = ELLIPSE_LABEL_ANNOTATOR.annotate(
-            annotated_frame, detections, labels=labels)
+        with metrics.timed('annotation'):
+            annotated_frame = annotate_tracks(frame, detections)
         yield annotated_frame, detections
 
+    record_embedding_cache(team_classifier)
 
-def run_radar(source_video_path: str, device: str) -> Iterator[np.ndarray]:
-    player_detection_model = YOLO(PLAYER_DETECTION_MODEL_PATH).to(device=device)
-    pitch_detection_model = YOLO(PITCH_DETECTION_MODEL_PATH).to(device=device)
-    frame_generator = sv.get_video_frames_generator(
-        source_path=source_video_path, stride=STRIDE)
 
-    crops = []
-    for frame in frame_generator:
-        result = player_detection_model(frame, imgsz=1280, verbose=False)[0]
-        detections = sv.Detections.from_ultralytics(result)
-        crops += get_crops(frame, detections[detections.class_id == PLAYER_CLASS_ID])
+def run_radar(
+    source_video_path: str,
+    device: str,
+    profile: InferenceProfile = PROFILES[Profile.ACCURATE],
+    project_id: Optional[str] = None,
+    video_id: Optional[str] = None,
+    start: int = 0,
+    end: Optional[int] = None
+) -> Iterator[np.ndarray]:
+    """
+    Run team classification and pitch detection on a video and yield annotated
+    frames with a radar view of the players overlaid.
 
-    team_classifier = TeamClassifier(device=device)
-    team_classifier.fit(crops)
+    Args:
+        source_video_path (str): Path to the source video.
+        device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        profile (InferenceProfile): Inference sizes, thresholds, keyframe interval,
+            crop sampling stride, batch size and resolution. In between keyframes,
+            boxes are propagated with optical flow and the pitch keypoints follow
+            the camera motion.
+        project_id (Optional[str]): Project of the video, to reuse its team models.
+        video_id (Optional[str]): Id of the video, to reuse its team model.
+        start (int): Index of the first frame to process.
+        end (Optional[int]): Index of the frame to stop at. None processes the
+            rest of the video.
 
-    frame_generator = sv.get_video_frames_generator(source_path=source_video_path)
+    Yields:
+        Iterator[np.ndarray]: Iterator over annotated frames.
+    """
+    settings = profile.settings(Service.RADAR)
+    player_detection_model = load_yolo(PLAYER_DETECTION_MODEL_PATH, device=device)
+    pitch_detection_model = load_yolo(PITCH_DETECTION_MODEL_PATH, device=device)
+    team_classifier = fit_team_classifier(
+        source_video_path, player_detection_model, settings, profile, device,
+        project_id=project_id, video_id=video_id)
+
+    player_detector = create_player_detector(player_detection_model, settings)
+    frame_generator = metrics.timed_iter(get_video_frames_generator(
+        source_path=source_video_path, start=start, end=end, reuse_buffers=True), 'decode')
     tracker = sv.ByteTrack(minimum_consecutive_frames=3)
-    for frame in frame_generator:
-        result = pitch_detection_model(frame, verbose=False)[0]
-        keypoints = sv.KeyPoints.from_ultralytics(result)
-        result = player_detection_model(frame, imgsz=1280, verbose=False)[0]
-        detections = sv.Detections.from_ultralytics(result)
-        detections = tracker.update_with_detections(detections)
-
-        players = detections[detections.class_id == PLAYER_CLASS_ID]
-        crops = get_crops(frame, players)
-        players_team_id = team_classifier.predict(crops)
-
-        goalkeepers = detections[detections.class_id == GOALKEEPER_CLASS_ID]
-        goalkeepers_team_id = resolve_goalkeepers_team_id(
-            players, players_team_id, goalkeepers)
-
-        referees = detections[detections.class_id == REFEREE_CLASS_ID]
-
-        detections = sv.Detections.merge([players, goalkeepers, referees])
-        color_lookup = np.array(
-            players_team_id.tolist() +
-            goalkeepers_team_id.tolist() +
-            [REFEREE_CLASS_ID] * len(referees)
-        )
-        labels = [str(tracker_id) for tracker_id in detections.tracker_id]
-
-        annotated_frame = frame.copy()
-        annotated_frame = ELLIPSE_ANNOTATOR.annotate(
-            annotated_frame, detections, custom_color_lookup=color_lookup)
-        annotated_frame = ELLIPSE_LABEL_ANNOTATOR.annotate(
-            annotated_frame, detections, labels,
-            custom_color_lookup=color_lookup)
-
-        h, w, _ = frame.shape
-        radar = render_radar(detections, keypoints, color_lookup)
-        radar = sv.resize_image(radar, (w // 2, h // 2))
-        radar_h, radar_w, _ = radar.shape
-        rect = sv.Rect(
-            x=w // 2 - radar_w // 2,
-            y=h - radar_h,
-            width=radar_w,
-            height=radar_h
-        )
-        annotated_frame = sv.draw_image(annotated_frame, radar, opacity=0.5, rect=rect)
+    goalkeeper_resolver = GoalkeeperTeamResolver()
+    radar_overlay = RadarOverlay(CONFIG, COLORS)
+    keypoints, transformer = None, None
+    for frame_index, frame in enumerate(frame_generator, start):
+        resized, scale = downscale(frame, profile.max_resolution)
+        detections = upscale_detections(player_detector(resized), scale)
+        if keypoints is None or player_detector.last_was_keyframe:
+            with metrics.timed('pitch_detection'):
+                result = pitch_detection_model(
+                    resized, imgsz=settings.pitch_imgsz, verbose=False)[0]
+            keypoints = upscale_keypoints(sv.KeyPoints.from_ultralytics(result), scale)
+        else:
+            keypoints = shift_keypoints(keypoints, player_detector.last_shift / scale)
+        with metrics.timed('tracking'):
+            detections = tracker.update_with_detections(detections)
+
+        detections, color_lookup, pitch_xy, transformer = resolve_radar_frame(
+            frame, frame_index, detections, keypoints, transformer,
+            team_classifier, goalkeeper_resolver)
+        with metrics.timed('annotation'):
+            annotated_frame = annotate_tracks(frame, detections, color_lookup)
+            annotated_frame = radar_overlay.annotate(annotated_frame, pitch_xy, color_lookup)
         yield annotated_frame, detections
 
+    record_embedding_cache(team_classifier)
 
 
-def run_model(
-            source_video_path: str, 
-            target_video_path: str, 
-            project_id: str,
-            video_id: str,
-            mode: Service, 
-            device: str = 'cpu',
-            with_sql: bool = True
-            ):
+def create_frame_generator(
+    mode: Service,
+    source_video_path: str,
+    device: str,
+    profile: InferenceProfile,
+    project_id: Optional[str] = None,
+    video_id: Optional[str] = None,
+    start: int = 0,
+    end: Optional[int] = None
+) -> Iterator[np.ndarray]:
+    """
+    Create the frame generator of a Service.
 
-    if with_sql:
-        db_path = ROOT_DIR / 'detections.db'
-        engine = create_engine(f'sqlite:///{db_path.as_posix()}')
+    Args:
+        mode (Service): The Service to run.
+        source_video_path (str): Path to the source video.
+        device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        profile (InferenceProfile): The inference profile of the job.
+        project_id (Optional[str]): Project of the video, to reuse its team models.
+        video_id (Optional[str]): Id of the video, to reuse its team model.
+        start (int): Index of the first frame to process.
+        end (Optional[int]): Index of the frame to stop at.
+
+    Returns:
+        Iterator[np.ndarray]: Iterator over annotated frames and their results.
 
+    Raises:
+        NotImplementedError: If the Service has no pipeline.
+    """
+    kwargs = dict(
+        source_video_path=source_video_path, device=device, profile=profile,
+        start=start, end=end)
     match mode: 
         case Service.PITCH_DETECTION:
-            frame_generator = run_pitch_detection(
-                source_video_path=source_video_path, device=device)
+            return run_pitch_detection(**kwargs)
         case Service.PLAYER_DETECTION:
-            frame_generator = run_player_detection(
-                source_video_path=source_video_path, device=device)
+            return run_player_detection(**kwargs)
         case Service.BALL_DETECTION:
-            frame_generator = run_ball_detection(
-                source_video_path=source_video_path, device=device)
+            return run_ball_detection(**kwargs)
         case Service.PLAYER_TRACKING:
-            frame_generator = run_player_tracking(
-                source_video_path=source_video_path, device=device)
+            return run_player_tracking(**kwargs)
         case Service.TEAM_CLASSIFICATION:
-            frame_generator = run_team_classification(
-                source_video_path=source_video_path, device=device)
+            return run_team_classification(
+                **kwargs, project_id=project_id, video_id=video_id)
         case Service.RADAR:
-            frame_generator = run_radar(
-                source_video_path=source_video_path, device=device)
+            return run_radar(**kwargs, project_id=project_id, video_id=video_id)
         case _:
             raise NotImplementedError(f"Mode {mode} is not implemented.")
 
+
+def run_model(
+            source_video_path: str, 
+            target_video_path: str, 
+            project_id: str,
+            video_id: str,
+            mode: Service, 
+            device: str = 'cpu',
+            with_sql: bool = True,
+            profile: Optional[InferenceProfile] = None,
+            workers: Optional[int] = None
+            ):
+
+    profile = profile or get_profile()
+    workers = workers or SEGMENT_WORKERS
+
     video_info = sv.VideoInfo.from_video_path((ROOT_DIR / source_video_path).as_posix())
     total_frames = video_info.total_frames
     frame_count = 0
     if total_frames <= 30:
         raise ValueError("Video is too short")
-    
-    df = pd.DataFrame()
 
+    if workers > 1 and total_frames >= 2 * MIN_SEGMENT_FRAMES:
+        # imported here, the segments module builds on this one
+        from rag.segments import run_segmented_model
+
+        yield from run_segmented_model(
+            source_video_path=source_video_path,
+            target_video_path=target_video_path,
+            project_id=project_id,
+            video_id=video_id,
+            mode=mode,
+            device=device,
+            with_sql=with_sql,
+            profile=profile,
+            workers=workers
+        )
+        return
+
+    with metrics.job(mode, video_id) as timer:
+        frame_generator = create_frame_generator(
+            mode, source_video_path, device, profile,
+            project_id=project_id, video_id=video_id)
+        
+        df = pd.DataFrame()
+
+
+        with VideoSink((ROOT_DIR / target_video_path).as_posix(), video_info, codec="avc1") as video_sink:  
+            for frame, detections in frame_generator:
+
+                with metrics.timed('encode'):
+                    video_sink.write_frame(frame)
+                if len(detections) > 0:
+                    with metrics.timed('parse_detections'):
+                        df = parse_detection(detections, df, frame_count, project_id, video_id)
+                timer.frame()
+                percentage = (frame_count / total_frames) * 100 
+                yield percentage
+                frame_count += 1
+            print("Video processing complete!", frame_count, "frames processed of", total_frames)
+
+        save_detections(df, str(mode), profile, with_sql)
+
+
+def save_detections(
+    df: pd.DataFrame,
+    table: str,
+    profile: InferenceProfile,
+    with_sql: bool = True
+) -> None:
+    """
+    Append the detections of a job to the detections database.
 
-    with sv.VideoSink((ROOT_DIR / target_video_path).as_posix(), video_info, codec="avc1") as video_sink:  
-        for frame, detections in frame_generator:
-
-            video_sink.write_frame(frame)
-            if len(detections) > 0:
-                df = parse_detection(detections, df, frame_count, project_id, video_id)
-            percentage = (frame_count / total_frames) * 100 
-            yield percentage
-            frame_count += 1
-        print("Video processing complete!", frame_count, "frames processed of", total_frames)
+    Args:
+        df (pd.DataFrame): Detections of the job.
+        table (str): Name of the detections table.
+        profile (InferenceProfile): The inference profile of the job.
+        with_sql (bool): Only validate the detections when False.
 
+    Raises:
+        ValueError: If there are too few detections to be useful.
+    """
     if len(df) < 30 :
         # print("Not enough detections found")
         raise ValueError("Not enough detections found")
 
+    df['profile'] = str(profile.name)
+
     if with_sql:
-        df.to_sql(str(mode), engine, index=False, if_exists='append')
+        engine = get_engine('detections.db')
+        with metrics.timed('db_write'):
+            add_missing_columns(engine, table, df)
+            with engine.begin() as conn:
+                df.to_sql(table, conn, index=False, if_exists='append')
+                # cached agent answers about these videos are stale from now on
+                bump_versions(conn, df['video_id'].unique())
         print("Dataframe saved to SQLite database")
 
 
+def add_missing_columns(engine: Engine, table: str, df: pd.DataFrame) -> None:
+    """
+    Add the columns of the dataframe that an existing detections table lacks, so
+    that tables created by older versions keep accepting appended rows.
+
+    Args:
+        engine (Engine): Engine of the detections database.
+        table (str): Name of the detections table.
+        df (pd.DataFrame): Detections about to be appended.
+    """
+    inspector = inspect(engine)
+    if not inspector.has_table(table):
+        return
+    existing = {column['name'] for column in inspector.get_columns(table)}
+    with engine.begin() as conn:
+        for column in df.columns:
+            if column not in existing:
+                conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN "{column}"'))
+
+
 def parse_detection(
     detections: sv.Detections, 
     df: pd.DataFrame, 
@@ -470,12 +909,13 @@ def parse_detection(
         "confidence": confidence,
         "class_id": class_id,
         "tracker_id": tracker_id,
-        "class_name": data,
+        "class_name": data.get("class_name"),
+        "interpolated": bool(data.get(INTERPOLATED_KEY, False)),
         "frame": frame,
         "project": project,
         "video_id": video_id
         }
-        df = pd.concat([df, pd.DataFrame(to_add)], axis=0, ignore_index=True)
+        df = pd.concat([df, pd.DataFrame([to_add])], axis=0, ignore_index=True)
         # print(df)   
     return df
 
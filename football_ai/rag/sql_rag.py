@@ -5,20 +5,28 @@ from langchain.callbacks.streaming_aiter import AsyncIteratorCallbackHandler
 from langchain.schema.output import LLMResult
 from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.chat_history import InMemoryChatMessageHistory
-from langchain_ollama import ChatOllama
 from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
 from langchain.agents import create_react_agent, AgentExecutor
 from langgraph.prebuilt import create_react_agent as cra
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain.prompts import ChatPromptTemplate, PromptTemplate
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
 from typing import Callable, Any, Optional
 import asyncio
+import time
 import aioconsole  # pip install aioconsole
-from .prompts import column_descriptions, context, sql_system_message
-from langchain import hub
+from .prompts import context, sql_system_message
+from .history import FINAL_ANSWER, SQLMessageHistory
+from .streaming import FinalAnswerMatcher
+from .prompt_budget import (
+    FIRST_TOKEN_SECONDS, PROMPT_TOKENS, QUESTION_PROMPT_TOKENS, QUESTION_SECONDS,
+    estimate_tokens, get_schema_summaries, prompt_tokens
+)
+from .sandbox import SandboxedSQLDatabase
+from .llm import (
+    LOCAL_SERVICES, SERVICE_MODELS, LLMService, base_system_message, create_chat_model,
+    get_model_gate
+)
 from langchain_core.prompts import MessagesPlaceholder
 from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 from langchain_community.chat_message_histories import SQLChatMessageHistory
@@ -30,25 +38,20 @@ from sqlalchemy.sql import text
 from dotenv import load_dotenv
 from collections import defaultdict
 import json
+from loguru import logger
 from pathlib import Path
 
 load_dotenv()
 
 ASYNC_MODE = True
-FINAL_ANSWER = "Final Answer: "
 ROOT_DIR = Path(__file__).parent.parent
 
 class ModelLLM():
 
-    options = {
-        "google": ChatGoogleGenerativeAI,
-        "groq": ChatGroq
-    }
-
     def __init__(
         self, 
         caller, 
-        model: str, 
+        model: str = None, 
         temperature: int = 0, 
         max_tokens: int = None, 
         timeout: int = None, 
@@ -57,7 +60,9 @@ class ModelLLM():
         callbacks: list = [], 
         handle_parse_errors: bool = True 
         ):
-        self._llm = self.choose_caller(caller)(
+        # the provider of the service is only imported when it is used
+        self._llm = create_chat_model(
+            caller,
             model=model,
             temperature=temperature,
             max_tokens=max_tokens,
@@ -67,50 +72,45 @@ class ModelLLM():
             callbacks=callbacks,
         )
 
-
-    def choose_caller(self, option):
-        return self.options.get(option, ChatOllama)
-
     def get_llm(self):
         return self._llm
         
 class AsyncCallbackHandler(AsyncIteratorCallbackHandler):
-    content: str = ""
-    final_answer: bool = False
     
     def __init__(self, final_answer_pre_callback: Callable, token_callback: Callable) -> None:
         super().__init__()
         self.final_answer_pre_callback = final_answer_pre_callback
         self.token_callback = token_callback
-        self.first_colon_hit = False
+        # the marker is found as the tokens arrive, without keeping the response
+        self.matcher = FinalAnswerMatcher()
+        # prompt tokens of the LLM calls of the current question
+        self.prompt_tokens: list = []
+        self._call_start: Optional[float] = None
+
+    async def on_llm_start(self, serialized: dict, prompts: list, **kwargs: Any) -> None:
+        await super().on_llm_start(serialized, prompts, **kwargs)
+        self._call_start = time.perf_counter()
 
     async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
-        # print("On llm new token")
-        self.content += token
-        if "Final Answer" in self.content:
+        if self._call_start is not None:
+            FIRST_TOKEN_SECONDS.observe(time.perf_counter() - self._call_start)
+            self._call_start = None
+        started, answer = self.matcher.feed(token)
+        if started:
             await self.final_answer_pre_callback()
-            self.final_answer = True
-            self.content = ""
-
-        if self.final_answer:
-            if not self.first_colon_hit:
-                if ":" in token:
-                    self.first_colon_hit = True
-                proc_token = token.lstrip(FINAL_ANSWER)
-
-            else:
-                proc_token = token        
-            await self.token_callback(proc_token)
+        if answer:
+            await self.token_callback(answer)
 
     
     async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
         try:
-            if self.final_answer:
-                self.content = ""
-                self.final_answer = False
+            tokens = prompt_tokens(response)
+            if tokens is not None:
+                PROMPT_TOKENS.observe(tokens)
+                self.prompt_tokens.append(tokens)
+            if self.matcher.found:
                 self.done.set()
-            else:
-                self.content = ""
+            self.matcher.reset()
 
         except Exception as e:
             print(f"Error in on_llm_end: {e}")
@@ -142,15 +142,11 @@ class SQLAgent:
 
         self.stream_handler = AsyncCallbackHandler(final_answer_pre_callback, token_callback)
 
-        service_models = { 
-            "google": "gemini-1.5-pro",
-            "local": "llama3.1",
-            "groq": "llama-3.1-70b-versatile"
-        }
-
+        self.service = LLMService(service)
+        self.model_name = SERVICE_MODELS[self.service]
         self.llm = ModelLLM(
-            caller=service,
-            model=service_models[service],
+            caller=self.service,
+            model=self.model_name,
             callbacks=[self.stream_handler],
             streaming=True
         ).get_llm()
@@ -164,11 +160,13 @@ class SQLAgent:
             "metadata": defaultdict(dict)
         }
 
-        prompt_template = hub.pull("langchain-ai/sql-agent-system-prompt")
-        self.base_system_message = prompt_template.format(dialect="SQLite", top_k=5)
+        # pulled from the hub once, the local services run without network
+        self.base_system_message = base_system_message(
+            dialect="SQLite", top_k=5, offline=self.service in LOCAL_SERVICES)
         
         # Database setup
-        self.detection_db = SQLDatabase.from_uri(f"sqlite:///{(ROOT_DIR / detection_db_path).as_posix()}")
+        # the tools only see the detections of this video, within time and row limits
+        self.detection_db = SandboxedSQLDatabase(detection_db_path, project_id, video_id)
         
         # Initialize memory and agent
         # self.memory_async = AsyncSqliteSaver.from_conn_string(f"sqlite:///{(ROOT_DIR / memory_db_path).as_posix()}")
@@ -182,12 +180,14 @@ class SQLAgent:
         self.tools_str = "\n".join([f"Name: {tool.name}, Description: {tool.description}\n" 
                                    for tool in self.tools])
 
+        # only the tables of the video, with column statistics instead of sample rows
+        self.schema = get_schema_summaries(detection_db_path).get(project_id, video_id)
         self.system_message_langgraph = sql_system_message.format(
             base_system_message=self.base_system_message,
             context=context,
-            tables=self.detection_db.get_usable_table_names(),
-            table_info=self.detection_db.get_table_info(),
-            column_descriptions=column_descriptions,
+            tables=self.schema.tables,
+            table_info=self.schema.table_info,
+            column_descriptions=self.schema.column_descriptions,
             tools_str=self.tools_str,
             project_id=project_id,
             video_id=video_id,
@@ -227,8 +227,12 @@ class SQLAgentLanggraph(SQLAgent):
 
     async def process_question(self, question: str, sender: str):
         #  used to consume the generator and run the callback handler
+        start = time.perf_counter()
+        self.stream_handler.prompt_tokens = []
 
-        async with self.memory_async as memory:
+        # questions beyond the concurrency of the model wait for their turn
+        async with get_model_gate(self.service, self.model_name).slot(), \
+                self.memory_async as memory:
             self.agent_executor = cra(
                 self.llm_with_tools,
                 tools=self.tools,
@@ -237,6 +241,8 @@ class SQLAgentLanggraph(SQLAgent):
             )
 
             self.config['metadata']['sender'] = sender
+            # the recorder files the LLM calls under their question
+            self.config['metadata']['question'] = question
             async for _event in self.agent_executor.astream_events(
                 {"messages": question},
                 self.config,
@@ -244,6 +250,15 @@ class SQLAgentLanggraph(SQLAgent):
             ):
                 continue
 
+        elapsed = time.perf_counter() - start
+        calls = self.stream_handler.prompt_tokens
+        QUESTION_SECONDS.observe(elapsed)
+        if calls:
+            QUESTION_PROMPT_TOKENS.observe(sum(calls))
+        logger.info(
+            f"Answered in {elapsed:.1f}s with {len(calls)} LLM calls, {sum(calls)} prompt "
+            f"tokens, system prompt ~{estimate_tokens(self.system_message_langgraph)} tokens")
+
     async def create_generator(self, question: str, sender: str) -> AsyncGenerator:
         task = asyncio.create_task(self.process_question(question, sender))
         async for token in self.stream_handler.aiter():
@@ -251,68 +266,6 @@ class SQLAgentLanggraph(SQLAgent):
         await task
             
 
-class SQLMessageHistory():
-    def __init__(self, project_id: str, memory_db_path: str = "memory.db") -> None:
-        self.project_id = project_id
-        self.raw_memory = create_engine(f"sqlite:///{(ROOT_DIR / memory_db_path).as_posix()}")
-
-    def get_history(self):
-        with self.raw_memory.connect() as conn:
-            query_text = """
-            WITH json_data AS (
-                SELECT *,
-                    json_extract(metadata, '$.writes.agent.messages[0].kwargs.response_metadata.finish_reason') as finish_reason,
-                    json_extract(metadata, '$.writes.agent.messages[0].kwargs.tool_calls') as tool_calls,
-                    json_extract(metadata, '$.source') as source,
-                    json_extract(metadata, '$.session_id') as session_id,
-                    json_extract(metadata, '$.sender') as sender
-                FROM checkpoints
-            )
-            SELECT 
-                thread_id, 
-                checkpoint_id, 
-                metadata,
-                sender,
-                tool_calls
-            FROM json_data
-            WHERE thread_id = 1
-            AND (
-                LOWER(finish_reason) = 'stop'
-                OR source = 'input'
-            )
-            AND session_id = :project_id
-			AND (tool_calls IS NULL OR tool_calls = '[]')
-
-            ORDER BY checkpoint_id DESC
-            """
-            query = conn.execute(text(query_text), {"project_id": self.project_id})
-            messages = []
-            for row in query:
-                message_metadata = json.loads(row[2])
-                message_id = row[1]
-                writes = message_metadata.get('writes')
-                if writes.get('agent'):
-                    message = writes['agent']['messages'][0]['kwargs']['content'].lstrip(FINAL_ANSWER)
-                    # skip tool messages
-                    if message == "":
-                        continue
-                    messages.append({
-                        "id": message_id,
-                        "sender": "system",
-                        "message": message
-                        })
-                elif writes.get('__start__'):
-                    message = writes['__start__']['messages']
-                    sender = message_metadata.get('sender')
-                    messages.append({ 
-                        "id": message_id,
-                        "sender": sender,
-                        "message": message
-                    })
-
-        return messages
-
-
 async def main_langgraph():
 
     agent = SQLAgentLanggraph(
@@ -0,0 +1,199 @@
+import sys
+from pathlib import Path
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.append(ROOT_DIR.as_posix())
+import asyncio
+import os
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from rag import metrics
+
+FINAL_ANSWER_MARKER = "Final Answer"
+# between the marker and the answer, e.g. "Final Answer: " or "**Final Answer**:\n",
+# emphasis only up to the colon, after it it belongs to the answer
+ANSWER_PREAMBLE = set(": \t\r\n")
+
+# seconds a streamed token may wait to be sent with the next ones
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))
+# bytes of tokens sent in one socket frame at most, before waiting for the interval
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "512"))
+
+ANSWER_TOKENS = metrics.Histogram(
+    'agent_answer_tokens', 'Tokens per streamed answer.',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000))
+ANSWER_EMITS = metrics.Histogram(
+    'agent_answer_emits', 'Socket emits per streamed answer.',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 250, 500))
+
+
+def _failure_table(pattern: str) -> List[int]:
+    # length of the longest proper prefix of pattern[:i + 1] that is also its suffix
+    table = [0] * len(pattern)
+    k = 0
+    for i in range(1, len(pattern)):
+        while k and pattern[i] != pattern[k]:
+            k = table[k - 1]
+        if pattern[i] == pattern[k]:
+            k += 1
+        table[i] = k
+    return table
+
+
+class FinalAnswerMatcher:
+    """
+    Incremental search of the final answer in a stream of tokens.
+
+    The marker is searched with the Knuth-Morris-Pratt automaton, carried from
+    token to token, so that every character is looked at once whatever the
+    length of the response and wherever the tokens split the marker. The
+    colon, emphasis and whitespace after the marker are skipped, everything
+    after them is the answer.
+
+    Attributes:
+        found (bool): Whether the marker was seen.
+    """
+
+    SEARCHING, PREAMBLE, ANSWER = range(3)
+
+    def __init__(self, marker: str = FINAL_ANSWER_MARKER):
+        self.marker = marker
+        self._table = _failure_table(marker)
+        self.reset()
+
+    @property
+    def found(self) -> bool:
+        return self._state != self.SEARCHING
+
+    def reset(self) -> None:
+        self._state = self.SEARCHING
+        self._matched = 0
+        self._colon = False
+
+    def feed(self, token: str) -> Tuple[bool, str]:
+        """
+        Consume a token.
+
+        Returns:
+            Tuple[bool, str]: Whether the marker ends in this token, and the
+                part of the token that belongs to the answer.
+        """
+        if self._state == self.ANSWER:
+            return False, token
+
+        start = 0
+        found_now = False
+        if self._state == self.SEARCHING:
+            marker, table, matched = self.marker, self._table, self._matched
+            # outside of a partial match, skip to the first character of the marker
+            first = token.find(marker[0]) if matched == 0 else 0
+            if first < 0:
+                return False, ""
+            for index in range(first, len(token)):
+                char = token[index]
+                while matched and char != marker[matched]:
+                    matched = table[matched - 1]
+                if char == marker[matched]:
+                    matched += 1
+                    if matched == len(marker):
+                        self._state = self.PREAMBLE
+                        found_now = True
+                        start = index + 1
+                        break
+            self._matched = matched
+            if not found_now:
+                return False, ""
+
+        # PREAMBLE
+        while start < len(token):
+            char = token[start]
+            if char == ':':
+                self._colon = True
+            elif char not in ANSWER_PREAMBLE and (char != '*' or self._colon):
+                break
+            start += 1
+        if start < len(token):
+            self._state = self.ANSWER
+        return found_now, token[start:]
+
+
+def extract_final_answer(content: str, marker: str = FINAL_ANSWER_MARKER) -> str:
+    """
+    The answer of a complete response, the response itself when it has no marker.
+    """
+    matcher = FinalAnswerMatcher(marker)
+    _, answer = matcher.feed(content)
+    return answer if matcher.found else content
+
+
+class TokenBatcher:
+    """
+    Micro-batching of streamed tokens into socket frames.
+
+    Tokens are sent together once `max_bytes` of them are pending or
+    `max_delay` seconds after the first pending one. One frame is in flight
+    at a time: while it is being sent tokens keep accumulating, and a producer
+    reaching `max_bytes` waits for the frame in flight, so that a slow socket
+    slows the stream down instead of queuing frames without bound.
+
+    Attributes:
+        emit (Callable[[str], Awaitable]): Sends a frame.
+        max_delay (float): Seconds a token may wait.
+        max_bytes (int): Bytes that trigger a frame right away.
+        tokens (int): Tokens added.
+        emits (int): Frames sent.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[str], Awaitable],
+        max_delay: float = STREAM_FLUSH_INTERVAL,
+        max_bytes: int = STREAM_FLUSH_BYTES
+    ):
+        self.emit = emit
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.tokens = 0
+        self.emits = 0
+        self._buffer: List[str] = []
+        self._size = 0
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    async def add(self, token: str) -> None:
+        if not token:
+            return
+        self.tokens += 1
+        self._buffer.append(token)
+        self._size += len(token.encode())
+        if self._size >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.max_delay)
+        # from here on a flush of the producer must not cancel this one
+        self._timer = None
+        await self.flush()
+
+    async def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        async with self._lock:
+            if not self._buffer:
+                return
+            frame = "".join(self._buffer)
+            self._buffer.clear()
+            self._size = 0
+            self.emits += 1
+            await self.emit(frame)
+
+    async def close(self) -> None:
+        """
+        Send the pending tokens and record the stream in the metrics.
+        """
+        await self.flush()
+        if self.tokens:
+            ANSWER_TOKENS.observe(self.tokens)
+            ANSWER_EMITS.observe(self.emits)
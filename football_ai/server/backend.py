@@ -1,12 +1,18 @@
 from utils import (
     ROOT_DIR, 
     run_model_async, 
+    run_composite_model_async,
     Service, 
     validate_file_size_type, 
     set_project_status, 
     get_project_status,
     generate_headers,
     verify_token,
+    load_module,
+    warm_up,
+    WARM_UP,
+    compact_memory_periodically,
+    CHECKPOINT_COMPACTION_INTERVAL,
     MAIN_API_URL
 )
 
@@ -20,12 +26,23 @@ from fastapi import (
     File, 
     Depends, 
     status, 
-    HTTPException
+    HTTPException,
+    Query
 )
 from pydantic import BaseModel, constr
-from rag.sql_rag import SQLAgentLanggraph, SQLMessageHistory
+from rag.history import HISTORY_MAX_PAGE_SIZE, HISTORY_PAGE_SIZE, SQLMessageHistory
+from rag.answer_cache import get_answer_cache
+from rag.router import get_router
+from rag.prompt_budget import get_schema_summaries
+from rag.llm import AGENT_LLM_SERVICE
+from rag.database import run_sync
+from rag.streaming import TokenBatcher
+from rag.scheduler import AdmissionRejected, count_frames, get_scheduler
+from rag.profiles import Profile, DEFAULT_PROFILE, get_profile
+from rag import metrics
+from rag.profiling import ProfileFormat, profile_path
 from werkzeug.utils import secure_filename
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, FileResponse
 import asyncio
 import aiofiles
 from dotenv import load_dotenv
@@ -33,15 +50,14 @@ import ngrok
 import uvicorn
 from loguru import logger
 import firebase_admin
-from firebase_admin import credentials, firestore, storage
+from firebase_admin import credentials
 import socketio
 from contextlib import asynccontextmanager
 from socketsetup import register_socket_events
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
-from functools import partial
+from functools import partial, lru_cache
 from typing import AsyncGenerator
-import numpy as np
 import uuid
 import httpx
 
@@ -57,8 +73,16 @@ firebase_admin.initialize_app(my_credentitals, {
     'storageBucket': FIREBASE_BUCKET
 })
 
-db = firestore.client()
-bucket = storage.bucket()
+# the google cloud clients are slow to import, they are created on first use
+@lru_cache(maxsize=None)
+def get_firestore():
+    from firebase_admin import firestore
+    return firestore.client()
+
+@lru_cache(maxsize=None)
+def get_bucket():
+    from firebase_admin import storage
+    return storage.bucket()
 
 sio = socketio.AsyncServer(cors_allowed_origins=[], async_mode='asgi') 
 
@@ -76,7 +100,16 @@ async def lifespan(app: FastAPI):
     await register_socket_events(sio)
     socket_app = socketio.ASGIApp(sio, socketio_path="/ws/socketio")
     app.mount("/", socket_app)
+    # serve /health right away, the pipelines and the agent load in the background
+    warm_up_task = asyncio.create_task(warm_up()) if WARM_UP else None
+    compaction_task = (
+        asyncio.create_task(compact_memory_periodically())
+        if CHECKPOINT_COMPACTION_INTERVAL > 0 else None)
     yield
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    if compaction_task is not None:
+        compaction_task.cancel()
     # ngrok teardown
     # logger.info("Tearing Down Ngrok Tunnel")
     # ngrok.disconnect()
@@ -94,6 +127,17 @@ app.add_middleware(
 @app.middleware("http")
 async def before_request(request: Request, call_next):
 
+    # probed by the orchestrator before any user can log in
+    if request.url.path == "/health":
+        return await call_next(request)
+
+    # scraped by the monitoring stack and used by operators, not by users
+    if request.url.path == "/metrics" or request.url.path.startswith("/admin/"):
+        service_key = os.getenv("LOCAL_SERVICE_KEY")
+        if not service_key or request.headers.get("x-local-service-key") != service_key:
+            return JSONResponse(content={"error": "Invalid service key"}, status_code=401)
+        return await call_next(request)
+
     if request.method != "OPTIONS":
         token = request.cookies.get('token')
         xsrf_token = request.headers.get('x-xsrf-token')   
@@ -116,10 +160,43 @@ async def before_request(request: Request, call_next):
 async def health_check():
     return JSONResponse(content={"status": "ok"})
 
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# projects whose next video job is profiled, armed by an operator
+profiling_requests = set()
+
+@app.post("/admin/profiling/{project_id}")
+async def enable_profiling(project_id: str):
+    profiling_requests.add(project_id)
+    return JSONResponse(content={"project_id": project_id, "profiling": True})
+
+@app.delete("/admin/profiling/{project_id}")
+async def disable_profiling(project_id: str):
+    profiling_requests.discard(project_id)
+    return JSONResponse(content={"project_id": project_id, "profiling": False})
+
+@app.get("/ai/{project_id}/jobs/{video_id}/profile")
+async def get_job_profile(project_id: str, video_id: str, format: ProfileFormat = ProfileFormat.COLLAPSED):
+    # video ids are prefixed with their project, which also keeps the path in the jobs folder
+    if not video_id.startswith(f"{project_id}-") or secure_filename(video_id) != video_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    path = profile_path(video_id, format)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="No profile recorded for this job")
+    return FileResponse(path, filename=path.name)
+
 class PredictFileRequest(BaseModel):
     model: Service
+    # more than one service runs them all in a single composite pass
+    services: List[Service] = []
     file: UploadFile
     prompt: Optional[constr(max_length=1000)] = None
+    profile: Profile = DEFAULT_PROFILE
+    # sample the job and record its torch operators, see /ai/{project_id}/jobs
+    profiling: bool = False
 
 class PredictAgentRequest(BaseModel):
     model: Optional[Service] = None # not required but may require to specify which table to help with prediction ?
@@ -134,16 +211,29 @@ class PredictRequest(BaseModel):
         model: Annotated[Optional[str], Form()] = None,
         file: Annotated[Optional[UploadFile], Form()] = None,
         prompt: Annotated[Optional[str], Form()] = None,
-        video_id: Annotated[Optional[str], Form()] = None
+        video_id: Annotated[Optional[str], Form()] = None,
+        profile: Annotated[Optional[str], Form()] = None,
+        profiling: Annotated[bool, Form()] = False
     ) -> Union[PredictFileRequest, PredictAgentRequest]:
 
+        services = []
         if model is not None:
-            model = Service[model.upper()]
+            # a comma separated list of models requests a composite job
+            services = list(dict.fromkeys(
+                Service[name.strip().upper()] for name in model.split(",")))
+            model = services[0]
 
         if file is not None:
             if not model: 
                 raise ValueError("Model is required")
-            return PredictFileRequest(model=model, file=file, prompt=prompt)
+            return PredictFileRequest(
+                model=model, 
+                services=services,
+                file=file, 
+                prompt=prompt, 
+                profile=get_profile(profile).name,
+                profiling=profiling
+            )
         elif prompt is not None and video_id is not None:
             return PredictAgentRequest(model=model, video_id=video_id, prompt=prompt)
         raise ValueError("Either file or (prompt and video_id) must be provided")         
@@ -154,6 +244,8 @@ async def predict(
     project_id: str,
     predict_request: Annotated[PredictRequest, Depends(PredictRequest.from_form)]
 ):
+    # the place of an admitted job in the inference queue
+    ticket = None
     try:
         async def token_stream_callback(token):
             await sio.emit('system_message', {"token": token}, room=project_id)
@@ -162,6 +254,52 @@ async def predict(
             await sio.emit('system_message_start', room=project_id)
             await asyncio.sleep(1) # ensure start message is sent before final answer
 
+        async def answer_question(prompt: str, video_id: str):
+            answer_tokens = []
+            # tokens are sent a few at a time rather than one frame per token
+            batcher = TokenBatcher(token_stream_callback)
+
+            async def record_token(token):
+                answer_tokens.append(token)
+                await batcher.add(token)
+
+            try:
+                await stream_answer(prompt, video_id, record_token)
+            finally:
+                await batcher.close()
+            # a failed or cancelled answer is not kept, the history would serve it
+            # and the agent would read it back as context
+            await SQLMessageHistory(project_id=project_id).aadd_turn(
+                sender, prompt, "".join(answer_tokens))
+
+        async def stream_answer(prompt: str, video_id: str, token_callback):
+            # canned analytics questions are answered with SQL, the rest by the agent
+            fast_answer = await get_router().process_question(
+                prompt, project_id, video_id,
+                final_answer_pre_stream_callback, token_callback)
+            if fast_answer is not None:
+                logger.info(f"Answered {fast_answer.intent} in {fast_answer.query_ms:.1f}ms")
+                return
+
+            async def run_agent(final_answer_pre_callback, token_callback):
+                sql_rag = await load_module("rag.sql_rag")
+                # a new video is summarized off the event loop, the agent gets it cached
+                await run_sync(get_schema_summaries().get, project_id, video_id)
+                agent = sql_rag.SQLAgentLanggraph(
+                    service=AGENT_LLM_SERVICE, 
+                    project_id=project_id,
+                    video_id=video_id,
+                    final_answer_pre_callback=final_answer_pre_callback,
+                    token_callback=token_callback
+                )
+                await agent.process_question(prompt, sender)
+
+            # repeated questions about unchanged detections replay the agent's answer
+            if await get_answer_cache().process_question(
+                    prompt, project_id, video_id,
+                    final_answer_pre_stream_callback, token_callback, run_agent):
+                logger.info(f"Answered from the answer cache for video {video_id}")
+
         project_status = await get_project_status(request, project_id)
         if project_status == "processing":
             raise HTTPException(status_code=400, detail="Project is currently processing a request")
@@ -174,7 +312,10 @@ async def predict(
 
         if isinstance(predict_request, PredictFileRequest):
             
-            service = Service[predict_request.model.upper()]
+            services = predict_request.services or [predict_request.model]
+            profile = get_profile(predict_request.profile)
+            profiling = predict_request.profiling or project_id in profiling_requests
+            profiling_requests.discard(project_id)
 
             validate_file_size_type(predict_request.file)
             
@@ -182,100 +323,151 @@ async def predict(
             temp_file = ROOT_DIR / f"temp/{sec_filename}"
             temp_file.parent.mkdir(exist_ok=True, parents=True)
 
-            output_file = ROOT_DIR / f"output/{sec_filename}"
-            output_file.parent.mkdir(exist_ok=True, parents=True)
+            stem, ext = sec_filename.split(".")
+            output_files = {
+                service: ROOT_DIR / (
+                    f"output/{sec_filename}" if len(services) == 1
+                    else f"output/{stem}-{str(service).lower()}.{ext}")
+                for service in services
+            }
+            (ROOT_DIR / "output").mkdir(exist_ok=True, parents=True)
 
             contents = await predict_request.file.read()
             async with aiofiles.open(temp_file, "wb") as f:
                 await f.write(contents)
 
+            # the job is admitted on its estimated work before it is queued, a
+            # rejected upload gets its place and wait back instead of an open request
+            scheduler = get_scheduler()
+            estimate = scheduler.estimate(
+                services, profile.name, await run_sync(count_frames, temp_file))
+            try:
+                # the job holds its place from here, it is released if it never runs
+                ticket = scheduler.admit(sender, estimate)
+            except AdmissionRejected as e:
+                logger.warning(
+                    f"Rejected {estimate.kind} job of {sender} ({e.reason}): "
+                    f"~{estimate.seconds:.0f}s of work, position {e.position}")
+                Path.unlink(temp_file)
+                return JSONResponse(content={
+                    "error": str(e),
+                    "reason": e.reason,
+                    "queue_position": e.position,
+                    "eta_seconds": round(e.eta_seconds)
+                }, status_code=429, headers={"Retry-After": str(max(1, round(e.eta_seconds)))})
+            logger.info(
+                f"Queued {estimate.kind} job of {sender}: ~{estimate.seconds:.0f}s of work, "
+                f"position {ticket.admission.position}, "
+                f"eta {ticket.admission.eta_seconds:.0f}s")
+
             # Initial progress
             await sio.emit('progress', {
                 'type': 'progress',
                 'percentage': 0
             }, room=project_id)
 
-            video_id = f"{project_id}-{str(uuid.uuid4())}"
+            video_ids = {
+                service: f"{project_id}-{str(uuid.uuid4())}" for service in services
+            }
 
             # Process video with socket.io progress updates
-            await run_model_async(
-                temp_file, 
-                output_file, 
-                project_id, 
-                video_id, 
-                service, 
-                sio, 
-            )
+            if len(services) == 1:
+                await run_model_async(
+                    temp_file, 
+                    output_files[services[0]], 
+                    project_id, 
+                    video_ids[services[0]], 
+                    services[0], 
+                    sio, 
+                    profile=profile,
+                    profiling=profiling,
+                    tenant=sender,
+                    ticket=ticket
+                )
+            else:
+                await run_composite_model_async(
+                    temp_file,
+                    output_files,
+                    project_id,
+                    video_ids,
+                    sio,
+                    profile=profile,
+                    profiling=profiling,
+                    tenant=sender,
+                    ticket=ticket
+                )
 
-            _, ext = sec_filename.split(".")
-            # Upload to firebase
-            blob = bucket.blob(f"projects/{project_id}/clips/{video_id}.{ext}")
-            with open(output_file, "rb") as f:
-                blob.upload_from_file(f, content_type=f"video/{ext}")
-                blob.make_public()
-                
-                url = blob.public_url
-                print(url)
+            clips = []
+            for service in services:
+                video_id = video_ids[service]
+                output_file = output_files[service]
+                # Upload to firebase
+                blob = get_bucket().blob(f"projects/{project_id}/clips/{video_id}.{ext}")
+                with open(output_file, "rb") as f:
+                    blob.upload_from_file(f, content_type=f"video/{ext}")
+                    blob.make_public()
+                    
+                    url = blob.public_url
+                    print(url)
+
+                if output_file.exists():
+                    Path.unlink(output_file)
+
+                # let microservice save video to db
+                async with httpx.AsyncClient() as client:
+                    resp = await client.post(
+                        f"{MAIN_API_URL}/projects/{project_id}/save-clip", 
+                        headers=generate_headers(request),
+                        cookies=request.cookies,
+                        json={
+                            "video_id": video_id,
+                            "url": url,
+                            "content_type": f"video/{ext}",
+                        }
+                    )
+                    if resp.status_code != 200:
+                        logger.error(f"Error saving video to db: {resp.text}")
+                        raise ValueError("Error saving video to db")
+
+                await sio.emit('new_clip', {
+                    "video_id": video_id,
+                    "url": url,
+                    "content_type": f"video/{ext}"
+                }, room=project_id)
+                clips.append({
+                    "video_id": video_id,
+                    "url": url,
+                    "content_type": f"video/{ext}",
+                    "model": str(service)
+                })
 
             # Clean up files
             if temp_file.exists():
                 Path.unlink(temp_file)
-            if output_file.exists():
-                Path.unlink(output_file)
-
-            # let microservice save video to db
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(
-                    f"{MAIN_API_URL}/projects/{project_id}/save-clip", 
-                    headers=generate_headers(request),
-                    cookies=request.cookies,
-                    json={
-                        "video_id": video_id,
-                        "url": url,
-                        "content_type": f"video/{ext}",
-                    }
-                )
-                if resp.status_code != 200:
-                    logger.error(f"Error saving video to db: {resp.text}")
-                    raise ValueError("Error saving video to db")
 
-            await socket.emit('new_clip', {
-                "video_id": video_id,
-                "url": url,
-                "content_type": f"video/{ext}"
-            }, room=project_id)
+            video_id, url = clips[0]["video_id"], clips[0]["url"]
 
             if predict_request.prompt:
-                agent = SQLAgentLanggraph(
-                    service="google", 
-                    project_id=project_id,
-                    video_id=video_id,
-                    final_answer_pre_callback=final_answer_pre_stream_callback,
-                    token_callback=token_stream_callback
-                )
-
-                await agent.process_question(predict_request.prompt, sender)
+                await answer_question(predict_request.prompt, video_id)
 
          
 
             return JSONResponse(content={
                 "video_id": video_id,
                 "url": url,
-                "content_type": f"video/{ext}"
+                "content_type": f"video/{ext}",
+                "profile": str(profile.name),
+                "clips": clips,
+                "profiling": (
+                    f"/ai/{project_id}/jobs/{video_ids[services[0]]}/profile"
+                    if profiling else None
+                )
             }, status_code=200)
 
         # Handle batch prediction (video_id with prompt)
         elif isinstance(predict_request, PredictAgentRequest):
 
-            agent = SQLAgentLanggraph(
-                service="google", 
-                project_id=project_id,
-                video_id=predict_request.video_id,
-                final_answer_pre_callback=final_answer_pre_stream_callback,
-                token_callback=token_stream_callback
-            )
-
-            await agent.process_question(predict_request.prompt, sender)
+            await answer_question(predict_request.prompt, predict_request.video_id)
 
             return JSONResponse(content={"status": "ok"}, status_code=200)
 
@@ -297,16 +489,25 @@ async def predict(
         raise HTTPException(status_code=500, detail=str(e))
 
     finally:
+        if ticket is not None:
+            # a job that failed before it ran gives its place back
+            get_scheduler().release(ticket)
         await set_project_status(sio, request, project_id, "active")
             
 @app.get("/ai/{project_id}/messages")
-def get_history(request: Request, project_id: str):
+async def get_history(
+    request: Request,
+    project_id: str,
+    before: Optional[int] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_MAX_PAGE_SIZE)
+):
 
     try:
         sql_history = SQLMessageHistory(project_id=project_id)
-        messages = sql_history.get_history()
+        messages, next_cursor = await sql_history.aget_history(before=before, limit=limit)
         
-        return JSONResponse(content={"messages": messages}, status_code=200)
+        return JSONResponse(
+            content={"messages": messages, "next_cursor": next_cursor}, status_code=200)
 
     except Exception as e:
         return JSONResponse(content={"error": f"Error: {e}"}, status_code=500)
@@ -2,11 +2,18 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 from fastapi import HTTPException, status, Request
-from typing import IO, Callable
+from typing import IO, Callable, Dict, Iterator, Optional
 import filetype
-from rag.services import Service, run_model
-from concurrent.futures import ThreadPoolExecutor
+from rag.modes import Service
+from rag.profiles import DEFAULT_PROFILE, InferenceProfile
+from rag import metrics
+from rag.compaction import CHECKPOINT_COMPACTION_INTERVAL, compact_checkpoints
+from rag.database import run_sync
+from rag.scheduler import Admission, Ticket, get_scheduler
+from contextlib import nullcontext
 import asyncio
+import importlib
+import time
 import socketio
 import jwt
 import httpx
@@ -17,7 +24,10 @@ load_dotenv()
 
 ROOT_DIR = Path(__file__).parent.parent
 MAIN_API_URL = os.getenv("MAIN_API_URL", "http://localhost:3000")
-thread_pool = ThreadPoolExecutor(max_workers=3) 
+# the pipelines and the agent pull in torch, ultralytics, transformers and langchain,
+# they are imported on first use or by the warm-up task instead of at startup
+HEAVY_MODULES = ["rag.services", "rag.composite", "rag.sql_rag"]
+WARM_UP = os.getenv("WARM_UP", "true").lower() == "true"
 
 class AuthError(Exception):
     """Custom exception for authentication errors"""
@@ -28,6 +38,38 @@ class AuthExpiredError(AuthError):
     pass
 
 
+async def load_module(name: str):
+    """
+    Import a module in a thread, so that a first import does not block the event loop
+    """
+    return await asyncio.to_thread(importlib.import_module, name)
+
+
+async def warm_up() -> None:
+    """
+    Import the heavy modules in the background once the server is up
+    """
+    for name in HEAVY_MODULES:
+        try:
+            start = time.perf_counter()
+            await load_module(name)
+            logger.info(f"Warmed up {name} in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            logger.error(f"Warm up of {name} failed: {e}")
+
+
+async def compact_memory_periodically() -> None:
+    """
+    Compact the agent checkpoints every `CHECKPOINT_COMPACTION_INTERVAL` hours
+    """
+    while True:
+        await asyncio.sleep(CHECKPOINT_COMPACTION_INTERVAL * 3600)
+        try:
+            await run_sync(compact_checkpoints)
+        except Exception as e:
+            logger.error(f"Compaction of the agent checkpoints failed: {e}")
+
+
 def generate_headers(request: Request = None, xsrftoken: str = None) -> dict:
     if not request and not xsrftoken:
         raise ValueError("Request or XSRF token required")
@@ -116,17 +158,19 @@ async def call_refresh_service(cookie_data, xsrf_token, token):
         decoded = verify_token(new_token, new_xsrf_token)
         return decoded
     
-async def run_model_async(
-        source_video_path: str,
-        target_video_path: str,
-        project_id: str,
+async def run_with_progress(
+        job: Callable[[], Iterator[float]],
         video_id: str,
-        mode: Service,
         sio: socketio.AsyncServer,
-        device: str = 'cpu'
+        ticket: Ticket,
+        project_id: Optional[str] = None,
+        profiling: bool = False
         ):
     """
-    Asynchronous wrapper for run_model that runs in a thread pool
+    Run a progress generator on the inference scheduler, emitting its progress over the
+    socket, and its place in the queue to the project while it waits for a worker.
+    With profiling, the job thread is profiled and the profiles are saved next to the
+    job timings under the video id.
     """
     loop = asyncio.get_event_loop()
     
@@ -137,6 +181,7 @@ async def run_model_async(
         try:
             while True:
                 percentage = await queue.get()
+                metrics.QUEUE_DEPTH.dec(queue='progress')
                 if percentage is None:  # Signal to stop
                     break
                 await sio.emit('progress', {
@@ -152,20 +197,24 @@ async def run_model_async(
 
     def progress_callback(percentage):
         """Callback function to put progress updates in the queue"""
+        metrics.QUEUE_DEPTH.inc(queue='progress')
         asyncio.run_coroutine_threadsafe(queue.put(percentage), loop)
 
+    async def queue_update(place: Admission):
+        await sio.emit('queue', {
+            'position': place.position,
+            'eta_seconds': round(place.eta_seconds)
+        }, room=project_id)
+
     def run_in_thread():
-        # Run the original model with progress updates
-        for percentage in run_model(
-            source_video_path=source_video_path,
-            target_video_path=target_video_path,
-            project_id=project_id,
-            video_id=video_id,
-            mode=mode,
-            device=device
-        ):
-            print(video_id, f"{percentage}%")
-            progress_callback(percentage)
+        # only pay for the profiler import and sampling when asked to
+        if profiling:
+            from rag.profiling import profile_job
+        with profile_job(video_id) if profiling else nullcontext():
+            # Run the original model with progress updates
+            for percentage in job():
+                print(video_id, f"{percentage}%")
+                progress_callback(percentage)
         
         # Signal completion
         progress_callback(None)
@@ -174,8 +223,9 @@ async def run_model_async(
     queue_task = asyncio.create_task(process_queue())
     
     try:
-        # Run the CPU-intensive task in the thread pool
-        await loop.run_in_executor(thread_pool, run_in_thread)
+        # Run the CPU-intensive task once the scheduler gives it a worker
+        await get_scheduler().run(
+            ticket, run_in_thread, on_wait=queue_update if project_id else None)
         # Wait for queue to finish processing
         await queue_task
     except Exception as e:
@@ -183,6 +233,78 @@ async def run_model_async(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def run_model_async(
+        source_video_path: str,
+        target_video_path: str,
+        project_id: str,
+        video_id: str,
+        mode: Service,
+        sio: socketio.AsyncServer,
+        device: str = 'cpu',
+        profile: InferenceProfile = None,
+        profiling: bool = False,
+        tenant: str = '',
+        ticket: Optional[Ticket] = None
+        ):
+    """
+    Asynchronous wrapper for run_model that runs on the inference scheduler, with the
+    ticket of its admission or queued for the tenant with a default length estimate
+    """
+    def job():
+        # imported in the job thread, once warmed up this is a lookup
+        from rag.services import run_model
+        return run_model(
+            source_video_path=source_video_path,
+            target_video_path=target_video_path,
+            project_id=project_id,
+            video_id=video_id,
+            mode=mode,
+            device=device,
+            profile=profile
+        )
+
+    scheduler = get_scheduler()
+    ticket = ticket or scheduler.submit(
+        tenant, scheduler.estimate([mode], profile.name if profile else DEFAULT_PROFILE))
+    await run_with_progress(
+        job, video_id, sio, ticket, project_id=project_id, profiling=profiling)
+
+
+async def run_composite_model_async(
+        source_video_path: str,
+        target_video_paths: Dict[Service, str],
+        project_id: str,
+        video_ids: Dict[Service, str],
+        sio: socketio.AsyncServer,
+        device: str = 'cpu',
+        profile: InferenceProfile = None,
+        profiling: bool = False,
+        tenant: str = '',
+        ticket: Optional[Ticket] = None
+        ):
+    """
+    Asynchronous wrapper for run_composite_model that runs on the inference scheduler
+    """
+    def job():
+        from rag.composite import run_composite_model
+        return run_composite_model(
+            source_video_path=source_video_path,
+            target_video_paths=target_video_paths,
+            project_id=project_id,
+            video_ids=video_ids,
+            device=device,
+            profile=profile
+        )
+
+    scheduler = get_scheduler()
+    ticket = ticket or scheduler.submit(
+        tenant, scheduler.estimate(list(video_ids), profile.name if profile else DEFAULT_PROFILE))
+    # the job is recorded under the clip of its first Service
+    await run_with_progress(
+        job, next(iter(video_ids.values())), sio, ticket,
+        project_id=project_id, profiling=profiling)
+
+
 def validate_file_size_type(file: IO):
 
     accepted_file_types = [
@@ -0,0 +1,144 @@
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+import supervision as sv
+
+from sports.annotators.soccer import draw_pitch, draw_points_on_pitch
+from sports.configs.soccer import SoccerPitchConfiguration
+
+
+class FrameCompositor:
+    """
+    Hands out the canvases annotated frames are drawn on.
+
+    When the raw frame is not needed once annotated, the frame itself is the
+    canvas. Otherwise it is copied into one of a small ring of reusable buffers
+    instead of a new array.
+
+    Attributes:
+        in_place (bool): Draw on the frame itself.
+        ring_size (int): Number of reusable buffers. A canvas is overwritten
+            `ring_size` frames later, so it must be written out before then.
+    """
+
+    def __init__(self, in_place: bool = True, ring_size: int = 2):
+        self.in_place = in_place
+        self.ring_size = ring_size
+        self.buffers: List[np.ndarray] = []
+        self.index = 0
+
+    def canvas(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Get the canvas to annotate a frame on.
+
+        Args:
+            frame (np.ndarray): The raw frame.
+
+        Returns:
+            np.ndarray: The frame itself, or a buffer holding a copy of it.
+        """
+        if self.in_place:
+            return frame
+
+        slot = self.index % self.ring_size
+        self.index += 1
+        if slot == len(self.buffers):
+            self.buffers.append(np.empty_like(frame))
+        elif self.buffers[slot].shape != frame.shape:
+            self.buffers[slot] = np.empty_like(frame)
+        np.copyto(self.buffers[slot], frame)
+        return self.buffers[slot]
+
+
+class RadarOverlay:
+    """
+    Draws the radar view of the players onto frames.
+
+    The empty pitch is drawn once and every frame only redraws the points on a
+    reusable copy of it, resizes into a reusable buffer and blends it into a
+    fixed region at the bottom center of the frame, in place.
+
+    Attributes:
+        config (SoccerPitchConfiguration): The pitch layout.
+        colors (List[str]): Hex color of each color index.
+        opacity (float): Opacity of the radar.
+        radius (int): Radius of the player points on the pitch image.
+    """
+
+    def __init__(
+        self,
+        config: SoccerPitchConfiguration,
+        colors: List[str],
+        opacity: float = 0.5,
+        radius: int = 20
+    ):
+        self.config = config
+        self.colors = [sv.Color.from_hex(color) for color in colors]
+        self.opacity = opacity
+        self.radius = radius
+        self.pitch = draw_pitch(config=config)
+        self.radar = np.empty_like(self.pitch)
+        self.resized: Optional[np.ndarray] = None
+        self.frame_shape: Optional[Tuple[int, ...]] = None
+        self.rect: Optional[sv.Rect] = None
+
+    def render(self, pitch_xy: np.ndarray, color_lookup: np.ndarray) -> np.ndarray:
+        """
+        Draw the located detections on the pitch.
+
+        Args:
+            pitch_xy (np.ndarray): Pitch coordinates of the detections, NaN when
+                unknown.
+            color_lookup (np.ndarray): Color index per detection.
+
+        Returns:
+            np.ndarray: The radar image, valid until the next call.
+        """
+        np.copyto(self.radar, self.pitch)
+        located = np.isfinite(pitch_xy).all(axis=1)
+        for color_id, color in enumerate(self.colors):
+            draw_points_on_pitch(
+                config=self.config, xy=pitch_xy[located & (color_lookup == color_id)],
+                face_color=color, radius=self.radius, pitch=self.radar)
+        return self.radar
+
+    def _layout(self, frame_shape: Tuple[int, ...]) -> None:
+        # same placement as fitting the radar in half the frame with sv.resize_image
+        h, w = frame_shape[:2]
+        pitch_h, pitch_w = self.pitch.shape[:2]
+        scale = min((w // 2) / pitch_w, (h // 2) / pitch_h)
+        radar_w, radar_h = int(pitch_w * scale), int(pitch_h * scale)
+        self.resized = np.empty((radar_h, radar_w, 3), dtype=np.uint8)
+        self.rect = sv.Rect(
+            x=w // 2 - radar_w // 2, y=h - radar_h, width=radar_w, height=radar_h)
+        self.frame_shape = frame_shape
+
+    def annotate(
+        self,
+        frame: np.ndarray,
+        pitch_xy: np.ndarray,
+        color_lookup: np.ndarray
+    ) -> np.ndarray:
+        """
+        Blend the radar into the frame, in place.
+
+        Args:
+            frame (np.ndarray): The frame to draw on.
+            pitch_xy (np.ndarray): Pitch coordinates of the detections.
+            color_lookup (np.ndarray): Color index per detection.
+
+        Returns:
+            np.ndarray: The annotated frame.
+        """
+        if frame.shape != self.frame_shape:
+            self._layout(frame.shape)
+        radar = self.render(pitch_xy, color_lookup)
+        cv2.resize(
+            radar, (self.rect.width, self.rect.height), dst=self.resized,
+            interpolation=cv2.INTER_LINEAR)
+        roi = frame[self.rect.y:self.rect.y + self.rect.height,
+                    self.rect.x:self.rect.x + self.rect.width]
+        cv2.addWeighted(
+            self.resized, self.opacity, roi, 1 - self.opacity, 0, dst=roi)
+        return frame
@@ -0,0 +1,284 @@
+import os
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Optional, Union
+
+import numpy as np
+
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch")
+INFERENCE_INT8 = os.getenv("INFERENCE_INT8", "false").lower() in ("1", "true")
+INTRA_OP_THREADS = int(os.getenv("INTRA_OP_THREADS", os.cpu_count() or 1))
+INTER_OP_THREADS = int(os.getenv("INTER_OP_THREADS", 1))
+
+Encoder = Callable[[np.ndarray], np.ndarray]
+
+
+class Backend(str, Enum):
+    """
+    Enum class representing the runtimes models can be executed with.
+    """
+    TORCH = 'TORCH'
+    ONNX = 'ONNX'
+    OPENVINO = 'OPENVINO'
+
+    def __str__(self):
+        return self.value
+
+
+def resolve_backend(backend: Optional[Union[str, Backend]] = None) -> Backend:
+    """
+    Resolve a backend name, falling back to the `INFERENCE_BACKEND` environment
+    variable.
+
+    Raises:
+        ValueError: If the backend does not exist.
+    """
+    return Backend((backend or INFERENCE_BACKEND).upper())
+
+
+def _ort_session(path: Path, device: str, backend: Backend = Backend.ONNX):
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise ImportError(
+            "The ONNX backend requires onnxruntime: pip install onnxruntime") from e
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = INTRA_OP_THREADS
+    options.inter_op_num_threads = INTER_OP_THREADS
+    options.execution_mode = (
+        ort.ExecutionMode.ORT_PARALLEL if INTER_OP_THREADS > 1
+        else ort.ExecutionMode.ORT_SEQUENTIAL
+    )
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    # the providers are given up front, in order of preference, with the CPU last
+    available = ort.get_available_providers()
+    providers = ['CPUExecutionProvider']
+    if device.startswith('cuda'):
+        providers.insert(0, 'CUDAExecutionProvider')
+    if backend == Backend.OPENVINO and 'OpenVINOExecutionProvider' in available:
+        providers.insert(0, 'OpenVINOExecutionProvider')
+    return ort.InferenceSession(
+        path.as_posix(), options,
+        providers=[provider for provider in providers if provider in available])
+
+
+def _ov_compiled_model(path: Path):
+    import openvino as ov
+
+    core = ov.Core()
+    xml = path if path.is_file() else next(path.glob('*.xml'))
+    return core.compile_model(
+        core.read_model(xml.as_posix()), 'CPU',
+        config={'PERFORMANCE_HINT': 'LATENCY', 'INFERENCE_NUM_THREADS': INTRA_OP_THREADS})
+
+
+def _tune_runtime(path: Path, device: str, backend: Backend) -> Callable:
+    """
+    Build an `on_predict_start` callback that replaces the runtime Ultralytics
+    created for an exported model with one using the tuned thread counts.
+
+    Ultralytics only creates its runtime when the predictor is set up, on the first
+    call, and runs this callback right after.
+    """
+    def on_predict_start(predictor) -> None:
+        model = predictor.model
+        if getattr(model, 'tuned', False):
+            return
+        if backend == Backend.ONNX:
+            model.session = _ort_session(path, device)
+            model.output_names = [output.name for output in model.session.get_outputs()]
+        else:
+            model.ov_compiled_model = _ov_compiled_model(path)
+        model.tuned = True
+
+    return on_predict_start
+
+
+def _quantize(path: Path) -> Path:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    target = path.with_name(f"{path.stem}-int8.onnx")
+    if not target.exists():
+        quantize_dynamic(path.as_posix(), target.as_posix(), weight_type=QuantType.QUInt8)
+    return target
+
+
+def _set_torch_threads() -> None:
+    import torch
+
+    torch.set_num_threads(INTRA_OP_THREADS)
+    try:
+        torch.set_num_interop_threads(INTER_OP_THREADS)
+    except RuntimeError:
+        # inter-op threads can only be set once, before any parallel work
+        pass
+
+
+def export_yolo(weights_path: Path, backend: Backend, int8: bool = False) -> Path:
+    """
+    Export YOLO weights to the given backend format, reusing a cached export that
+    lives next to the weights.
+
+    Args:
+        weights_path (Path): Path to the `.pt` weights.
+        backend (Backend): ONNX or OPENVINO.
+        int8 (bool): Quantize the ONNX weights to INT8.
+
+    Returns:
+        Path: Path to the exported model file or directory.
+    """
+    from ultralytics import YOLO
+
+    weights_path = Path(weights_path)
+    if backend == Backend.ONNX:
+        target = weights_path.with_suffix('.onnx')
+        if not target.exists():
+            exported = YOLO(weights_path).export(format='onnx', dynamic=True, simplify=True)
+            Path(exported).rename(target)
+        return _quantize(target) if int8 else target
+
+    if backend == Backend.OPENVINO:
+        target = weights_path.with_name(f"{weights_path.stem}_openvino_model")
+        if not target.exists():
+            exported = YOLO(weights_path).export(format='openvino', dynamic=True)
+            Path(exported).rename(target)
+        return target
+
+    return weights_path
+
+
+def load_yolo(
+    weights_path: Path,
+    device: str = 'cpu',
+    backend: Optional[Union[str, Backend]] = None,
+    int8: Optional[bool] = None
+):
+    """
+    Load a YOLO model on the requested backend.
+
+    Exported models are loaded the way Ultralytics loads them, from the `.onnx`
+    file or the `_openvino_model` directory, and keep its pre and post-processing.
+    On their first call, the ONNX Runtime session or OpenVINO compiled model is
+    replaced with one built with `INTRA_OP_THREADS` / `INTER_OP_THREADS`.
+
+    Args:
+        weights_path (Path): Path to the `.pt` weights.
+        device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        backend (Optional[Union[str, Backend]]): Runtime to use. Defaults to the
+            `INFERENCE_BACKEND` environment variable.
+        int8 (Optional[bool]): Quantize ONNX weights to INT8. Defaults to the
+            `INFERENCE_INT8` environment variable.
+
+    Returns:
+        YOLO: The loaded model.
+    """
+    from ultralytics import YOLO
+
+    backend = resolve_backend(backend)
+    int8 = INFERENCE_INT8 if int8 is None else int8
+
+    if backend == Backend.TORCH:
+        _set_torch_threads()
+        return YOLO(weights_path).to(device=device)
+
+    path = export_yolo(weights_path, backend, int8=int8)
+    model = YOLO(path.as_posix())
+    model.add_callback('on_predict_start', _tune_runtime(path, device, backend))
+    return model
+
+
+def export_siglip(model_path: str, target: Path) -> Path:
+    """
+    Export the SigLIP vision encoder, including the mean pooling of its last hidden
+    state, to ONNX with a dynamic batch axis.
+
+    Args:
+        model_path (str): HuggingFace id or path of the SigLIP model.
+        target (Path): Where to write the ONNX model.
+
+    Returns:
+        Path: The target path.
+    """
+    import torch
+    from transformers import SiglipVisionModel
+
+    class PooledEncoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, pixel_values):
+            return torch.mean(self.model(pixel_values=pixel_values).last_hidden_state, dim=1)
+
+    model = PooledEncoder(SiglipVisionModel.from_pretrained(model_path).eval())
+    size = model.model.config.image_size
+    target.parent.mkdir(exist_ok=True, parents=True)
+    torch.onnx.export(
+        model,
+        torch.zeros(1, 3, size, size),
+        target.as_posix(),
+        input_names=['pixel_values'],
+        output_names=['embeddings'],
+        dynamic_axes={'pixel_values': {0: 'batch'}, 'embeddings': {0: 'batch'}},
+        opset_version=17,
+    )
+    return target
+
+
+def load_siglip_encoder(
+    model_path: str,
+    device: str = 'cpu',
+    backend: Optional[Union[str, Backend]] = None,
+    int8: Optional[bool] = None,
+    cache_dir: Optional[Path] = None
+) -> Encoder:
+    """
+    Load the SigLIP vision encoder as a function mapping preprocessed pixel values
+    of shape (N, 3, H, W) to mean pooled embeddings of shape (N, D).
+
+    Args:
+        model_path (str): HuggingFace id or path of the SigLIP model.
+        device (str): Device to run the model on (e.g., 'cpu', 'cuda').
+        backend (Optional[Union[str, Backend]]): Runtime to use. Defaults to the
+            `INFERENCE_BACKEND` environment variable. OPENVINO runs the ONNX
+            export on ONNX Runtime with the OpenVINO execution provider, the
+            CPU one when onnxruntime-openvino is not installed.
+        int8 (Optional[bool]): Quantize the ONNX weights to INT8.
+        cache_dir (Optional[Path]): Directory of the cached ONNX export.
+
+    Returns:
+        Encoder: The embedding function.
+    """
+    backend = resolve_backend(backend)
+    int8 = INFERENCE_INT8 if int8 is None else int8
+
+    if backend == Backend.TORCH:
+        import torch
+        from transformers import SiglipVisionModel
+
+        _set_torch_threads()
+        model = SiglipVisionModel.from_pretrained(model_path).to(device)
+
+        def encode(pixel_values: np.ndarray) -> np.ndarray:
+            with torch.no_grad():
+                inputs = torch.from_numpy(pixel_values).to(device)
+                outputs = model(pixel_values=inputs)
+                return torch.mean(outputs.last_hidden_state, dim=1).cpu().numpy()
+
+        return encode
+
+    cache_dir = cache_dir or Path(__file__).parent.parent.parent / 'aimodels'
+    target = cache_dir / f"{Path(model_path).name}-vision.onnx"
+    if not target.exists():
+        export_siglip(model_path, target)
+    if int8:
+        target = _quantize(target)
+
+    session = _ort_session(target, device, backend)
+
+    def encode(pixel_values: np.ndarray) -> np.ndarray:
+        return session.run(
+            None, {'pixel_values': pixel_values.astype(np.float32, copy=False)})[0]
+
+    return encode
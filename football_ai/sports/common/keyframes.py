@@ -0,0 +1,217 @@
+from typing import Callable, Optional
+
+import cv2
+import numpy as np
+import supervision as sv
+
+INTERPOLATED_KEY = 'interpolated'
+
+
+def to_thumbnail(frame: np.ndarray, width: int) -> np.ndarray:
+    """
+    Convert a BGR frame to a downscaled grayscale thumbnail.
+
+    Args:
+        frame (np.ndarray): The BGR frame.
+        width (int): Width of the thumbnail in pixels. The aspect ratio is kept.
+
+    Returns:
+        np.ndarray: Grayscale thumbnail of the frame.
+    """
+    h, w = frame.shape[:2]
+    height = max(int(h * width / w), 1)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+
+def mark_interpolated(detections: sv.Detections, value: bool) -> sv.Detections:
+    """
+    Flag every detection as interpolated (propagated) or not.
+
+    Args:
+        detections (sv.Detections): Detections to flag in place.
+        value (bool): Whether the detections were propagated rather than detected.
+
+    Returns:
+        sv.Detections: The same detections, for chaining.
+    """
+    detections.data[INTERPOLATED_KEY] = np.full(len(detections), value, dtype=bool)
+    return detections
+
+
+class DetectionPropagator:
+    """
+    Propagates bounding boxes from the last keyframe to the following frames
+    using sparse Lucas-Kanade optical flow on a grid of points inside each box.
+
+    Attributes:
+        motion_threshold (float): Maximum median displacement, as a fraction of the
+            thumbnail width, before propagation is considered unreliable.
+        min_tracked_ratio (float): Minimum fraction of flow points that must be
+            tracked successfully for propagation to be trusted.
+    """
+
+    GRID = np.array(
+        [(x, y) for y in (0.25, 0.5, 0.75) for x in (0.25, 0.5, 0.75)],
+        dtype=np.float32
+    )
+
+    def __init__(self, motion_threshold: float = 0.05, min_tracked_ratio: float = 0.5):
+        self.motion_threshold = motion_threshold
+        self.min_tracked_ratio = min_tracked_ratio
+        self.previous: Optional[np.ndarray] = None
+        self.detections: Optional[sv.Detections] = None
+        self.scale = 1.0
+        self.last_shift = np.zeros(2, dtype=np.float32)
+
+    def reset(self, thumbnail: np.ndarray, detections: sv.Detections, scale: float) -> None:
+        """
+        Start propagating from a freshly detected keyframe.
+
+        Args:
+            thumbnail (np.ndarray): Grayscale thumbnail of the keyframe.
+            detections (sv.Detections): Detections found on the keyframe.
+            scale (float): Ratio between thumbnail and frame coordinates.
+        """
+        self.previous = thumbnail
+        self.detections = detections
+        self.scale = scale
+        self.last_shift = np.zeros(2, dtype=np.float32)
+
+    def propagate(self, thumbnail: np.ndarray) -> Optional[sv.Detections]:
+        """
+        Move the current boxes to the given frame.
+
+        Args:
+            thumbnail (np.ndarray): Grayscale thumbnail of the current frame.
+
+        Returns:
+            Optional[sv.Detections]: Propagated detections flagged as interpolated,
+                or None when motion is too large or tracking failed and a full
+                detection is required.
+        """
+        if self.previous is None or self.detections is None:
+            return None
+
+        detections = self.detections
+        if len(detections) == 0:
+            self.previous = thumbnail
+            return mark_interpolated(detections[np.arange(0)], True)
+
+        xyxy = detections.xyxy.astype(np.float32) * self.scale
+        wh = xyxy[:, 2:] - xyxy[:, :2]
+        points = xyxy[:, None, :2] + wh[:, None, :] * self.GRID[None, :, :]
+        points = points.reshape(-1, 1, 2)
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(
+            self.previous, thumbnail, points, None, winSize=(15, 15), maxLevel=2)
+        status = status.reshape(len(detections), len(self.GRID)).astype(bool)
+        if status.mean() < self.min_tracked_ratio:
+            return None
+
+        flow = (moved - points).reshape(len(detections), len(self.GRID), 2)
+        flow = np.where(status[:, :, None], flow, np.nan)
+        shifts = np.nanmedian(flow, axis=1)
+
+        global_shift = np.nanmedian(shifts, axis=0)
+        if np.linalg.norm(global_shift) > self.motion_threshold * thumbnail.shape[1]:
+            return None
+
+        # boxes that lost all their points follow the rest of the scene
+        shifts = np.where(np.isnan(shifts), global_shift, shifts)
+
+        propagated = detections[np.arange(len(detections))]
+        propagated.xyxy = detections.xyxy + np.tile(shifts / self.scale, 2)
+        mark_interpolated(propagated, True)
+
+        self.previous = thumbnail
+        self.detections = propagated
+        self.last_shift = (global_shift / self.scale).astype(np.float32)
+        return propagated
+
+
+class AdaptiveDetector:
+    """
+    Runs a detection callback only on keyframes and propagates boxes with optical
+    flow in between.
+
+    A frame is a keyframe when `interval` frames have passed since the last one,
+    when the mean absolute difference with the last keyframe thumbnail exceeds
+    `scene_change_threshold`, or when propagation reports too much motion.
+
+    Attributes:
+        interval (int): Maximum number of frames between two keyframes. An
+            interval of 1 disables propagation entirely.
+        keyframes (int): Number of frames that ran the detection callback.
+        propagated (int): Number of frames whose boxes were propagated.
+        last_was_keyframe (bool): Whether the last call ran the detection callback.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[np.ndarray], sv.Detections],
+        interval: int = 1,
+        scene_change_threshold: float = 12.0,
+        motion_threshold: float = 0.05,
+        thumbnail_width: int = 320
+    ):
+        self.callback = callback
+        self.interval = max(interval, 1)
+        self.scene_change_threshold = scene_change_threshold
+        self.thumbnail_width = thumbnail_width
+        self.propagator = DetectionPropagator(motion_threshold=motion_threshold)
+        self.keyframe_thumbnail: Optional[np.ndarray] = None
+        self.since_keyframe = 0
+        self.keyframes = 0
+        self.propagated = 0
+        self.last_was_keyframe = True
+
+    @property
+    def last_shift(self) -> np.ndarray:
+        """Median (x, y) displacement of the last propagated frame, in pixels."""
+        return self.propagator.last_shift
+
+    def _is_scene_change(self, thumbnail: np.ndarray) -> bool:
+        diff = cv2.absdiff(thumbnail, self.keyframe_thumbnail)
+        return float(diff.mean()) > self.scene_change_threshold
+
+    def _detect(self, frame: np.ndarray, thumbnail: Optional[np.ndarray]) -> sv.Detections:
+        detections = mark_interpolated(self.callback(frame), False)
+        self.keyframes += 1
+        self.since_keyframe = 0
+        self.last_was_keyframe = True
+        if thumbnail is not None:
+            self.keyframe_thumbnail = thumbnail
+            self.propagator.reset(
+                thumbnail, detections, scale=thumbnail.shape[1] / frame.shape[1])
+        return detections
+
+    def __call__(self, frame: np.ndarray) -> sv.Detections:
+        """
+        Detect or propagate objects on the next frame of the video.
+
+        Args:
+            frame (np.ndarray): The next frame, in decoding order.
+
+        Returns:
+            sv.Detections: Detections with an `interpolated` flag in their data.
+        """
+        if self.interval == 1:
+            return self._detect(frame, None)
+
+        thumbnail = to_thumbnail(frame, self.thumbnail_width)
+        self.since_keyframe += 1
+        if (
+            self.keyframe_thumbnail is None
+            or self.since_keyframe >= self.interval
+            or self._is_scene_change(thumbnail)
+        ):
+            return self._detect(frame, thumbnail)
+
+        detections = self.propagator.propagate(thumbnail)
+        if detections is None:
+            return self._detect(frame, thumbnail)
+
+        self.propagated += 1
+        self.last_was_keyframe = False
+        return detections
@@ -1,15 +1,38 @@
-from typing import Generator, Iterable, List, TypeVar
+import hashlib
+import os
+import warnings
+import zipfile
+from collections import OrderedDict
+from enum import Enum
+from pathlib import Path
+from typing import (
+    Dict, Generator, Hashable, Iterable, List, Optional, Sequence, TypeVar, Union
+)
 
+import cv2
 import numpy as np
-import supervision as sv
-import torch
-import umap
-from sklearn.cluster import KMeans
-from transformers import AutoProcessor, SiglipVisionModel
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+from sports.common.backends import Backend, load_siglip_encoder
 
 V = TypeVar("V")
 
-SIGLIP_MODEL_PATH = 'google/siglip-base-patch16-224'
+SIGLIP_MODEL_PATH = os.getenv("SIGLIP_MODEL_PATH", 'google/siglip-base-patch16-224')
+SIGLIP_IMAGE_SIZE = 224
+
+
+class TeamStrategy(str, Enum):
+    """
+    Enum class representing the available team classification strategies.
+    """
+    SIGLIP = 'SIGLIP'
+    COLOR = 'COLOR'
+
+    def __str__(self):
+        return self.value
+
+
+DEFAULT_TEAM_STRATEGY = TeamStrategy(os.getenv("TEAM_CLASSIFIER_STRATEGY", "SIGLIP").upper())
 
 
 def create_batches(
@@ -37,76 +60,669 @@ def create_batches(
         yield current_batch
 
 
-class TeamClassifier:
+def preprocess_crops(
+    crops: Sequence[np.ndarray],
+    size: int = SIGLIP_IMAGE_SIZE,
+    out: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Resize BGR crops and normalize them to SigLIP pixel values, writing straight
+    into a float32 (N, 3, size, size) buffer.
+
+    This matches the SigLIP image processor: bicubic resize, RGB channel order and
+    rescaling to [-1, 1] (mean and std of 0.5).
+
+    Args:
+        crops (Sequence[np.ndarray]): BGR image crops.
+        size (int): Side of the square model input.
+        out (Optional[np.ndarray]): Buffer with room for at least len(crops)
+            images, reused across batches. Allocated when missing or too small.
+
+    Returns:
+        np.ndarray: View of the buffer holding the preprocessed crops.
+    """
+    if out is None or out.shape[0] < len(crops) or out.shape[2:] != (size, size):
+        out = np.empty((len(crops), 3, size, size), dtype=np.float32)
+    pixel_values = out[:len(crops)]
+    for i, crop in enumerate(crops):
+        if crop.size == 0:
+            pixel_values[i] = 0
+            continue
+        resized = cv2.resize(crop, (size, size), interpolation=cv2.INTER_CUBIC)
+        pixel_values[i] = resized[:, :, ::-1].transpose(2, 0, 1)
+    pixel_values *= 2 / 255
+    pixel_values -= 1
+    return pixel_values
+
+
+def crop_hash(crop: np.ndarray) -> int:
+    """
+    Compute a 64-bit hash of the colors of a crop, downsampled to 8x8 and quantized
+    to 16 levels per BGR channel.
+
+    Near-identical crops share a hash, which is fine for team classification: they
+    belong to the same team. Crops with the same brightness pattern but different
+    shirt colors do not.
+
+    Args:
+        crop (np.ndarray): BGR image crop.
+
+    Returns:
+        int: The hash.
+    """
+    if crop.size == 0:
+        return 0
+    small = cv2.resize(crop, (8, 8), interpolation=cv2.INTER_AREA) >> 4
+    return int.from_bytes(hashlib.blake2b(small.tobytes(), digest_size=8).digest(), 'big')
+
+
+class EmbeddingCache:
+    """
+    A least recently used cache of crop embeddings.
+
+    Attributes:
+        maxsize (int): Maximum number of embeddings kept.
+        hits (int): Number of lookups answered from the cache.
+        misses (int): Number of lookups that required an embedding.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: Hashable) -> Optional[np.ndarray]:
+        embedding = self.entries.get(key)
+        if embedding is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return embedding
+
+    def put(self, key: Hashable, embedding: np.ndarray) -> None:
+        self.entries[key] = embedding
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+
+def tracker_keys(
+    tracker_ids: Iterable[int],
+    frame_index: int,
+    frame_bucket: int = 15
+) -> List[Hashable]:
+    """
+    Build embedding cache keys for tracked crops, so that the same tracked player
+    is embedded once per bucket of frames.
+
+    Args:
+        tracker_ids (Iterable[int]): Tracker ids of the crops.
+        frame_index (int): Index of the frame the crops come from.
+        frame_bucket (int): Number of consecutive frames sharing an embedding.
+
+    Returns:
+        List[Hashable]: One key per crop.
+    """
+    bucket = frame_index // frame_bucket
+    return [('tracker', int(tracker_id), bucket) for tracker_id in tracker_ids]
+
+
+class CentroidTeamClassifier:
+    """
+    Base class of the team classifiers. Subclasses turn crops into features and
+    features into the space they are clustered in; this class fits two centroids
+    in that space, assigns crops to the nearest one, updates the centroids online
+    and (de)serializes the fitted state.
+
+    Attributes:
+        strategy (TeamStrategy): The strategy implemented by the subclass.
+        centroids (Optional[np.ndarray]): The two team centroids.
+        counts (Optional[np.ndarray]): Number of samples behind each centroid.
+        spread (float): Mean distance of the fit samples to their centroid.
+        sample (Optional[np.ndarray]): Subsample of the features seen so far.
+        sample_labels (Optional[np.ndarray]): Team of each feature of the sample.
+    """
+    strategy: TeamStrategy
+    sample_size = 512
+    drift_factor = 2.0
+
+    def __init__(self):
+        self.centroids: Optional[np.ndarray] = None
+        self.counts: Optional[np.ndarray] = None
+        self.spread = 0.0
+        self.sample: Optional[np.ndarray] = None
+        self.sample_labels: Optional[np.ndarray] = None
+
+    def extract_features(
+        self,
+        crops: List[np.ndarray],
+        keys: Optional[List[Hashable]] = None
+    ) -> np.ndarray:
+        raise NotImplementedError
+
+    def create_cluster_model(self):
+        """
+        Create the unfitted two-cluster model `fit` uses.
+        """
+        return KMeans(n_clusters=2)
+
+    def project(self, features: np.ndarray, fit: bool = False) -> np.ndarray:
+        """
+        Map features to the clustering space, fitting the mapping when `fit` is set.
+        """
+        return features
+
+    def _distances(self, projections: np.ndarray) -> np.ndarray:
+        return np.linalg.norm(
+            projections[:, None, :] - self.centroids[None, :, :], axis=2)
+
+    def _add_to_sample(self, features: np.ndarray, labels: np.ndarray) -> None:
+        sample, sample_labels = features, labels
+        if self.sample is not None:
+            sample = np.concatenate([self.sample, features])
+            sample_labels = np.concatenate([self.sample_labels, labels])
+        if len(sample) > self.sample_size:
+            rng = np.random.default_rng(0)
+            kept = rng.choice(len(sample), self.sample_size, replace=False)
+            sample, sample_labels = sample[kept], sample_labels[kept]
+        self.sample = sample.astype(np.float16)
+        self.sample_labels = sample_labels.astype(np.int64)
+
+    def fit(self, crops: List[np.ndarray]) -> None:
+        """
+        Fit the classifier model on a list of image crops.
+
+        Args:
+            crops (List[np.ndarray]): List of image crops.
+        """
+        features = self.extract_features(crops)
+        projections = self.project(features, fit=True)
+        cluster_model = self.create_cluster_model().fit(projections)
+        self.centroids = cluster_model.cluster_centers_
+        self.counts = np.bincount(cluster_model.labels_, minlength=2).astype(np.float64)
+        self.spread = float(self._distances(projections).min(axis=1).mean())
+        self.sample = None
+        self.sample_labels = None
+        self._add_to_sample(features, cluster_model.labels_)
+
+    def partial_fit(self, crops: List[np.ndarray]) -> bool:
+        """
+        Update the fitted centroids with new crops, moving each centroid to the
+        running mean of the samples assigned to it.
+
+        Args:
+            crops (List[np.ndarray]): List of image crops.
+
+        Returns:
+            bool: False, without updating anything, when the crops are too far from
+                the fitted centroids (for example a different match) and the
+                classifier should be fitted again instead.
+        """
+        if len(crops) == 0:
+            return True
+
+        features = self.extract_features(crops)
+        projections = self.project(features)
+        distances = self._distances(projections)
+        if distances.min(axis=1).mean() > self.drift_factor * max(self.spread, 1e-6):
+            return False
+
+        labels = distances.argmin(axis=1)
+        for team in (0, 1):
+            members = projections[labels == team]
+            if len(members) == 0:
+                continue
+            total = self.counts[team] + len(members)
+            self.centroids[team] += (members.sum(axis=0)
+                                     - len(members) * self.centroids[team]) / total
+            self.counts[team] = total
+        self._add_to_sample(features, labels)
+        return True
+
+    def predict(
+        self,
+        crops: List[np.ndarray],
+        keys: Optional[List[Hashable]] = None
+    ) -> np.ndarray:
+        """
+        Predict the cluster labels for a list of image crops.
+
+        Args:
+            crops (List[np.ndarray]): List of image crops.
+            keys (Optional[List[Hashable]]): Feature cache keys of the crops, for
+                example from `tracker_keys`.
+
+        Returns:
+            np.ndarray: Predicted cluster labels.
+        """
+        if len(crops) == 0:
+            return np.array([])
+
+        projections = self.project(self.extract_features(crops, keys))
+        return self._distances(projections).argmin(axis=1)
+
+    def get_state(self) -> Dict[str, np.ndarray]:
+        """
+        Export the fitted state as a dictionary of arrays.
+        """
+        return {
+            'strategy': np.array(str(self.strategy)),
+            'centroids': self.centroids,
+            'counts': self.counts,
+            'spread': np.array(self.spread),
+            'sample': self.sample,
+            'sample_labels': self.sample_labels,
+        }
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
+        """
+        Restore a state exported by `get_state`.
+
+        Raises:
+            ValueError: If the state was fitted with another strategy.
+            KeyError: If the state misses an array, for example an archive written
+                by an older version.
+        """
+        if str(state['strategy']) != str(self.strategy):
+            raise ValueError(
+                f"Cannot load a {state['strategy']} team model into {self.strategy}")
+        self.centroids = np.array(state['centroids'], dtype=np.float64)
+        self.counts = np.array(state['counts'], dtype=np.float64)
+        self.spread = float(state['spread'])
+        self.sample = np.array(state['sample'])
+        self.sample_labels = np.array(state['sample_labels'], dtype=np.int64)
+
+
+class TeamClassifier(CentroidTeamClassifier):
     """
     A classifier that uses a pre-trained SiglipVisionModel for feature extraction,
     UMAP for dimensionality reduction, and KMeans for clustering.
     """
-    def __init__(self, device: str = 'cpu', batch_size: int = 32):
+    strategy = TeamStrategy.SIGLIP
+
+    def __init__(
+        self,
+        device: str = 'cpu',
+        batch_size: int = 32,
+        backend: Optional[Backend] = None,
+        cache_size: int = 4096
+    ):
         """
        Initialize the TeamClassifier with device and batch size.
 
        Args:
            device (str): The device to run the model on ('cpu' or 'cuda').
            batch_size (int): The batch size for processing images.
+           backend (Optional[Backend]): Runtime of the SigLIP encoder. Defaults to
+               the `INFERENCE_BACKEND` environment variable.
+           cache_size (int): Number of crop embeddings kept in the LRU cache.
+               0 disables the cache.
        """
+        super().__init__()
         self.device = device
         self.batch_size = batch_size
-        self.features_model = SiglipVisionModel.from_pretrained(
-            SIGLIP_MODEL_PATH).to(device)
-        self.processor = AutoProcessor.from_pretrained(SIGLIP_MODEL_PATH)
+        # umap is slow to import, only pay for it when this strategy is used
+        import umap
+
+        self.features_model = load_siglip_encoder(
+            SIGLIP_MODEL_PATH, device=device, backend=backend)
+        self.cache = EmbeddingCache(cache_size) if cache_size > 0 else None
+        self.pixel_values = np.empty(
+            (batch_size, 3, SIGLIP_IMAGE_SIZE, SIGLIP_IMAGE_SIZE), dtype=np.float32)
         self.reducer = umap.UMAP(n_components=3)
-        self.cluster_model = KMeans(n_clusters=2)
 
-    def extract_features(self, crops: List[np.ndarray]) -> np.ndarray:
+    def embed(self, crops: List[np.ndarray]) -> np.ndarray:
+        """
+        Embed crops with the SigLIP encoder, bypassing the cache.
+
+        Args:
+            crops (List[np.ndarray]): List of image crops.
+
+        Returns:
+            np.ndarray: Embeddings of the crops.
+        """
+        data = []
+        for batch in create_batches(crops, self.batch_size):
+            pixel_values = preprocess_crops(batch, out=self.pixel_values)
+            data.append(self.features_model(pixel_values))
+        return np.concatenate(data)
+
+    def extract_features(
+        self,
+        crops: List[np.ndarray],
+        keys: Optional[List[Hashable]] = None
+    ) -> np.ndarray:
         """
         Extract features from a list of image crops using the pre-trained
             SiglipVisionModel.
 
         Args:
             crops (List[np.ndarray]): List of image crops.
+            keys (Optional[List[Hashable]]): Embedding cache keys of the crops, for
+                example from `tracker_keys`. Defaults to `crop_hash`.
 
         Returns:
             np.ndarray: Extracted features as a numpy array.
         """
-        crops = [sv.cv2_to_pillow(crop) for crop in crops]
-        batches = create_batches(crops, self.batch_size)
+        if self.cache is None:
+            return self.embed(crops)
 
-        data = []
-        with torch.no_grad():
-            for batch in batches:
-                inputs = self.processor(
-                    images=batch, return_tensors="pt").to(self.device)
-                outputs = self.features_model(**inputs)
-                embeddings = torch.mean(outputs.last_hidden_state, dim=1).cpu().numpy()
-                data.append(embeddings)
+        if keys is None:
+            keys = [crop_hash(crop) for crop in crops]
 
-        return np.concatenate(data)
+        cached = [self.cache.get(key) for key in keys]
+        missing = [i for i, embedding in enumerate(cached) if embedding is None]
+        if missing:
+            embeddings = self.embed([crops[i] for i in missing])
+            for i, embedding in zip(missing, embeddings):
+                self.cache.put(keys[i], embedding)
+                cached[i] = embedding
 
-    def fit(self, crops: List[np.ndarray]) -> None:
+        return np.stack(cached)
+
+    def project(self, features: np.ndarray, fit: bool = False) -> np.ndarray:
+        if fit:
+            return self.reducer.fit_transform(features)
+        return self.reducer.transform(features)
+
+    def set_state(self, state: Dict[str, np.ndarray]) -> None:
         """
-        Fit the classifier model on a list of image crops.
+        Restore a state exported by `get_state`.
+
+        The UMAP reducer is not persisted: it is refitted on the feature sample, and
+        the centroids and spread are recomputed from the sample in the new
+        projection, so that the team ids of the state are kept.
+
+        Raises:
+            ValueError: If the state was fitted with another strategy, or its sample
+                does not hold both teams.
+            KeyError: If the state misses an array.
+        """
+        import umap
+
+        super().set_state(state)
+        labels = self.sample_labels
+        if not all((labels == team).any() for team in (0, 1)):
+            raise ValueError("The team model sample does not hold both teams")
+        # seeded so that every job restoring the state gets the same projection
+        self.reducer = umap.UMAP(n_components=3, random_state=0)
+        projections = self.reducer.fit_transform(self.sample.astype(np.float32))
+        self.centroids = np.stack(
+            [projections[labels == team].mean(axis=0) for team in (0, 1)]).astype(np.float64)
+        self.spread = float(self._distances(projections).min(axis=1).mean())
+
+
+class ColorTeamClassifier(CentroidTeamClassifier):
+    """
+    A lightweight classifier that describes each crop by the HSV histogram of its
+    torso region, ignoring grass-colored pixels, and clusters the histograms with
+    MiniBatchKMeans.
+    """
+    strategy = TeamStrategy.COLOR
+
+    TORSO = (0.15, 0.5, 0.2, 0.8)  # top, bottom, left, right as crop fractions
+    BINS = (16, 4, 4)  # hue, saturation, value
+    GRASS_HUE = (35, 85)
+
+    def __init__(self, batch_size: int = 256):
+        """
+        Initialize the ColorTeamClassifier.
 
         Args:
-            crops (List[np.ndarray]): List of image crops.
+            batch_size (int): Mini-batch size of the KMeans fit.
         """
-        data = self.extract_features(crops)
-        projections = self.reducer.fit_transform(data)
-        self.cluster_model.fit(projections)
+        super().__init__()
+        self.batch_size = batch_size
+
+    def create_cluster_model(self):
+        return MiniBatchKMeans(n_clusters=2, batch_size=self.batch_size, n_init=3)
 
-    def predict(self, crops: List[np.ndarray]) -> np.ndarray:
+    def histogram(self, crop: np.ndarray) -> np.ndarray:
         """
-        Predict the cluster labels for a list of image crops.
+        Compute the normalized HSV histogram of the torso region of a crop.
+
+        Args:
+            crop (np.ndarray): BGR image crop.
+
+        Returns:
+            np.ndarray: Flattened histogram, square rooted and L2 normalized so that
+                euclidean distances approximate the Hellinger distance.
+        """
+        size = int(np.prod(self.BINS))
+        if crop.size == 0:
+            return np.zeros(size, dtype=np.float32)
+
+        h, w = crop.shape[:2]
+        top, bottom, left, right = self.TORSO
+        torso = crop[int(h * top):max(int(h * bottom), int(h * top) + 1),
+                     int(w * left):max(int(w * right), int(w * left) + 1)]
+        hsv = cv2.cvtColor(torso, cv2.COLOR_BGR2HSV)
+        grass = cv2.inRange(
+            hsv, (self.GRASS_HUE[0], 60, 40), (self.GRASS_HUE[1], 255, 255))
+        mask = cv2.bitwise_not(grass)
+        if cv2.countNonZero(mask) == 0:
+            mask = None
+
+        histogram = cv2.calcHist(
+            [hsv], [0, 1, 2], mask, list(self.BINS), [0, 180, 0, 256, 0, 256])
+        histogram = np.sqrt(histogram.flatten())
+        norm = np.linalg.norm(histogram)
+        return (histogram / norm if norm > 0 else histogram).astype(np.float32)
+
+    def extract_features(
+        self,
+        crops: List[np.ndarray],
+        keys: Optional[List[Hashable]] = None
+    ) -> np.ndarray:
+        """
+        Extract color histograms from a list of image crops.
 
         Args:
             crops (List[np.ndarray]): List of image crops.
+            keys (Optional[List[Hashable]]): Unused, histograms are cheaper to
+                compute than to cache.
 
         Returns:
-            np.ndarray: Predicted cluster labels.
+            np.ndarray: Extracted features as a numpy array.
         """
-        if len(crops) == 0:
-            return np.array([])
+        return np.stack([self.histogram(crop) for crop in crops])
+
+
+def create_team_classifier(
+    strategy: Optional[Union[str, TeamStrategy]] = None,
+    device: str = 'cpu',
+    batch_size: int = 32,
+    backend: Optional[Backend] = None
+) -> CentroidTeamClassifier:
+    """
+    Create a team classifier for the given strategy.
+
+    Args:
+        strategy (Optional[Union[str, TeamStrategy]]): SIGLIP or COLOR. Defaults to
+            the `TEAM_CLASSIFIER_STRATEGY` environment variable.
+        device (str): The device to run the model on ('cpu' or 'cuda').
+        batch_size (int): The batch size for processing images.
+        backend (Optional[Backend]): Runtime of the SigLIP encoder.
+
+    Returns:
+        CentroidTeamClassifier: The unfitted classifier.
+    """
+    strategy = TeamStrategy(str(strategy or DEFAULT_TEAM_STRATEGY).upper())
+    if strategy == TeamStrategy.COLOR:
+        return ColorTeamClassifier()
+    return TeamClassifier(device=device, batch_size=batch_size, backend=backend)
+
+
+class GoalkeeperTeamResolver:
+    """
+    Assign goalkeepers to the team whose players are closest on average.
+
+    Team centroids are running averages of the player positions, so a frame where
+    one team is out of view keeps the last known centroid instead of producing
+    NaN. Every confident assignment is a vote for the goalkeeper's tracker id and
+    the team with the most votes wins, so a goalkeeper does not flip teams when
+    the players move up the pitch.
+
+    Attributes:
+        momentum (float): Weight of the previous centroids in the running average.
+        centroids (np.ndarray): Centroids of team 0 and 1, NaN until first seen.
+        votes (Dict[int, np.ndarray]): Team votes per goalkeeper tracker id.
+    """
+
+    def __init__(self, momentum: float = 0.8):
+        self.momentum = momentum
+        self.centroids = np.full((2, 2), np.nan)
+        self.votes: Dict[int, np.ndarray] = {}
+
+    def update(self, players_xy: np.ndarray, players_team_id: np.ndarray) -> None:
+        """
+        Update the team centroids with the players of a frame. Players without a
+        position (NaN) are ignored.
+        """
+        visible = np.isfinite(players_xy).all(axis=1)
+        for team in (0, 1):
+            xy = players_xy[visible & (players_team_id == team)]
+            if len(xy) == 0:
+                continue
+            if np.isnan(self.centroids[team]).any():
+                self.centroids[team] = xy.mean(axis=0)
+            else:
+                self.centroids[team] = (self.momentum * self.centroids[team]
+                                        + (1 - self.momentum) * xy.mean(axis=0))
+
+    def resolve(
+        self,
+        players_xy: np.ndarray,
+        players_team_id: np.ndarray,
+        goalkeepers_xy: np.ndarray,
+        goalkeepers_tracker_id: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """
+        Resolve the team IDs of the goalkeepers of a frame.
+
+        Args:
+            players_xy (np.ndarray): (N, 2) player positions.
+            players_team_id (np.ndarray): (N,) team IDs of the players.
+            goalkeepers_xy (np.ndarray): (M, 2) goalkeeper positions.
+            goalkeepers_tracker_id (Optional[np.ndarray]): (M,) tracker ids of the
+                goalkeepers. None resolves every goalkeeper independently.
 
-        data = self.extract_features(crops)
-        projections = self.reducer.transform(data)
-        return self.cluster_model.predict(projections)
+        Returns:
+            np.ndarray: (M,) team IDs of the goalkeepers.
+        """
+        self.update(players_xy, players_team_id)
+        if len(goalkeepers_xy) == 0:
+            return np.array([], dtype=int)
+
+        distances = np.linalg.norm(
+            goalkeepers_xy[:, None, :] - self.centroids[None, :, :], axis=2)
+        # only vote when both teams and the goalkeeper are located
+        confident = np.isfinite(distances).all(axis=1)
+        team_id = np.where(np.isnan(distances), np.inf, distances).argmin(axis=1)
+        if goalkeepers_tracker_id is None:
+            return team_id
+
+        for i, tracker_id in enumerate(goalkeepers_tracker_id):
+            votes = self.votes.setdefault(int(tracker_id), np.zeros(2))
+            if confident[i]:
+                votes[team_id[i]] += 1
+            if votes.any():
+                team_id[i] = votes.argmax()
+        return team_id
+
+
+class TeamModelStore:
+    """
+    Fitted team models persisted per video, as compressed `.npz` archives under
+    `<directory>/<project_id>/<video_id>.npz`.
+
+    Attributes:
+        directory (Path): Root directory of the store.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+
+    def path(self, project_id: str, video_id: str) -> Path:
+        return self.directory / str(project_id) / f"{video_id}.npz"
+
+    def save(
+        self,
+        classifier: CentroidTeamClassifier,
+        project_id: str,
+        video_id: str
+    ) -> Path:
+        """
+        Persist the fitted state of a classifier.
+
+        Returns:
+            Path: Path of the written archive.
+        """
+        path = self.path(project_id, video_id)
+        path.parent.mkdir(exist_ok=True, parents=True)
+        # write next to the target and rename, parallel jobs never read half a file:
+        # the temporary name does not end in .npz so `latest` never lists it, and
+        # numpy is given the handle so that it does not append the suffix
+        tmp = path.parent / f"{path.name}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as file:
+            np.savez_compressed(file, **classifier.get_state())
+        tmp.replace(path)
+        return path
+
+    def _load(self, path: Path) -> Optional[Dict[str, np.ndarray]]:
+        # a corrupt or unreadable archive is skipped rather than failing the job
+        try:
+            with np.load(path, allow_pickle=False) as archive:
+                return {key: archive[key] for key in archive.files}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            warnings.warn(f"Could not load the team model {path}: {e}")
+            return None
+
+    def load(
+        self,
+        project_id: str,
+        video_id: str,
+        strategy: TeamStrategy
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Load the model fitted on a video, if any.
+        """
+        path = self.path(project_id, video_id)
+        if not path.exists():
+            return None
+        state = self._load(path)
+        if state is None or 'strategy' not in state:
+            return None
+        return state if str(state['strategy']) == str(strategy) else None
+
+    def latest(
+        self,
+        project_id: str,
+        strategy: TeamStrategy
+    ) -> Optional[Dict[str, np.ndarray]]:
+        """
+        Load the most recently saved model of a project, used to start a new clip
+        of the same match warm.
+        """
+        project_dir = self.directory / str(project_id)
+        if not project_dir.exists():
+            return None
+        mtimes = []
+        for path in project_dir.glob('*.npz'):
+            try:
+                mtimes.append((path.stat().st_mtime, path))
+            except OSError:
+                # replaced or removed by another job since the listing
+                continue
+        for _, path in sorted(mtimes, reverse=True):
+            state = self._load(path)
+            if state is not None and str(state.get('strategy')) == str(strategy):
+                return state
+        return None
@@ -0,0 +1,299 @@
+import os
+import queue
+import threading
+from enum import Enum
+from fractions import Fraction
+from typing import Generator, Iterator, Optional, Union
+
+import cv2
+import numpy as np
+import supervision as sv
+
+VIDEO_BACKEND = os.getenv("VIDEO_BACKEND", "opencv")
+VIDEO_PRESET = os.getenv("VIDEO_PRESET", "veryfast")
+VIDEO_CRF = int(os.getenv("VIDEO_CRF", 23))
+# 0 lets FFmpeg pick the number of threads
+VIDEO_THREADS = int(os.getenv("VIDEO_THREADS", 0))
+# frames decoded ahead of the consumer, in a background thread
+VIDEO_PREFETCH = int(os.getenv("VIDEO_PREFETCH", 4))
+
+
+class VideoBackend(str, Enum):
+    """
+    Enum class representing the libraries videos can be decoded and encoded with.
+    """
+    OPENCV = 'OPENCV'
+    PYAV = 'PYAV'
+
+    def __str__(self):
+        return self.value
+
+
+def resolve_video_backend(backend: Optional[Union[str, VideoBackend]] = None) -> VideoBackend:
+    """
+    Resolve a video backend name, falling back to the `VIDEO_BACKEND` environment
+    variable.
+
+    Raises:
+        ValueError: If the backend does not exist.
+    """
+    return VideoBackend((backend or VIDEO_BACKEND).upper())
+
+
+def _import_av():
+    try:
+        import av
+    except ImportError as e:
+        raise ImportError("The PYAV video backend requires PyAV: pip install av") from e
+    return av
+
+
+class FrameRing:
+    """
+    A fixed set of frame buffers handed out in turn, so that decoding does not
+    allocate a new array per frame.
+
+    A frame returned by `next` is overwritten `size` calls later, consumers that
+    keep frames longer must copy them.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.buffers = []
+        self.index = 0
+
+    def next(self, shape) -> np.ndarray:
+        shape = tuple(shape)
+        slot = self.index % self.size
+        self.index += 1
+        if slot == len(self.buffers):
+            self.buffers.append(np.empty(shape, dtype=np.uint8))
+        elif self.buffers[slot].shape != shape:
+            self.buffers[slot] = np.empty(shape, dtype=np.uint8)
+        return self.buffers[slot]
+
+
+def _read_opencv(
+    source_path: str,
+    stride: int,
+    start: int,
+    end: Optional[int],
+    ring: Optional[FrameRing]
+) -> Generator[np.ndarray, None, None]:
+    video = cv2.VideoCapture(source_path)
+    if not video.isOpened():
+        raise Exception(f"Could not open video at {source_path}")
+    total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+    end = min(end, total_frames) if end is not None else total_frames
+    if start > 0:
+        video.set(cv2.CAP_PROP_POS_FRAMES, start)
+    shape = (
+        int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(video.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+
+    frame_position = start
+    try:
+        while frame_position < end:
+            success, frame = video.read(ring.next(shape) if ring else None)
+            if not success:
+                break
+            yield frame
+            for _ in range(stride - 1):
+                if not video.grab():
+                    return
+            frame_position += stride
+    finally:
+        video.release()
+
+
+def _read_pyav(
+    source_path: str,
+    stride: int,
+    start: int,
+    end: Optional[int]
+) -> Generator[np.ndarray, None, None]:
+    av = _import_av()
+    with av.open(source_path) as container:
+        stream = container.streams.video[0]
+        stream.thread_type = 'AUTO'
+        stream.thread_count = VIDEO_THREADS
+        fps = stream.average_rate or stream.guessed_rate
+        first_pts = stream.start_time or 0
+
+        def frame_index(frame) -> int:
+            return round((frame.pts - first_pts) * stream.time_base * fps)
+
+        if start > 0:
+            # seek to the keyframe before the start timestamp, then decode forward
+            container.seek(
+                first_pts + int(start / fps / stream.time_base),
+                stream=stream, backward=True, any_frame=False)
+
+        for frame in container.decode(stream):
+            index = frame_index(frame) if frame.pts is not None else start
+            if index < start or (index - start) % stride:
+                continue
+            if end is not None and index >= end:
+                break
+            yield frame.to_ndarray(format='bgr24')
+
+
+def _prefetch(generator: Iterator[np.ndarray], size: int) -> Generator[np.ndarray, None, None]:
+    frames = queue.Queue(maxsize=size)
+    done = object()
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        try:
+            for frame in generator:
+                if not put(frame):
+                    return
+            put(done)
+        except Exception as e:
+            put(e)
+        finally:
+            generator.close()
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    try:
+        while True:
+            frame = frames.get()
+            if frame is done:
+                return
+            if isinstance(frame, Exception):
+                raise frame
+            yield frame
+    finally:
+        # a consumer stopping early must not leave the decoder running
+        stop.set()
+        thread.join()
+
+
+def get_video_frames_generator(
+    source_path: str,
+    stride: int = 1,
+    start: int = 0,
+    end: Optional[int] = None,
+    backend: Optional[Union[str, VideoBackend]] = None,
+    reuse_buffers: bool = False,
+    prefetch: Optional[int] = None
+) -> Generator[np.ndarray, None, None]:
+    """
+    Drop-in replacement of `sv.get_video_frames_generator` with a selectable
+    decoder, decoding in a background thread.
+
+    Args:
+        source_path (str): The path of the video file.
+        stride (int): Interval at which frames are returned.
+        start (int): Index of the first frame. The PYAV backend seeks to the
+            closest keyframe by timestamp instead of decoding from the start.
+        end (Optional[int]): Index of the frame to stop at, None for the end.
+        backend (Optional[Union[str, VideoBackend]]): Decoder to use. Defaults to
+            the `VIDEO_BACKEND` environment variable.
+        reuse_buffers (bool): Decode into a small ring of preallocated frames
+            (OPENCV backend, PyAV always returns new arrays). Only for consumers
+            that are done with a frame when they request the next one; crops and
+            other views of a frame are overwritten too.
+        prefetch (Optional[int]): Frames decoded ahead of the consumer. Defaults to
+            the `VIDEO_PREFETCH` environment variable, 0 decodes inline.
+
+    Returns:
+        Generator[np.ndarray, None, None]: A generator of BGR frames.
+    """
+    backend = resolve_video_backend(backend)
+    prefetch = VIDEO_PREFETCH if prefetch is None else prefetch
+    if backend == VideoBackend.PYAV:
+        generator = _read_pyav(source_path, stride, start, end)
+    else:
+        # the frames waiting in the queue, the consumer's, the decoder's and one
+        # spare for consumers comparing a frame with the previous one
+        ring = FrameRing(prefetch + 3) if reuse_buffers else None
+        generator = _read_opencv(source_path, stride, start, end, ring)
+    if prefetch > 0:
+        return _prefetch(generator, prefetch)
+    return generator
+
+
+class VideoSink:
+    """
+    Drop-in replacement of `sv.VideoSink` with a selectable encoder.
+
+    The PYAV backend encodes with multi-threaded libx264 and the `VIDEO_PRESET`
+    and `VIDEO_CRF` settings, the OPENCV backend defers to `sv.VideoSink`.
+
+    Attributes:
+        target_path (str): The path of the output video.
+        video_info (sv.VideoInfo): Resolution and fps of the output video.
+        codec (str): FOURCC code of the OPENCV backend.
+        backend (VideoBackend): The encoder in use.
+    """
+
+    def __init__(
+        self,
+        target_path: str,
+        video_info: sv.VideoInfo,
+        codec: str = "mp4v",
+        backend: Optional[Union[str, VideoBackend]] = None,
+        preset: Optional[str] = None,
+        crf: Optional[int] = None
+    ):
+        self.target_path = str(target_path)
+        self.video_info = video_info
+        self.codec = codec
+        self.backend = resolve_video_backend(backend)
+        self.preset = preset or VIDEO_PRESET
+        self.crf = VIDEO_CRF if crf is None else crf
+        self._sink = None
+        self._container = None
+        self._stream = None
+
+    def __enter__(self):
+        if self.backend == VideoBackend.OPENCV:
+            self._sink = sv.VideoSink(self.target_path, self.video_info, codec=self.codec)
+            self._sink.__enter__()
+            return self
+
+        av = _import_av()
+        self._container = av.open(self.target_path, mode='w')
+        self._stream = self._container.add_stream(
+            'libx264', rate=Fraction(self.video_info.fps).limit_denominator(1001))
+        width, height = self.video_info.resolution_wh
+        # yuv420p needs even dimensions
+        self._stream.width, self._stream.height = width - width % 2, height - height % 2
+        self._stream.pix_fmt = 'yuv420p'
+        self._stream.thread_type = 'AUTO'
+        self._stream.thread_count = VIDEO_THREADS
+        self._stream.options = {'preset': self.preset, 'crf': str(self.crf)}
+        return self
+
+    def write_frame(self, frame: np.ndarray):
+        """
+        Write a BGR frame to the video.
+        """
+        if self._sink is not None:
+            self._sink.write_frame(frame)
+            return
+
+        av = _import_av()
+        frame = frame[:self._stream.height, :self._stream.width]
+        video_frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
+        for packet in self._stream.encode(video_frame):
+            self._container.mux(packet)
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if self._sink is not None:
+            self._sink.__exit__(exc_type, exc_value, exc_traceback)
+            return
+
+        for packet in self._stream.encode():
+            self._container.mux(packet)
+        self._container.close()